@@ -0,0 +1,72 @@
+import multiprocessing
+import os
+import signal
+import socket
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+
+from apps.jobs.queue import claim_job, release_lost_jobs, run_job, run_pending
+
+
+class Command(BaseCommand):
+    help = "Run the queued background jobs with N worker processes, until stopped (SIGINT / SIGTERM)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=2)
+        parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds to wait when the queue is empty")
+        parser.add_argument("--burst", action="store_true", help="Run the due jobs in this process then exit")
+
+    def handle(self, *args, **options):
+        release_lost_jobs()
+        if options["burst"]:
+            count = run_pending(worker=self.worker_name(0))
+            self.stdout.write(self.style.SUCCESS(f"Ran {count} jobs"))
+            return
+
+        # Every worker opens its own database connection
+        connections.close_all()
+        processes = [
+            multiprocessing.Process(target=self.work, args=(index, options["poll_interval"]), daemon=True)
+            for index in range(options["workers"])
+        ]
+        for process in processes:
+            process.start()
+        self.stdout.write(f"Started {len(processes)} workers")
+
+        def stop(signum, frame):
+            for process in processes:
+                if process.is_alive():
+                    os.kill(process.pid, signal.SIGTERM)
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        for process in processes:
+            process.join()
+
+    def worker_name(self, index):
+        return f"{socket.gethostname()}:{os.getpid()}:{index}"
+
+    def work(self, index, poll_interval):
+        stopping = False
+
+        def stop(signum, frame):
+            nonlocal stopping
+            stopping = True
+        # The job being run is finished before the worker exits
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        worker = self.worker_name(index)
+        last_release = time.monotonic()
+        while not stopping:
+            close_old_connections()
+            job = claim_job(worker)
+            if job is None:
+                time.sleep(poll_interval)
+            else:
+                run_job(job)
+            if time.monotonic() - last_release > 60:
+                release_lost_jobs()
+                last_release = time.monotonic()
+        connections.close_all()
@@ -0,0 +1,129 @@
+"""
+A small job queue stored in the database, so side work leaves the request without Redis or a broker.
+
+    @task(priority=5)
+    def send_receipt(order_id):
+        ...
+
+    send_receipt.enqueue(order_id=order.pk)
+
+A job is inserted in the current transaction: workers only see it once the transaction commits and
+it disappears with a rollback. `run_workers` claims the due jobs by priority with a conditional UPDATE,
+so any number of worker processes can share the table, and failed jobs are retried with a backoff.
+"""
+import functools
+import logging
+import traceback
+from datetime import timedelta
+
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from apps.jobs.models import Job
+
+logger = logging.getLogger(__name__)
+
+# A running job not finished after this long is considered lost with its worker and queued again
+LOCK_TIMEOUT = timedelta(minutes=10)
+RETRY_DELAY = timedelta(seconds=10)
+
+
+def task(func=None, *, priority=0, max_attempts=3):
+    """
+    Register a function as a job, it gets an `enqueue(**kwargs)` method.
+    Arguments must be JSON serializable.
+    """
+    if func is None:
+        return functools.partial(task, priority=priority, max_attempts=max_attempts)
+
+    name = f"{func.__module__}.{func.__qualname__}"
+
+    def enqueue(priority=priority, max_attempts=max_attempts, run_at=None, unique=False, **kwargs):
+        return enqueue_job(name, kwargs, priority=priority, max_attempts=max_attempts, run_at=run_at, unique=unique)
+
+    func.job_name = name
+    func.enqueue = enqueue
+    return func
+
+
+def enqueue_job(name, kwargs=None, priority=0, max_attempts=3, run_at=None, unique=False):
+    """
+    Queue a job, with `unique` nothing is queued when the same job is already waiting.
+    """
+    kwargs = kwargs or {}
+    if unique:
+        job = Job.objects.filter(name=name, kwargs=kwargs, status=Job.QUEUED).first()
+        if job is not None:
+            return job
+    return Job.objects.create(
+        name=name, kwargs=kwargs, priority=priority, max_attempts=max_attempts, run_at=run_at or timezone.now(),
+    )
+
+
+def claim_job(worker):
+    """
+    Lock the next due job for `worker`, or returns None when nothing is due.
+    The conditional UPDATE only succeeds for one of the workers racing for the same job.
+    """
+    now = timezone.now()
+    while True:
+        candidates = list(
+            Job.objects.filter(status=Job.QUEUED, run_at__lte=now).values_list("pk", flat=True)[:10]
+        )
+        if not candidates:
+            return None
+        for pk in candidates:
+            claimed = Job.objects.filter(pk=pk, status=Job.QUEUED).update(
+                status=Job.RUNNING, locked_by=worker, locked_at=now, attempts=F("attempts") + 1, updated_at=now,
+            )
+            if claimed:
+                return Job.objects.get(pk=pk)
+
+
+def run_job(job):
+    """
+    Run a claimed job, it is done, queued again with a growing delay, or failed after `max_attempts`.
+    """
+    try:
+        func = import_string(job.name)
+        if getattr(func, "job_name", None) != job.name:
+            raise ValueError(f"{job.name} is not a task")
+        func(**job.kwargs)
+    except Exception:
+        logger.exception("Job %s (%s) failed", job.pk, job.name)
+        job.last_error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            job.status = Job.QUEUED
+            job.run_at = timezone.now() + RETRY_DELAY * 2 ** (job.attempts - 1)
+        else:
+            job.status = Job.FAILED
+    else:
+        job.status = Job.DONE
+        job.last_error = ""
+    job.locked_by, job.locked_at = "", None
+    job.save(update_fields=["status", "run_at", "last_error", "locked_by", "locked_at", "updated_at"])
+    return job
+
+
+def release_lost_jobs():
+    """
+    Queue again the jobs whose worker died while running them
+    """
+    return Job.objects.filter(status=Job.RUNNING, locked_at__lt=timezone.now() - LOCK_TIMEOUT).update(
+        status=Job.QUEUED, locked_by="", locked_at=None, updated_at=timezone.now(),
+    )
+
+
+def run_pending(worker="inline", limit=None):
+    """
+    Run the due jobs until none is left (or `limit` jobs ran), returns the number of jobs run
+    """
+    count = 0
+    while limit is None or count < limit:
+        job = claim_job(worker)
+        if job is None:
+            break
+        run_job(job)
+        count += 1
+    return count
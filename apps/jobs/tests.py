@@ -0,0 +1,94 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase
+from django.utils import timezone
+
+from apps.jobs.models import Job
+from apps.jobs.queue import LOCK_TIMEOUT, claim_job, enqueue_job, release_lost_jobs, run_pending, task
+
+calls = []
+
+
+@task
+def record(value):
+    calls.append(value)
+
+
+@task(max_attempts=2)
+def fail():
+    raise RuntimeError("boom")
+
+
+def not_a_task():
+    calls.append("not a task")
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_jobs_run_by_priority(self):
+        record.enqueue(value="low", priority=-1)
+        record.enqueue(value="first")
+        record.enqueue(value="high", priority=5)
+        record.enqueue(value="second")
+        record.enqueue(value="later", run_at=timezone.now() + timedelta(hours=1))
+
+        self.assertEqual(run_pending(), 4)
+        self.assertEqual(calls, ["high", "first", "second", "low"])
+        self.assertEqual(Job.objects.filter(status=Job.DONE).count(), 4)
+        self.assertEqual(Job.objects.get(status=Job.QUEUED).kwargs, {"value": "later"})
+
+    def test_rolled_back_jobs_are_dropped(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            record.enqueue(value="rolled back")
+            raise RuntimeError
+        self.assertFalse(Job.objects.exists())
+
+    def test_failed_jobs_are_retried_then_failed(self):
+        job = fail.enqueue()
+        run_pending()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+        self.assertIn("boom", job.last_error)
+        self.assertGreater(job.run_at, timezone.now())
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        run_pending()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+
+    def test_only_tasks_are_run(self):
+        job = enqueue_job(f"{__name__}.not_a_task", max_attempts=1)
+        run_pending()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(calls, [])
+
+    def test_unique_jobs(self):
+        first = record.enqueue(value=1, unique=True)
+        self.assertEqual(record.enqueue(value=1, unique=True), first)
+        self.assertNotEqual(record.enqueue(value=2, unique=True), first)
+        self.assertEqual(Job.objects.count(), 2)
+
+    def test_lost_jobs_are_released(self):
+        job = record.enqueue(value=1)
+        self.assertEqual(claim_job("dead worker"), job)
+        self.assertIsNone(claim_job("other worker"))
+        self.assertEqual(release_lost_jobs(), 0)
+
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - LOCK_TIMEOUT - timedelta(seconds=1))
+        self.assertEqual(release_lost_jobs(), 1)
+        self.assertEqual(run_pending(), 1)
+        self.assertEqual(calls, [1])
+
+    def test_run_workers_burst(self):
+        record.enqueue(value="a")
+        record.enqueue(value="b")
+        out = StringIO()
+        call_command("run_workers", "--burst", stdout=out)
+        self.assertIn("Ran 2 jobs", out.getvalue())
+        self.assertEqual(calls, ["a", "b"])
@@ -1,7 +1,27 @@
 from django.apps import apps
 from django.contrib import admin
 
-# Register your models here.
+from apps.orders.models import Order, OrderItem
+
+
+class ReadOnlyAdmin(admin.ModelAdmin):
+    """
+    Orders and their lines are only written through the API: `OrderSerializer` and `OrderViewSet.destroy`
+    keep the order total, the stock, the customer balance and the sales rollup in step, a model save does not.
+    """
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+admin.site.register(Order, ReadOnlyAdmin)
+admin.site.register(OrderItem, ReadOnlyAdmin)
 
 # Register your models here.
 app = apps.get_app_config("orders")
@@ -11,4 +31,4 @@ for model in app.get_models():
     try:
         admin.site.register(model)
     except admin.sites.AlreadyRegistered:
-        pass
\ No newline at end of file
+        pass
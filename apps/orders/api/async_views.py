@@ -0,0 +1,47 @@
+from django.http import Http404
+
+from apps.orders.api.serializers import OrderSerializer
+from apps.orders.api.viewsets import OrderAnalyticsView
+from apps.orders.models import Order
+from config.asyncviews import AsyncAPIView
+
+
+class AsyncOrderListView(AsyncAPIView):
+    """
+    Async version of the `OrderViewSet` list, filtered by `?user=` and paginated with `?limit=` and `?offset=`.
+    """
+    serializer_class = OrderSerializer
+    ordering = ("-created_at", "-id")
+
+    async def get(self, request, *args, **kwargs):
+        queryset = Order.objects.with_details().order_by(*self.ordering)
+        if request.query_params.get("user", "").isdigit():
+            queryset = queryset.filter(user_id=request.query_params["user"])
+        return self.render(await self.paginate(queryset))
+
+
+class AsyncOrderDetailView(AsyncAPIView):
+    """
+    Async version of the `OrderViewSet` retrieve.
+    """
+    serializer_class = OrderSerializer
+
+    async def get(self, request, pk, *args, **kwargs):
+        order = await Order.objects.with_details().filter(pk=pk).afirst()
+        if order is None:
+            raise Http404
+        return self.render(self.serialize(order))
+
+
+class AsyncOrderAnalyticsView(AsyncAPIView):
+    """
+    Async version of `OrderAnalyticsView`, running the same aggregate queries with the async ORM.
+    """
+
+    async def get(self, request, *args, **kwargs):
+        analytics = OrderAnalyticsView()
+        periods = analytics.get_periods()
+        sums = {}
+        for queryset, aggregates in analytics.get_queries(request, periods):
+            sums.update(await queryset.aaggregate(**aggregates))
+        return self.render(analytics.format_sums(periods, sums))
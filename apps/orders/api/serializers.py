@@ -1,15 +1,68 @@
+from collections import Counter
+
 from django.db import transaction
+from django.db.models import prefetch_related_objects
+from django.utils import timezone
 from rest_framework import serializers
 
-from apps.orders.models import Order, OrderItem, UserBalance, BalanceNote
+from apps.orders.models import Order, OrderItem, UserBalance, BalanceNote, DailySalesRollup, order_items_prefetch
 from apps.products.api.serializers import ProductSerializer
+from apps.products.models import Product, OutOfStockError
 from apps.users.api.serializers import UserSerializer
 
 
+class PreloadedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    Resolves the related object from the objects loaded by `PreloadingListSerializer`
+    instead of running one query per item.
+    """
+
+    def to_internal_value(self, data):
+        preloaded = self.context.get("preloaded", {}).get(self.field_name)
+        if preloaded is None:
+            return super().to_internal_value(data)
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            return preloaded[int(data)]
+        except KeyError:
+            self.fail('does_not_exist', pk_value=data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+
+class PreloadingListSerializer(serializers.ListSerializer):
+    """
+    Loads the objects of every `PreloadedPrimaryKeyRelatedField` of the items with one IN query per field,
+    used for both validation and the later processing of the items.
+    """
+
+    def to_internal_value(self, data):
+        preloaded = self.context.setdefault("preloaded", {})
+        for field_name, field in self.child.fields.items():
+            if not isinstance(field, PreloadedPrimaryKeyRelatedField):
+                continue
+            pks = set()
+            if isinstance(data, list):
+                for item in data:
+                    if not isinstance(item, dict):
+                        continue
+                    try:
+                        pks.add(int(item.get(field_name)))
+                    except (TypeError, ValueError):
+                        continue
+            preloaded[field_name] = field.get_queryset().in_bulk(pks)
+        return super().to_internal_value(data)
+
+
 class OrderItemSerializer(serializers.ModelSerializer):
+    product = PreloadedPrimaryKeyRelatedField(queryset=Product.objects.select_related("brand"))
+
     class Meta:
         model = OrderItem
-        fields = "__all__"
+        # The order is the one being written
+        exclude = ("order",)
+        list_serializer_class = PreloadingListSerializer
     def to_representation(self, instance):
         data = super().to_representation(instance)
         data["product"] = ProductSerializer(instance.product).data
@@ -32,22 +85,155 @@ class OrderSerializer(serializers.ModelSerializer):
         return data
 
 
+    def _reserve_stock(self, quantities, order_items):
+        """
+        Take `quantities` out of the stock, an out of stock product fails the lines of `order_items` selling it
+        """
+        try:
+            Product.objects.decrement_stock(quantities)
+        except OutOfStockError as e:
+            raise serializers.ValidationError({"order_items": [
+                {"quantity": [f"المخزون غير كاف، المتاح {e.available[item.product.pk]}"]}
+                if item.product.pk in e.available else {}
+                for item in order_items
+            ]})
+
+    def _add_items(self, order, order_items):
+        for item in order_items:
+            item.order = order
+        OrderItem.objects.bulk_create(order_items)
+
+    def _line_is_unchanged(self, item, item_data):
+        """
+        Whether the request line `item_data` leaves the existing line `item` as it is,
+        the fields the request does not send are kept.
+        """
+        if item.quantity != item_data.get("quantity", 0):
+            return False
+        if "fixed_price" in item_data and item.fixed_price != (item_data["fixed_price"] or item.product.price):
+            return False
+        if "extra_data" in item_data and item.extra_data != {
+                **(item_data["extra_data"] or {}), "product_name": str(item.product)}:
+            return False
+        return True
+
     def create(self, validated_data):
         with transaction.atomic():
             order_items_data = validated_data.pop("order_items", [])  # Extract order_items data
-            order = Order.objects.create(**validated_data)
 
-            # Create OrderItem instances and associate them with the order
+            # Price the items from the already loaded products, nothing is written yet
             order_items = []
+            quantities = Counter()
             for item_data in order_items_data:
-                order_item = OrderItem.objects.create(**item_data)
+                order_item = OrderItem(**item_data)
+                order_item.apply_product_pricing(order_item.product)
                 order_items.append(order_item)
+                quantities[order_item.product.pk] += order_item.quantity
 
-            # Add the created order items to the ManyToMany field
-            order.order_items.set(order_items)
-            order.save()
+            # The total is known before the insert, so the order is written once
+            order = Order.objects.create(total=sum(item.total for item in order_items), **validated_data)
+
+            self._add_items(order, order_items)
+            self._reserve_stock(quantities, order_items)
+
+            if order.amount_to_pay():
+                order.user.userbalance.deposit(order.amount_to_pay(), "orders_total")
+            DailySalesRollup.record_order(order, sum(quantities.values()))
+
+        # Load the new items the way `OrderViewSet.get_queryset` does for the response
+        prefetch_related_objects([order], order_items_prefetch())
         return order
 
+    def update(self, instance, validated_data):
+        """
+        Edit the order in place: only the added, removed or changed lines are written,
+        and the stock, balance and rollup get the net difference.
+        New lines are matched with the existing lines of the same product, in order. A line whose quantity,
+        `fixed_price` or `extra_data` differs gets its total from the current product price like a new line,
+        and keeps its agreed `fixed_price` unless the request sends one (0 is the current product price).
+        """
+        with transaction.atomic():
+            old_items = list(instance.order_items.all())
+            old_user, old_amount = instance.user, instance.amount_to_pay()
+            old_total, old_supplement = instance.total, instance.supplement
+
+            # `lines` are the final items in the order of the request
+            added, changed, removed, lines = [], [], [], []
+            order_items_data = validated_data.pop("order_items", None)
+            if order_items_data is None:
+                lines = old_items
+            else:
+                by_product = {}
+                for item in old_items:
+                    by_product.setdefault(item.product_id, []).append(item)
+                for item_data in order_items_data:
+                    candidates = by_product.get(item_data["product"].pk)
+                    if not candidates:
+                        item = OrderItem(**item_data)
+                        added.append(item)
+                    elif self._line_is_unchanged(candidates[0], item_data):
+                        item = candidates.pop(0)
+                    else:
+                        item = candidates.pop(0)
+                        changed.append((item, item.quantity))
+                        item.quantity = item_data.get("quantity", 0)
+                        if "fixed_price" in item_data:
+                            item.fixed_price = item_data["fixed_price"]
+                        if "extra_data" in item_data:
+                            item.extra_data = item_data["extra_data"]
+                    lines.append(item)
+                removed = [item for items in by_product.values() for item in items]
+
+            # Net stock movement per product, positive is sold and negative is returned
+            quantities = Counter()
+            for item in removed:
+                quantities[item.product_id] -= item.quantity
+            for item in added:
+                quantities[item.product_id] += item.quantity
+            for item, old_quantity in changed:
+                quantities[item.product_id] += item.quantity - old_quantity
+            Product.objects.increment_stock({pk: -quantity for pk, quantity in quantities.items() if quantity < 0})
+            self._reserve_stock({pk: quantity for pk, quantity in quantities.items() if quantity > 0}, lines)
+
+            now = timezone.now()
+            for item, _ in changed:
+                item.apply_product_pricing(item.product)
+                item.updated_at = now
+            for item in added:
+                item.apply_product_pricing(item.product)
+            if removed:
+                OrderItem.objects.filter(pk__in=[item.pk for item in removed]).delete()
+            if changed:
+                OrderItem.objects.bulk_update(
+                    [item for item, _ in changed], ["quantity", "total", "fixed_price", "extra_data", "updated_at"])
+            if added:
+                self._add_items(instance, added)
+
+            for attr, value in validated_data.items():
+                setattr(instance, attr, value)
+            instance.total = sum(item.total for item in lines)
+            instance.save()
+
+            if instance.user_id == old_user.pk:
+                if instance.amount_to_pay() != old_amount:
+                    instance.user.userbalance.deposit(instance.amount_to_pay() - old_amount, "orders_total")
+            else:
+                if old_amount:
+                    old_user.userbalance.deposit(-old_amount, "orders_total")
+                if instance.amount_to_pay():
+                    instance.user.userbalance.deposit(instance.amount_to_pay(), "orders_total")
+            DailySalesRollup.record(
+                timezone.localdate(instance.created_at),
+                products_count=sum(quantities.values()),
+                products_total=instance.total - old_total,
+                supplements_total=instance.supplement - old_supplement,
+            )
+
+        # The prefetched items are stale, load them again for the response
+        instance._prefetched_objects_cache = {}
+        prefetch_related_objects([instance], order_items_prefetch())
+        return instance
+
 
 class UserBalanceSerializer(serializers.ModelSerializer):
     class Meta:
@@ -57,7 +243,10 @@ class UserBalanceSerializer(serializers.ModelSerializer):
 
     def to_representation(self, instance):
         representation = super().to_representation(instance)
-        representation['amount_to_pay'] = instance.amount_to_pay()
+        # The columns only hold the compacted snapshot of the ledger
+        balances = instance.balances()
+        representation.update(balances)
+        representation['amount_to_pay'] = balances['orders_total'] - balances['paid_amount']
         return representation
 
 class UserBalanceDepositSerializer(serializers.Serializer):
@@ -66,6 +255,34 @@ class UserBalanceDepositSerializer(serializers.Serializer):
     note = serializers.CharField(write_only=True, required=False)
 
 
+class OrderSeriesQuerySerializer(serializers.Serializer):
+    start = serializers.DateField()
+    end = serializers.DateField()
+    granularity = serializers.ChoiceField(choices=["hour", "day", "week", "month"], default="day")
+    user = serializers.IntegerField(required=False)
+    product = serializers.IntegerField(required=False)
+    brand = serializers.IntegerField(required=False)
+
+    def validate(self, attrs):
+        if attrs["start"] > attrs["end"]:
+            raise serializers.ValidationError({"end": "end must be after start"})
+        return attrs
+
+
+class UserBalanceDepositBatchRowSerializer(UserBalanceDepositSerializer):
+    user_balance = PreloadedPrimaryKeyRelatedField(queryset=UserBalance.objects.all())
+
+    class Meta:
+        list_serializer_class = PreloadingListSerializer
+
+
+class ExportQuerySerializer(serializers.Serializer):
+    output = serializers.ChoiceField(choices=["csv", "jsonl"], default="csv")
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    user = serializers.IntegerField(required=False)
+
+
 class UserBalanceNoteSerializer(serializers.ModelSerializer):
     class Meta:
         model = BalanceNote
@@ -1,57 +1,89 @@
-from datetime import datetime, time, timedelta
+from datetime import date, datetime, time, timedelta
 
+from django.core.handlers.asgi import ASGIRequest
 from django.db import transaction
-from django.db.models import Sum
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDay, TruncHour, TruncMonth, TruncWeek
+from django.http import StreamingHttpResponse
 from django.utils import timezone
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import filters, viewsets
 from rest_framework import status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.generics import get_object_or_404
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from apps.orders.api.serializers import OrderSerializer, UserBalanceSerializer, UserBalanceDepositSerializer, \
-    UserBalanceNoteSerializer
-from apps.orders.models import Order, UserBalance, OrderItem, BalanceNote
+    UserBalanceNoteSerializer, OrderSeriesQuerySerializer, UserBalanceDepositBatchRowSerializer, ExportQuerySerializer
+from apps.orders.cache import bump_series_version, get_analytics_cache, series_version
+from apps.orders.exports import DATASETS, OUTPUTS, aiter_lines, stream_export
+from apps.orders.models import Order, UserBalance, OrderItem, BalanceNote, DailySalesRollup, BalanceEntry
+from config.changes import record_balance_changes
+from config.conditional import ConditionalGetMixin
+from config.pagination import OffsetOrCursorPagination
 
 
-class OrderViewSet(viewsets.ModelViewSet):
+class OrderViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
     filter_backends = [filters.SearchFilter, filters.OrderingFilter, DjangoFilterBackend, ]
     search_fields = ['name', 'description']
     filterset_fields = ["order_items__product", "user"]
+    pagination_class = OffsetOrCursorPagination
+    ordering = ("-created_at", "-id")
+    # The nested products (price, stock, allow_edit) and user are part of the representation
+    last_modified_fields = ("updated_at", "order_items__product__updated_at", "user__updated_at")
+    # Maximum queries per action whatever the number of orders and items, including the token lookup,
+    # enforced by `QueryBudgetTestMixin` and reported by `QueryCountMiddleware`
+    query_budgets = {"list": 5, "retrieve": 4, "create": 13, "update": 18, "partial_update": 18, "destroy": 11}
+
+    def get_queryset(self):
+        return super().get_queryset().with_details()
 
     def update(self, request, *args, **kwargs):
+        partial = kwargs.pop('partial', False)
         instance = self.get_object()
-        if not instance.user.userbalance.orders_total >= instance.amount_to_pay():
+        if not instance.user.userbalance.balances()["orders_total"] >= instance.amount_to_pay():
             return Response({"error": "You can't edit this order"}, status=status.HTTP_400_BAD_REQUEST)
 
+        serializer = self.get_serializer(instance, data=request.data, partial=partial)
+        serializer.is_valid(raise_exception=True)
         try:
-
-            with transaction.atomic():
-                response = self.create(request, *args, **kwargs)
-                instance.user.userbalance.deposit(-instance.amount_to_pay(), "orders_total")
-                for item in instance.order_items.all():
-                    item.product.stock += item.quantity
-                    item.product.save()
-
-                instance.delete()
-                return response
+            # The order is edited in place, see `OrderSerializer.update`
+            serializer.save()
+            bump_series_version()
+        except ValidationError:
+            raise
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(serializer.data)
 
+    def destroy(self, request, *args, **kwargs):
+        instance = self.get_object()
+        with transaction.atomic():
+            quantities = instance.return_stock()
+            if instance.amount_to_pay():
+                instance.user.userbalance.deposit(-instance.amount_to_pay(), "orders_total")
+            DailySalesRollup.record_order(instance, sum(quantities.values()), sign=-1)
+            instance.delete()
+            bump_series_version()
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
 
 
-class UserBalanceViewSet(viewsets.ModelViewSet):
+class UserBalanceViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     serializer_class = UserBalanceSerializer
     filter_backends = [DjangoFilterBackend, filters.SearchFilter]
     filterset_fields = ['user__id']
+    # Deposits are ledger inserts, they do not touch the balance row
+    last_modified_fields = ("updated_at", "entries__created_at")
+    query_budgets = {"list": 4, "retrieve": 3, "deposit": 10}
+
     def get_queryset(self):
         # Users can only see their own balance
-        return UserBalance.objects.all()
+        return UserBalance.objects.with_pending()
 
     @action(detail=True, methods=['post'], serializer_class=UserBalanceDepositSerializer)
     def deposit(self, request, pk=None):
@@ -65,10 +97,10 @@ class UserBalanceViewSet(viewsets.ModelViewSet):
             note = serializer.validated_data.get('note')
 
             try:
-                user_balance.deposit(amount, balance_type)
-                user_balance.refresh_from_db()
-                BalanceNote.objects.create(user=user_balance.user, amount=amount, note=note)
-                print(user_balance.amount_to_pay())
+                with transaction.atomic():
+                    entry = user_balance.deposit(amount, balance_type)
+                    BalanceNote.objects.create(user=user_balance.user, amount=amount, note=note, entry=entry)
+                user_balance = UserBalance.objects.with_pending().get(pk=user_balance.pk)
                 return Response({
                     'status': 'success',
                     'message': f'{amount} deposited to {balance_type} successfully',
@@ -82,11 +114,59 @@ class UserBalanceViewSet(viewsets.ModelViewSet):
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @action(detail=False, methods=['post'], url_path='deposit-batch',
+            serializer_class=UserBalanceDepositBatchRowSerializer)
+    def deposit_batch(self, request):
+        """
+        Apply many deposits at once, e.g. the end of day payments.
+        The body is a list of {user_balance, amount, balance_type, note} rows,
+        all the rows are validated before any of them is applied and they are applied in one transaction.
+        """
+        serializer = self.get_serializer(data=request.data, many=True, allow_empty=False, max_length=1000)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        rows = serializer.validated_data
+        with transaction.atomic():
+            entries = BalanceEntry.objects.bulk_create([
+                BalanceEntry(user_balance=row['user_balance'], balance=row['balance_type'], amount=row['amount'])
+                for row in rows
+            ])
+            BalanceNote.objects.bulk_create([
+                BalanceNote(user_id=row['user_balance'].user_id, amount=row['amount'], note=row.get('note', ''),
+                            entry=entry)
+                for row, entry in zip(rows, entries)
+            ])
+            record_balance_changes({row['user_balance'].user_id for row in rows})
+
+        balances = {
+            pk: UserBalanceSerializer(user_balance).data
+            for pk, user_balance in UserBalance.objects.with_pending().in_bulk(
+                {row['user_balance'].pk for row in rows}).items()
+        }
+        return Response({
+            'status': 'success',
+            'message': f'{len(rows)} deposits applied successfully',
+            'results': [
+                {
+                    'user_balance': row['user_balance'].pk,
+                    'entry': entry.pk,
+                    'amount': row['amount'],
+                    'balance_type': row['balance_type'],
+                    'balance': balances[row['user_balance'].pk],
+                }
+                for row, entry in zip(rows, entries)
+            ],
+        })
+
 
 class UserBalanceNoteViewSet(viewsets.ModelViewSet):
     serializer_class = UserBalanceNoteSerializer
     filter_backends = [DjangoFilterBackend, filters.SearchFilter]
     filterset_fields = ['user__id']
+    pagination_class = OffsetOrCursorPagination
+    ordering = ("-timestamp", "-id")
+    query_budgets = {"list": 3, "retrieve": 2}
 
     def get_queryset(self):
         # Users can only see their own balance
@@ -98,81 +178,249 @@ class OrderAnalyticsView(APIView):
     Returns analytics for today, this month, and this year periods.
     Analytics include sum of products purchased, sum of supplements, sum of amount to pay,
     and count of users created within each period.
+    The numbers are read from the daily sales rollup, pass `?source=orders` to compute them from the orders.
     """
+    rollup_fields = ("products_count", "products_total", "supplements_total", "users_created")
 
     def get(self, request, *args, **kwargs):
-        # Get current date
-        now = timezone.now()
-        today = now.date()
+        periods = self.get_periods()
+        sums = {}
+        for queryset, aggregates in self.get_queries(request, periods):
+            sums.update(queryset.aggregate(**aggregates))
+        return Response(self.format_sums(periods, sums), status=status.HTTP_200_OK)
 
-        # Define periods
-        # Today period
-        today_start = datetime.combine(today, time.min)
-        today_end = datetime.combine(today, time.max)
+    def get_periods(self):
+        """
+        The periods as (first day, last day)
+        """
+        # Get current date
+        today = timezone.localdate()
 
-        # This month period
-        month_start = datetime(today.year, today.month, 1, 0, 0, 0)
         if today.month == 12:
-            next_month = datetime(today.year + 1, 1, 1, 0, 0, 0)
+            next_month = date(today.year + 1, 1, 1)
         else:
-            next_month = datetime(today.year, today.month + 1, 1, 0, 0, 0)
-        month_end = next_month - timedelta(seconds=1)
-
-        # This year period
-        year_start = datetime(today.year, 1, 1, 0, 0, 0)
-        year_end = datetime(today.year, 12, 31, 23, 59, 59)
+            next_month = date(today.year, today.month + 1, 1)
+        return {
+            "today": (today, today),
+            "this_month": (date(today.year, today.month, 1), next_month - timedelta(days=1)),
+            "this_year": (date(today.year, 1, 1), date(today.year, 12, 31)),
+        }
 
-        # Get user model
-        from django.contrib.auth import get_user_model
-        User = get_user_model()
+    def get_queries(self, request, periods):
+        """
+        The (queryset, aggregates) pairs to evaluate, shared with `AsyncOrderAnalyticsView`
+        """
+        if request.GET.get("source") == "orders":
+            return self._queries_from_orders(periods)
+        return self._queries_from_rollup(periods)
 
-        # Calculate analytics for each period
-        response_data = {
-            "today": self._calculate_analytics(today_start, today_end, User),
-            "this_month": self._calculate_analytics(month_start, month_end, User),
-            "this_year": self._calculate_analytics(year_start, year_end, User)
+    def format_sums(self, periods, sums):
+        return {
+            period: self._format_analytics(**{field: sums[f"{period}__{field}"] or 0 for field in self.rollup_fields})
+            for period in periods
         }
 
-        return Response(response_data, status=status.HTTP_200_OK)
+    def _format_analytics(self, products_count, products_total, supplements_total, users_created):
+        return {
+            "products_count": products_count,
+            "products_total": float(products_total),
+            "supplements_total": float(supplements_total),
+            "amount_to_pay_total": float(products_total + supplements_total),
+            "users_created": users_created,
+        }
 
-    def _calculate_analytics(self, start_datetime, end_datetime, User):
+    def _queries_from_rollup(self, periods):
         """
-        Helper method to calculate analytics for a given period
+        Sum the rollup rows of the year once, with one conditional sum per period and field
         """
-        # Query orders for the period
-        period_orders = Order.objects.filter(
-            created_at__gte=start_datetime,
-            created_at__lte=end_datetime
+        aggregates = {}
+        for period, (first_day, last_day) in periods.items():
+            period_filter = Q(date__gte=first_day, date__lte=last_day)
+            for field in self.rollup_fields:
+                aggregates[f"{period}__{field}"] = Sum(field, filter=period_filter)
+        queryset = DailySalesRollup.objects.filter(
+            date__gte=periods["this_year"][0],
+            date__lte=periods["this_year"][1],
         )
+        return [(queryset, aggregates)]
 
-        # Get the sum of all order totals for the period (excluding supplements)
-        sum_products = period_orders.aggregate(sum=Sum('total'))['sum'] or 0
-
-        # Get the sum of all supplements
-        sum_supplements = period_orders.aggregate(sum=Sum('supplement'))['sum'] or 0
+    def _queries_from_orders(self, periods):
+        """
+        Scan the orders and users of the year once each, every period is a conditional aggregate over the same scan.
+        The order items have no date of their own: a conditional sum would join every item of the year
+        to its order, which costs more than summing the items of each period through an `order_id__in`
+        subquery, as the periods other than the year are short.
+        Periods are half open [first day 00:00, day after the last day 00:00) in the current timezone.
+        """
+        bounds = {
+            period: (
+                timezone.make_aware(datetime.combine(first_day, time.min)),
+                timezone.make_aware(datetime.combine(last_day + timedelta(days=1), time.min)),
+            )
+            for period, (first_day, last_day) in periods.items()
+        }
 
-        # Calculate the total amount to pay (total + supplement)
-        sum_amount_to_pay = sum_products + sum_supplements
+        # Get user model
+        from django.contrib.auth import get_user_model
+        User = get_user_model()
 
-        # Get count of products purchased in the period
-        order_items = OrderItem.objects.filter(
-            order__in=period_orders
-        )
-        products_count = order_items.aggregate(sum=Sum('quantity'))['sum'] or 0
+        return [
+            self._aggregate_periods(
+                Order.objects.all(), "created_at", bounds,
+                products_total=(Sum, "total"), supplements_total=(Sum, "supplement"),
+            ),
+            *(
+                (
+                    OrderItem.objects.filter(
+                        order_id__in=Order.objects.filter(created_at__gte=start, created_at__lt=end).values("pk")
+                    ),
+                    {f"{period}__products_count": Sum("quantity")},
+                )
+                for period, (start, end) in bounds.items()
+            ),
+            self._aggregate_periods(
+                User.objects.filter(deleted=False, is_staff=False), "date_joined", bounds, users_created=(Count, "id"),
+            ),
+        ]
+
+    def _aggregate_periods(self, queryset, date_field, bounds, **fields):
+        """
+        Helper method to compute `fields` for every period in one query,
+        the scan is bounded by the year so it can use the index on `date_field`.
+        """
+        year_start, year_end = bounds["this_year"]
+        aggregates = {}
+        for period, (start, end) in bounds.items():
+            period_filter = Q(**{f"{date_field}__gte": start, f"{date_field}__lt": end})
+            for name, (function, expression) in fields.items():
+                aggregates[f"{period}__{name}"] = function(expression, filter=period_filter)
+        queryset = queryset.filter(**{
+            f"{date_field}__gte": year_start,
+            f"{date_field}__lt": year_end,
+        })
+        return queryset, aggregates
+
+
+class OrderSeriesAnalyticsView(APIView):
+    """
+    API view to return order totals bucketed by hour, day, week or month between `start` and `end` (inclusive days),
+    optionally filtered by `user`, `product` or `brand`.
+    The buckets are computed in one grouped query, closed buckets are cached, see `apps.orders.cache`.
+    """
+    max_buckets = 1000
+    truncs = {"hour": TruncHour, "day": TruncDay, "week": TruncWeek, "month": TruncMonth}
 
-        # Get count of users created in the period
-        users_created = User.objects.filter(
-            date_joined__gte=start_datetime,
-            date_joined__lte=end_datetime,
-            deleted=False,
-            is_staff=False,
-        ).count()
+    def get(self, request, *args, **kwargs):
+        serializer = OrderSeriesQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+        granularity = params["granularity"]
+
+        buckets = self._bucket_bounds(params["start"], params["end"], granularity)
+        if len(buckets) > self.max_buckets:
+            return Response(
+                {"error": f"The range has more than {self.max_buckets} {granularity} buckets"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        cache = get_analytics_cache()
+        version = series_version()
+        filters_key = ":".join(str(params.get(name, "")) for name in ("user", "product", "brand"))
+        keys = {start: f"orders-series:{version}:{granularity}:{filters_key}:{start.isoformat()}" for start, _ in buckets}
+        values = cache.get_many(keys.values())
 
-        # Create the response data for this period
+        now = timezone.now()
+        missing = [(start, end) for start, end in buckets if keys[start] not in values]
+        if missing:
+            computed = self._compute_buckets(missing[0][0], missing[-1][1], granularity, params)
+            closed = {}
+            for start, end in missing:
+                values[keys[start]] = computed.get(start, self._empty_bucket())
+                if end <= now:
+                    closed[keys[start]] = values[keys[start]]
+            cache.set_many(closed)
+
+        return Response({
+            "granularity": granularity,
+            "start": params["start"],
+            "end": params["end"],
+            "buckets": [{"bucket": start, **values[keys[start]]} for start, _ in buckets],
+        }, status=status.HTTP_200_OK)
+
+    def _bucket_bounds(self, first_day, last_day, granularity):
+        """
+        Helper method to list the (start, end) of every bucket, aligned the way the `Trunc*` functions align them
+        """
+        current = datetime.combine(first_day, time.min)
+        if granularity == "week":
+            current -= timedelta(days=current.weekday())
+        elif granularity == "month":
+            current = current.replace(day=1)
+        end = datetime.combine(last_day + timedelta(days=1), time.min)
+
+        bounds = []
+        while current < end and len(bounds) <= self.max_buckets:
+            if granularity == "hour":
+                following = current + timedelta(hours=1)
+            elif granularity == "day":
+                following = current + timedelta(days=1)
+            elif granularity == "week":
+                following = current + timedelta(weeks=1)
+            else:
+                following = (current + timedelta(days=32)).replace(day=1)
+            bounds.append((timezone.make_aware(current), timezone.make_aware(following)))
+            current = following
+        return bounds
+
+    def _compute_buckets(self, start, end, granularity, params):
+        """
+        Helper method to compute every bucket between `start` and `end` in one grouped query
+        """
+        items = OrderItem.objects.filter(order__created_at__gte=start, order__created_at__lt=end)
+        if params.get("user"):
+            items = items.filter(order__user_id=params["user"])
+        if params.get("product"):
+            items = items.filter(product_id=params["product"])
+        if params.get("brand"):
+            items = items.filter(product__brand_id=params["brand"])
+
+        rows = items.annotate(bucket=self.truncs[granularity]("order__created_at")).values("bucket").annotate(
+            orders_count=Count("order", distinct=True),
+            products_count=Sum("quantity"),
+            products_total=Sum("total"),
+        ).order_by("bucket")
         return {
-            "products_count": products_count,
-            "products_total": float(sum_products),
-            "supplements_total": float(sum_supplements),
-            "amount_to_pay_total": float(sum_amount_to_pay),
-            "users_created": users_created,
-        }
\ No newline at end of file
+            row["bucket"]: {
+                "orders_count": row["orders_count"],
+                "products_count": row["products_count"],
+                "products_total": float(row["products_total"]),
+            }
+            for row in rows
+        }
+
+    def _empty_bucket(self):
+        return {"orders_count": 0, "products_count": 0, "products_total": 0.0}
+
+
+class ExportView(APIView):
+    """
+    API view to stream the orders (one row per line), user balances or balance notes
+    as `?output=csv` (default) or `jsonl`, optionally filtered by `start`, `end` (inclusive days) and `user`.
+    The rows are streamed as they are read so the memory stays constant whatever the size of the export,
+    under WSGI and ASGI alike.
+    """
+
+    def get(self, request, dataset, *args, **kwargs):
+        if dataset not in DATASETS:
+            return Response({"error": f"Unknown export: {dataset}"}, status=status.HTTP_404_NOT_FOUND)
+        serializer = ExportQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        params = dict(serializer.validated_data)
+        output = params.pop("output")
+
+        lines = stream_export(dataset, output, **params)
+        if isinstance(request._request, ASGIRequest):
+            lines = aiter_lines(lines)
+        response = StreamingHttpResponse(lines, content_type=OUTPUTS[output])
+        response["Content-Disposition"] = f'attachment; filename="{dataset}.{output}"'
+        return response
@@ -0,0 +1,36 @@
+"""
+Cache of the closed buckets of the order series analytics (`OrderSeriesAnalyticsView`).
+
+Buckets are keyed by a series version counter; editing or deleting an order and moving a product to another
+brand bump the counter once the transaction commits, so stale buckets are never read again.
+The cache backend is the `analytics` alias of `CACHES`: with the "file" backend the counter is shared by the
+workers, with the per-process default another worker keeps its buckets until `ANALYTICS_CACHE_TIMEOUT`.
+"""
+from django.core.cache import caches
+from django.db import transaction
+
+SERIES_VERSION_KEY = "orders-series:version"
+
+
+def get_analytics_cache():
+    return caches["analytics"]
+
+
+def _incr_series_version():
+    cache = get_analytics_cache()
+    try:
+        cache.incr(SERIES_VERSION_KEY)
+    except ValueError:
+        cache.add(SERIES_VERSION_KEY, 0, None)
+        cache.incr(SERIES_VERSION_KEY)
+
+
+def bump_series_version(using=None):
+    """
+    Invalidate every cached series bucket once the current transaction commits
+    """
+    transaction.on_commit(_incr_series_version, using=using)
+
+
+def series_version():
+    return get_analytics_cache().get_or_set(SERIES_VERSION_KEY, 0, None)
@@ -0,0 +1,140 @@
+"""
+Streaming exports of the orders (one row per order line), the user balances and the balance notes.
+
+Rows are read with `values_list()` projections through `QuerySet.iterator()` and written one by one as CSV or
+JSON lines, so the memory used does not depend on the number of exported rows.
+Under ASGI the lines are wrapped with `aiter_lines()`: Django reads a synchronous streaming iterator to the end
+before sending anything there.
+"""
+import csv
+import json
+from datetime import datetime, time, timedelta
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from apps.orders.models import BalanceNote, Order, UserBalance
+
+CHUNK_SIZE = 2000
+OUTPUTS = {"csv": "text/csv", "jsonl": "application/x-ndjson"}
+
+
+def _filter(queryset, date_field, start=None, end=None, user=None):
+    if start:
+        queryset = queryset.filter(**{f"{date_field}__gte": timezone.make_aware(datetime.combine(start, time.min))})
+    if end:
+        end = timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min))
+        queryset = queryset.filter(**{f"{date_field}__lt": end})
+    if user:
+        queryset = queryset.filter(user_id=user)
+    return queryset
+
+
+def _rows(queryset, fields):
+    return queryset.values_list(*fields.values()).iterator(chunk_size=CHUNK_SIZE)
+
+
+ORDER_FIELDS = {
+    "order_id": "id",
+    "created_at": "created_at",
+    "user_id": "user_id",
+    "user_name": "user__first_name",
+    "order_total": "total",
+    "supplement": "supplement",
+    "item_id": "order_items__id",
+    "product_id": "order_items__product_id",
+    "product_name": "order_items__extra_data__product_name",
+    "quantity": "order_items__quantity",
+    "fixed_price": "order_items__fixed_price",
+    "item_total": "order_items__total",
+}
+
+
+def order_rows(start=None, end=None, user=None):
+    orders = _filter(Order.objects.all(), "created_at", start, end, user)
+    return _rows(orders.order_by("created_at", "id", "order_items__id"), ORDER_FIELDS)
+
+
+BALANCE_FIELDS = {
+    "balance_id": "id",
+    "user_id": "user_id",
+    "user_name": "user__first_name",
+    "orders_total": "orders_total",
+    "paid_amount": "paid_amount",
+    "pending_orders_total": "pending_orders_total",
+    "pending_paid_amount": "pending_paid_amount",
+}
+BALANCE_COLUMNS = ["balance_id", "user_id", "user_name", "orders_total", "paid_amount", "amount_to_pay"]
+
+
+def balance_rows(start=None, end=None, user=None):
+    # Balances are a current state, the date range does not apply to them
+    balances = _filter(UserBalance.objects.with_pending(), "updated_at", user=user).order_by("id")
+    for pk, user_id, user_name, orders_total, paid_amount, pending_orders, pending_paid in _rows(
+            balances, BALANCE_FIELDS):
+        orders_total += pending_orders or 0
+        paid_amount += pending_paid or 0
+        yield pk, user_id, user_name, orders_total, paid_amount, orders_total - paid_amount
+
+
+NOTE_FIELDS = {
+    "note_id": "id",
+    "timestamp": "timestamp",
+    "user_id": "user_id",
+    "user_name": "user__first_name",
+    "amount": "amount",
+    "balance_type": "entry__balance",
+    "entry_id": "entry_id",
+    "note": "note",
+}
+
+
+def note_rows(start=None, end=None, user=None):
+    notes = _filter(BalanceNote.objects.all(), "timestamp", start, end, user)
+    return _rows(notes.order_by("timestamp", "id"), NOTE_FIELDS)
+
+
+# dataset: (columns, rows function)
+DATASETS = {
+    "orders": (list(ORDER_FIELDS), order_rows),
+    "balances": (BALANCE_COLUMNS, balance_rows),
+    "notes": (list(NOTE_FIELDS), note_rows),
+}
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def stream_csv(columns, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def stream_jsonl(columns, rows):
+    for row in rows:
+        yield json.dumps(dict(zip(columns, row)), cls=DjangoJSONEncoder, ensure_ascii=False) + "\n"
+
+
+def stream_export(dataset, output="csv", start=None, end=None, user=None):
+    """
+    Yield the lines of `dataset` ("orders", "balances" or "notes") as `output` ("csv" or "jsonl")
+    """
+    columns, rows = DATASETS[dataset]
+    rows = rows(start=start, end=end, user=user)
+    return stream_csv(columns, rows) if output == "csv" else stream_jsonl(columns, rows)
+
+
+async def aiter_lines(lines):
+    """
+    The `lines` of `stream_export` as an async iterator of `CHUNK_SIZE` lines at a time.
+    The lines are read in the thread of the sync view, which holds the database connection and cursor.
+    """
+    read_chunk = sync_to_async(lambda: "".join(islice(lines, CHUNK_SIZE)))
+    while chunk := await read_chunk():
+        yield chunk
@@ -0,0 +1,144 @@
+import json
+import multiprocessing
+import random
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, connections
+from rest_framework.exceptions import ValidationError
+
+from apps.orders.api.serializers import OrderSerializer
+from apps.orders.models import Order
+from apps.products.models import Product
+
+
+class Command(BaseCommand):
+    help = (
+        "Run concurrent reader and writer processes against the database of the current DATABASE_PROFILE "
+        "and report the throughput and latency of each, to compare the profiles. "
+        "The writers create real orders: run it on a database seeded with `seed_benchmark_data`."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--readers", type=int, default=4, help="Reader processes")
+        parser.add_argument("--writers", type=int, default=2, help="Writer processes")
+        parser.add_argument("--duration", type=float, default=10, help="Seconds")
+        parser.add_argument("--output", help="Write the results as JSON to this file")
+        parser.add_argument("--compare", help="Print the change from the results of a previous run")
+
+    def handle(self, *args, **options):
+        self.users = list(get_user_model().objects.filter(is_staff=False).values_list("pk", flat=True)[:500])
+        self.products = list(Product.objects.filter(deleted=False, stock__gte=1000).values_list("pk", flat=True)[:500])
+        self.orders = Order.objects.count()
+        if options["writers"] and (not self.users or not self.products):
+            raise CommandError("No customers or products in stock, run seed_benchmark_data first")
+
+        meta = {"profile": settings.DATABASE_PROFILE, "database": connection.vendor}
+        if connection.vendor == "sqlite":
+            with connection.cursor() as cursor:
+                cursor.execute("PRAGMA journal_mode")
+                meta["journal_mode"] = cursor.fetchone()[0]
+
+        # Every process opens its own connection
+        connections.close_all()
+        results = multiprocessing.Queue()
+        start_at = time.time() + 1
+        processes = [
+            multiprocessing.Process(target=self.work, args=(role, index, start_at, options["duration"], results))
+            for role, count in (("read", options["readers"]), ("write", options["writers"]))
+            for index in range(count)
+        ]
+        for process in processes:
+            process.start()
+        samples = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+
+        report = {"meta": meta, "results": []}
+        self.stdout.write(f"Profile {meta['profile']} ({', '.join(f'{k}={v}' for k, v in meta.items() if k != 'profile')})")
+        for role in ("read", "write"):
+            role_samples = [sample for sample in samples if sample["role"] == role]
+            if not role_samples:
+                continue
+            timings = sorted(timing for sample in role_samples for timing in sample["timings"])
+            result = {
+                "name": role,
+                "processes": len(role_samples),
+                "operations": len(timings),
+                "ops_per_second": round(len(timings) / options["duration"], 1),
+                "p50_ms": round(statistics.median(timings), 3) if timings else None,
+                "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3) if timings else None,
+                "rejected": sum(sample["rejected"] for sample in role_samples),
+                "errors": sum(sample["errors"] for sample in role_samples),
+            }
+            report["results"].append(result)
+            self.stdout.write(
+                f"{role:6} {result['processes']:3} processes {result['ops_per_second']:9.1f} ops/s  "
+                f"p50 {result['p50_ms'] or 0:8.2f} ms  p95 {result['p95_ms'] or 0:8.2f} ms  "
+                f"rejected {result['rejected']}  errors {result['errors']}"
+            )
+
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                json.dump(report, file, indent=2)
+        if options["compare"]:
+            self.compare(options["compare"], report["results"])
+
+    def read(self, rng):
+        # A page of the order list with its items, products and brands, as `OrderViewSet.list` loads it
+        offset = rng.randrange(max(1, self.orders - 20))
+        list(Order.objects.with_details()[offset:offset + 20])
+
+    def write(self, rng):
+        serializer = OrderSerializer(data={
+            "user": rng.choice(self.users),
+            "order_items": [
+                {"product": product, "quantity": 1}
+                for product in rng.sample(self.products, min(len(self.products), rng.randint(1, 5)))
+            ],
+        })
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+    def work(self, role, index, start_at, duration, results):
+        rng = random.Random(f"{role}{index}")
+        operation = self.read if role == "read" else self.write
+        timings, rejected, errors = [], 0, 0
+        time.sleep(max(0, start_at - time.time()))
+        deadline = time.perf_counter() + duration
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                operation(rng)
+            except ValidationError:
+                rejected += 1
+                continue
+            except OperationalError:
+                # "database is locked" when a writer gives up waiting for the lock
+                errors += 1
+                continue
+            timings.append((time.perf_counter() - start) * 1000)
+        connections.close_all()
+        results.put({"role": role, "timings": timings, "rejected": rejected, "errors": errors})
+
+    def compare(self, path, results):
+        with open(path) as file:
+            report = json.load(file)
+        previous = {result["name"]: result for result in report["results"]}
+        self.stdout.write(f"\nChange from {path} ({report['meta']['profile']}):")
+        for result in results:
+            before = previous.get(result["name"])
+            if before is None:
+                continue
+            change = (
+                f"({(result['ops_per_second'] - before['ops_per_second']) / before['ops_per_second']:+7.1%})"
+                if before["ops_per_second"] else ""
+            )
+            self.stdout.write(
+                f"{result['name']:6} {before['ops_per_second']:9.1f} -> {result['ops_per_second']:9.1f} ops/s {change}  "
+                f"p95 {before['p95_ms'] or 0:8.2f} -> {result['p95_ms'] or 0:8.2f} ms  "
+                f"errors {before['errors']} -> {result['errors']}"
+            )
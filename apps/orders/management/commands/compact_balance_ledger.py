@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from apps.orders.models import UserBalance
+
+
+class Command(BaseCommand):
+    help = "Fold the pending balance ledger entries into the balance snapshots, meant to run periodically."
+
+    def handle(self, *args, **options):
+        balances = UserBalance.objects.filter(entries__compacted=False).distinct()
+        compacted = sum(balance.compact() for balance in balances.iterator())
+        self.stdout.write(self.style.SUCCESS(f"Compacted {compacted} ledger entries"))
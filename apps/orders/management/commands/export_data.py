@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from apps.orders.exports import DATASETS, OUTPUTS, stream_export
+
+
+class Command(BaseCommand):
+    help = "Stream the orders (one row per line), user balances or balance notes as CSV or JSON lines."
+
+    def add_arguments(self, parser):
+        parser.add_argument("dataset", choices=list(DATASETS))
+        parser.add_argument("--output", choices=list(OUTPUTS), default="csv")
+        parser.add_argument("--start", help="First day to export (YYYY-MM-DD)")
+        parser.add_argument("--end", help="Last day to export (YYYY-MM-DD)")
+        parser.add_argument("--user", type=int, help="Only export this user id")
+        parser.add_argument("--file", help="Write to this file instead of the standard output")
+
+    def parse_day(self, value):
+        if value is None:
+            return None
+        day = parse_date(value)
+        if day is None:
+            raise CommandError(f"Invalid date: {value}")
+        return day
+
+    def handle(self, *args, **options):
+        lines = stream_export(
+            options["dataset"],
+            options["output"],
+            start=self.parse_day(options["start"]),
+            end=self.parse_day(options["end"]),
+            user=options["user"],
+        )
+        if options["file"]:
+            with open(options["file"], "w", newline="", encoding="utf-8") as file:
+                file.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending="")
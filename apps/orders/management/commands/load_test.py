@@ -0,0 +1,89 @@
+import asyncio
+import json
+import statistics
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        "Send concurrent GET requests to a running server (e.g. daphne) and report the throughput and latency, "
+        "to compare the sync API views with their async versions under the same number of workers."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("urls", nargs="+", help="Absolute URLs, every one is tested separately")
+        parser.add_argument("--token", required=True, help="API token sent as `Authorization: Token ...`")
+        parser.add_argument("--concurrency", type=int, default=50)
+        parser.add_argument("--requests", type=int, default=500, help="Requests per URL")
+        parser.add_argument("--slow-client-ms", type=int, default=0,
+                            help="Wait this long before reading every response, like a client on a slow network")
+        parser.add_argument("--output", help="Write the results as JSON to this file")
+
+    def handle(self, *args, **options):
+        self.options = options
+        results = []
+        for url in options["urls"]:
+            if urlsplit(url).scheme != "http":
+                raise CommandError(f"Only http:// URLs are supported: {url}")
+            result = asyncio.run(self.run(url))
+            results.append(result)
+            self.stdout.write(
+                f"{url:60} {result['rps']:8.1f} req/s  p50 {result['p50_ms']:8.2f} ms  "
+                f"p95 {result['p95_ms']:8.2f} ms  errors {result['errors']}"
+            )
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                json.dump(results, file, indent=2)
+
+    async def fetch(self, url):
+        parts = urlsplit(url)
+        reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+        path = parts.path + (f"?{parts.query}" if parts.query else "")
+        writer.write(
+            f"GET {path} HTTP/1.1\r\nHost: {parts.netloc}\r\nAuthorization: Token {self.options['token']}\r\n"
+            f"Connection: close\r\n\r\n".encode()
+        )
+        await writer.drain()
+        if self.options["slow_client_ms"]:
+            await asyncio.sleep(self.options["slow_client_ms"] / 1000)
+        response = await reader.read()
+        writer.close()
+        await writer.wait_closed()
+        return int(response.split(b" ", 2)[1])
+
+    async def run(self, url):
+        queue = asyncio.Queue()
+        for _ in range(self.options["requests"]):
+            queue.put_nowait(None)
+        timings, errors = [], 0
+
+        async def worker():
+            nonlocal errors
+            while not queue.empty():
+                queue.get_nowait()
+                start = time.perf_counter()
+                try:
+                    status = await self.fetch(url)
+                except (OSError, IndexError, ValueError):
+                    status = None
+                timings.append((time.perf_counter() - start) * 1000)
+                if status != 200:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(self.options["concurrency"])))
+        elapsed = time.perf_counter() - start
+
+        timings.sort()
+        return {
+            "url": url,
+            "concurrency": self.options["concurrency"],
+            "requests": len(timings),
+            "errors": errors,
+            "rps": round(len(timings) / elapsed, 1),
+            "p50_ms": round(statistics.median(timings), 2),
+            "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 2),
+        }
@@ -0,0 +1,71 @@
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from apps.orders.models import DailySalesRollup, Order, OrderItem
+
+
+class Command(BaseCommand):
+    help = "Rebuild the daily sales rollup from the orders and users, for backfills or to fix a drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start", help="First day to rebuild (YYYY-MM-DD), defaults to the first order")
+        parser.add_argument("--end", help="Last day to rebuild (YYYY-MM-DD), defaults to the last order")
+
+    def parse_day(self, value):
+        if value is None:
+            return None
+        day = parse_date(value)
+        if day is None:
+            raise CommandError(f"Invalid date: {value}")
+        return day
+
+    def filter_days(self, queryset, field, start, end):
+        if start:
+            queryset = queryset.filter(**{f"{field}__gte": timezone.make_aware(datetime.combine(start, time.min))})
+        if end:
+            end = timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min))
+            queryset = queryset.filter(**{f"{field}__lt": end})
+        return queryset
+
+    def handle(self, *args, **options):
+        start, end = self.parse_day(options["start"]), self.parse_day(options["end"])
+        rows = defaultdict(dict)
+
+        # One grouped query per table, each returns one row per day
+        orders = self.filter_days(Order.objects.all(), "created_at", start, end)
+        for row in orders.annotate(day=TruncDate("created_at")).values("day").annotate(
+                products_total=Sum("total"), supplements_total=Sum("supplement")).order_by():
+            rows[row["day"]].update(products_total=row["products_total"], supplements_total=row["supplements_total"])
+
+        items = self.filter_days(OrderItem.objects.all(), "order__created_at", start, end)
+        for row in items.annotate(day=TruncDate("order__created_at")).values("day").annotate(
+                products_count=Sum("quantity")).order_by():
+            rows[row["day"]]["products_count"] = row["products_count"]
+
+        users = get_user_model().objects.filter(deleted=False, is_staff=False)
+        users = self.filter_days(users, "date_joined", start, end)
+        for row in users.annotate(day=TruncDate("date_joined")).values("day").annotate(
+                users_created=Count("id")).order_by():
+            rows[row["day"]]["users_created"] = row["users_created"]
+
+        with transaction.atomic():
+            existing = DailySalesRollup.objects.all()
+            if start:
+                existing = existing.filter(date__gte=start)
+            if end:
+                existing = existing.filter(date__lte=end)
+            existing.delete()
+            DailySalesRollup.objects.bulk_create(
+                [DailySalesRollup(date=day, **values) for day, values in rows.items()],
+                batch_size=500,
+            )
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt the sales rollup of {len(rows)} days"))
@@ -0,0 +1,257 @@
+import io
+import json
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from datetime import datetime, time as datetime_time, timedelta
+
+import django
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from apps.orders.api.viewsets import OrderAnalyticsView
+from apps.orders.models import Order, OrderItem, UserBalance
+from config.urls import router
+
+
+class Command(BaseCommand):
+    help = (
+        "Call every API endpoint through the test client against the current database "
+        "and record the p50/p95 latency, the queries per request and the peak memory, "
+        "then run the cases comparing an optimized path with the one it replaced. "
+        "Seed the database with `seed_benchmark_data` first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=20)
+        parser.add_argument("--warmup", type=int, default=2)
+        parser.add_argument("--only", help="Only run the endpoints whose name contains this text")
+        parser.add_argument("--deposits", type=int, default=100,
+                            help="The number of deposits in the single deposits against batch case")
+        parser.add_argument("--cold", action="store_true", help="Clear the caches before every request")
+        parser.add_argument("--output", help="Write the results as JSON to this file")
+        parser.add_argument("--compare", help="Print the change from the results of a previous run")
+
+    def handle(self, *args, **options):
+        user = get_user_model().objects.filter(is_staff=True).first() or get_user_model().objects.first()
+        if user is None:
+            raise CommandError("The database is empty, run seed_benchmark_data first")
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+        self.options = options
+
+        runs = [
+            (name, method, path, lambda method=method, path=path, data=data: self.call(method, path, data).status_code)
+            for name, method, path, data in self.endpoints()
+        ]
+        results = []
+        for name, method, path, run in [*runs, *self.cases()]:
+            if options["only"] and options["only"] not in name:
+                continue
+            result = self.measure(run)
+            result.update(name=name, method=method.upper(), path=path)
+            results.append(result)
+            self.stdout.write(
+                f"{name:45} {result['status']:>4} p50 {result['p50_ms']:8.2f} ms  p95 {result['p95_ms']:8.2f} ms  "
+                f"{result['queries']:4} queries  {result['peak_memory_kb']:9.1f} KiB"
+            )
+
+        report = {"meta": self.meta(), "results": results}
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                json.dump(report, file, indent=2)
+        if options["compare"]:
+            self.compare(options["compare"], results)
+
+    def meta(self):
+        try:
+            commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True).stdout.strip()
+        except OSError:
+            commit = ""
+        return {
+            "commit": commit or None,
+            "created_at": timezone.now().isoformat(),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "database": connection.vendor,
+            "iterations": self.options["iterations"],
+            "cold": self.options["cold"],
+        }
+
+    def request(self, method, path, data):
+        response = getattr(self.client, method)(path, data, format="json")
+        if getattr(response, "streaming", False):
+            b"".join(response.streaming_content)
+        return response
+
+    def call(self, method, path, data):
+        if self.options["cold"]:
+            for cache in caches.all():
+                cache.clear()
+        if method == "get":
+            return self.request(method, path, data)
+        # Writes are rolled back so every iteration runs against the same data
+        with transaction.atomic():
+            response = self.request(method, path, data)
+            transaction.set_rollback(True)
+        return response
+
+    def measure(self, run):
+        """
+        Time `run`, a function returning the HTTP status of what it did
+        """
+        for _ in range(self.options["warmup"]):
+            run()
+
+        timings, queries = [], []
+        for _ in range(self.options["iterations"]):
+            with CaptureQueriesContext(connection) as ctx:
+                start = time.perf_counter()
+                status = run()
+                timings.append((time.perf_counter() - start) * 1000)
+            queries.append(len(ctx.captured_queries))
+
+        # tracemalloc slows everything down, the memory is measured on a separate request
+        tracemalloc.start()
+        try:
+            run()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        timings.sort()
+        return {
+            "status": status,
+            "p50_ms": round(statistics.median(timings), 3),
+            "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+            "mean_ms": round(statistics.mean(timings), 3),
+            "queries": max(queries),
+            "peak_memory_kb": round(peak / 1024, 1),
+        }
+
+    def first_id(self, path):
+        response = self.client.get(path)
+        results = response.data.get("results", []) if isinstance(response.data, dict) else response.data
+        return results[0]["id"] if response.status_code == 200 and results else None
+
+    def endpoints(self):
+        """
+        Yields (name, method, path, data) for the list, detail and extra GET actions of every router viewset,
+        the other API views and a few rolled back writes.
+        """
+        ids = {}
+        for prefix, viewset, basename in router.registry:
+            path = f"/api/{prefix}/"
+            ids[basename] = self.first_id(path)
+            if hasattr(viewset, "list"):
+                yield f"{basename}-list", "get", path, None
+            if hasattr(viewset, "retrieve") and ids[basename] is not None:
+                yield f"{basename}-detail", "get", f"{path}{ids[basename]}/", None
+            for action in viewset.get_extra_actions():
+                if "get" not in action.mapping:
+                    continue
+                if not action.detail:
+                    yield f"{basename}-{action.url_path}", "get", f"{path}{action.url_path}/", None
+                elif ids[basename] is not None:
+                    yield f"{basename}-{action.url_path}", "get", f"{path}{ids[basename]}/{action.url_path}/", None
+
+        today = timezone.localdate()
+        yield "products-search", "get", "/api/products/", {"search": "product 1"}
+        yield "orders-cursor", "get", "/api/orders/", {"pagination": "cursor"}
+        yield "orders-analytics", "get", "/api/orders-analytics/", None
+        yield "orders-analytics-raw", "get", "/api/orders-analytics/", {"source": "orders"}
+        yield "orders-analytics-series", "get", "/api/orders-analytics/series/", {
+            "start": str(today - timedelta(days=90)), "end": str(today)}
+        yield "exports-orders", "get", "/api/exports/orders/", {"start": str(today - timedelta(days=7))}
+
+        products = self.client.get("/api/products/", {"limit": 5}).data["results"]
+        if products:
+            yield "orders-create", "post", "/api/orders/", {
+                "user": ids["users"],
+                "order_items": [{"product": product["id"], "quantity": 1} for product in products],
+            }
+        if ids["user-balance"] is not None:
+            yield "user-balance-deposit", "post", f"/api/user-balance/{ids['user-balance']}/deposit/", {
+                "amount": "10.00", "balance_type": "paid_amount", "note": "benchmark"}
+
+    def cases(self):
+        """
+        Yields (name, method, path, run) for the optimized paths side by side with what they replaced,
+        e.g. `analytics-periods-single-scan` against `analytics-periods-per-query`.
+        """
+        periods = OrderAnalyticsView().get_periods()
+        yield "analytics-periods-per-query", "orm", "OrderAnalyticsView before user-006", (
+            lambda: self.analytics_per_period_queries(periods))
+        yield "analytics-periods-single-scan", "orm", "OrderAnalyticsView._queries_from_orders", (
+            lambda: self.analytics_single_scan(periods))
+
+        balances = list(UserBalance.objects.order_by("pk").values_list("pk", flat=True)[:self.options["deposits"]])
+        if balances:
+            deposits = [{"user_balance": pk, "amount": "10.00", "balance_type": "paid_amount", "note": "benchmark"}
+                        for pk in balances]
+            yield "user-balance-deposit-loop", "post", f"{len(deposits)} x /api/user-balance/<pk>/deposit/", (
+                lambda: self.deposit_one_by_one(deposits))
+            yield "user-balance-deposit-batch", "post", "/api/user-balance/deposit-batch/", (
+                lambda: self.call("post", "/api/user-balance/deposit-batch/", deposits).status_code)
+
+    def analytics_per_period_queries(self, periods):
+        """
+        The raw analytics as computed before they were rewritten as conditional aggregates:
+        separate aggregates per field and an `order__in` subquery, repeated for every period.
+        """
+        User = get_user_model()
+        for first_day, last_day in periods.values():
+            start = timezone.make_aware(datetime.combine(first_day, datetime_time.min))
+            end = timezone.make_aware(datetime.combine(last_day, datetime_time.max))
+            orders = Order.objects.filter(created_at__gte=start, created_at__lte=end)
+            orders.aggregate(sum=Sum("total"))
+            orders.aggregate(sum=Sum("supplement"))
+            OrderItem.objects.filter(order__in=orders).aggregate(sum=Sum("quantity"))
+            User.objects.filter(date_joined__gte=start, date_joined__lte=end, deleted=False, is_staff=False).count()
+        return 200
+
+    def analytics_single_scan(self, periods):
+        for queryset, aggregates in OrderAnalyticsView()._queries_from_orders(periods):
+            queryset.aggregate(**aggregates)
+        return 200
+
+    def deposit_one_by_one(self, deposits):
+        """
+        The deposits of `deposit-batch` as one request each, rolled back together
+        """
+        with transaction.atomic(), redirect_stdout(io.StringIO()):
+            for row in deposits:
+                response = self.request("post", f"/api/user-balance/{row['user_balance']}/deposit/", {
+                    "amount": row["amount"], "balance_type": row["balance_type"], "note": row["note"]})
+                if response.status_code >= 400:
+                    break
+            transaction.set_rollback(True)
+        return response.status_code
+
+    def compare(self, path, results):
+        with open(path) as file:
+            previous = {result["name"]: result for result in json.load(file)["results"]}
+        self.stdout.write(f"\nChange from {path}:")
+        for result in results:
+            before = previous.get(result["name"])
+            if before is None:
+                continue
+            self.stdout.write(
+                f"{result['name']:45} p50 {self.change(before['p50_ms'], result['p50_ms'])}  "
+                f"p95 {self.change(before['p95_ms'], result['p95_ms'])}  "
+                f"queries {before['queries']} -> {result['queries']}"
+            )
+
+    def change(self, before, after):
+        if not before:
+            return f"{after:8.2f} ms"
+        return f"{after:8.2f} ms ({(after - before) / before:+7.1%})"
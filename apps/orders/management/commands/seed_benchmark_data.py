@@ -0,0 +1,156 @@
+import random
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from apps.orders.models import BalanceNote, Order, OrderItem, UserBalance
+from apps.products.cache import bump_catalog_version
+from apps.products.models import Brand, Product
+from apps.products.search import build_search_document, index_products
+
+USERNAME_PREFIX = "bench_"
+
+# Share of the orders placed at every hour of the day, the shop is busy around noon and in the evening
+HOUR_WEIGHTS = [0, 0, 0, 0, 0, 0, 0, 1, 3, 6, 8, 9, 10, 9, 7, 6, 6, 7, 9, 10, 8, 5, 2, 1]
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a synthetic dataset of users, brands, products, orders and balance notes for benchmarks. "
+        "The same options and seed always produce the same data."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--brands", type=int, default=50)
+        parser.add_argument("--products", type=int, default=5000)
+        parser.add_argument("--orders", type=int, default=50000)
+        parser.add_argument("--notes", type=int, default=20000)
+        parser.add_argument("--days", type=int, default=365, help="Spread the orders over this many days")
+        parser.add_argument("--until", help="Last day of the dataset (YYYY-MM-DD), defaults to today")
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--batch-size", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        if get_user_model().objects.filter(username__startswith=USERNAME_PREFIX).exists():
+            raise CommandError("The benchmark data already exists, seed an empty database")
+        until = parse_date(options["until"]) if options["until"] else timezone.localdate()
+        if until is None:
+            raise CommandError(f"Invalid date: {options['until']}")
+
+        self.random = random.Random(options["seed"])
+        self.batch_size = options["batch_size"]
+        self.start = timezone.make_aware(datetime.combine(until - timedelta(days=options["days"] - 1), time.min))
+        self.days = options["days"]
+
+        with transaction.atomic():
+            users = self.create_users(options["users"])
+            products = self.create_products(options["brands"], options["products"])
+            self.create_orders(users, products, options["orders"])
+            self.create_notes(users, options["notes"])
+        call_command("rebuild_sales_rollup", stdout=self.stdout)
+        bump_catalog_version()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {options['users']} users, {options['brands']} brands, {options['products']} products, "
+            f"{options['orders']} orders and {options['notes']} balance notes"
+        ))
+
+    def random_time(self):
+        day = self.start + timedelta(days=self.random.randrange(self.days))
+        hour = self.random.choices(range(24), HOUR_WEIGHTS)[0]
+        return day + timedelta(hours=hour, seconds=self.random.randrange(3600))
+
+    def create_users(self, count):
+        User = get_user_model()
+        users = [
+            User(username=f"{USERNAME_PREFIX}{i}", first_name=f"{USERNAME_PREFIX}{i}", phone=f"07{i:09d}")
+            for i in range(count)
+        ]
+        User.objects.bulk_create(users, batch_size=self.batch_size)
+        # bulk_create skips the signals creating the balances
+        UserBalance.objects.bulk_create([UserBalance(user=user) for user in users], batch_size=self.batch_size)
+        for user in users:
+            user.date_joined = self.random_time()
+        User.objects.bulk_update(users, ["date_joined"], batch_size=self.batch_size)
+        return users
+
+    def create_products(self, brands_count, count):
+        brands = Brand.objects.bulk_create(
+            [Brand(name=f"brand {i}") for i in range(brands_count)], batch_size=self.batch_size)
+        # A few brands carry most of the catalog
+        brand_weights = [1 / (rank + 1) for rank in range(brands_count)]
+        products = []
+        for i in range(count):
+            brand = self.random.choices(brands, brand_weights)[0] if brands and self.random.random() < 0.9 else None
+            product = Product(
+                name=f"product {i}",
+                brand=brand,
+                sku=f"SKU-{i:06d}",
+                description=f"benchmark product {i}" if self.random.random() < 0.5 else None,
+                price=Decimal(str(round(self.random.lognormvariate(3, 1), 2))),
+                stock=self.random.randrange(1000, 100000),
+            )
+            product.search_document = build_search_document(product)
+            products.append(product)
+        Product.objects.bulk_create(products, batch_size=self.batch_size)
+        index_products(products)
+        return products
+
+    def create_orders(self, users, products, count):
+        # Sales follow a long tail: a few customers and products make most of the orders
+        user_weights = [self.random.paretovariate(1.2) for _ in users]
+        product_weights = [self.random.paretovariate(1.1) for _ in products]
+        balances = {balance.user_id: balance for balance in UserBalance.objects.filter(user__in=users)}
+
+        for offset in range(0, count, self.batch_size):
+            orders, lines, dates = [], [], []
+            for _ in range(min(self.batch_size, count - offset)):
+                order = Order(user=self.random.choices(users, user_weights)[0])
+                dates.append(self.random_time())
+                items = []
+                for product in self.random.choices(products, product_weights, k=min(8, int(self.random.expovariate(0.5)) + 1)):
+                    item = OrderItem(product=product, quantity=self.random.randint(1, 5))
+                    item.apply_product_pricing(product)
+                    items.append(item)
+                order.total = sum(item.total for item in items)
+                if self.random.random() < 0.1:
+                    order.supplement = Decimal(self.random.choice([5, 10, 25]))
+                balances[order.user.pk].orders_total += order.amount_to_pay()
+                orders.append(order)
+                lines.append(items)
+
+            Order.objects.bulk_create(orders)
+            for order, items in zip(orders, lines):
+                for item in items:
+                    item.order = order
+            OrderItem.objects.bulk_create([item for items in lines for item in items])
+            # auto_now_add ignores the dates given to bulk_create
+            for order, items, created_at in zip(orders, lines, dates):
+                order.created_at = created_at
+                for item in items:
+                    item.created_at = created_at
+            Order.objects.bulk_update(orders, ["created_at"])
+            OrderItem.objects.bulk_update([item for items in lines for item in items], ["created_at"])
+
+        UserBalance.objects.bulk_update(balances.values(), ["orders_total"], batch_size=self.batch_size)
+
+    def create_notes(self, users, count):
+        balances = {balance.user_id: balance for balance in UserBalance.objects.filter(user__in=users)}
+        notes = []
+        for _ in range(count):
+            user = self.random.choice(users)
+            amount = Decimal(self.random.choice([10, 20, 50, 100, 200, 500]))
+            balances[user.pk].paid_amount += amount
+            notes.append(BalanceNote(user=user, amount=amount, note="دفعة نقدية"))
+        BalanceNote.objects.bulk_create(notes, batch_size=self.batch_size)
+        for note in notes:
+            note.timestamp = self.random_time()
+        BalanceNote.objects.bulk_update(notes, ["timestamp"], batch_size=self.batch_size)
+        UserBalance.objects.bulk_update(balances.values(), ["paid_amount"], batch_size=self.batch_size)
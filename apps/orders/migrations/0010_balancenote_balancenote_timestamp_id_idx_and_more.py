@@ -0,0 +1,20 @@
+# Generated by Django 4.2.17 on 2026-10-18 15:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('orders', '0009_balancenote'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='balancenote',
+            index=models.Index(fields=['timestamp', 'id'], name='balancenote_timestamp_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['created_at', 'id'], name='order_created_at_id_idx'),
+        ),
+    ]
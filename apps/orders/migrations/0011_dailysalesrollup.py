@@ -0,0 +1,26 @@
+# Generated by Django 4.2.17 on 2026-10-18 15:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('orders', '0010_balancenote_balancenote_timestamp_id_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('products_count', models.BigIntegerField(default=0)),
+                ('products_total', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('supplements_total', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('users_created', models.IntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-date'],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.17 on 2026-10-18 16:05
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('orders', '0011_dailysalesrollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userbalance',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.17 on 2026-10-18 15:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('orders', '0012_userbalance_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('balance', models.CharField(choices=[('orders_total', 'orders_total'), ('paid_amount', 'paid_amount')], max_length=20)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('compacted', models.BooleanField(default=False)),
+                ('user_balance', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='entries', to='orders.userbalance')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='balancenote',
+            name='entry',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='note', to='orders.balanceentry'),
+        ),
+        migrations.AddIndex(
+            model_name='balanceentry',
+            index=models.Index(fields=['user_balance', 'compacted'], name='balanceentry_pending_idx'),
+        ),
+    ]
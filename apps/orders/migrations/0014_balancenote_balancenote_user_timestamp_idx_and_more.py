@@ -0,0 +1,20 @@
+# Generated by Django 4.2.17 on 2026-10-18 15:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('orders', '0013_balanceentry'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='balancenote',
+            index=models.Index(fields=['user', 'timestamp'], name='balancenote_user_timestamp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'created_at'], name='order_user_created_at_idx'),
+        ),
+    ]
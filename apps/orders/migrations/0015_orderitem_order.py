@@ -0,0 +1,68 @@
+# Generated by Django 4.2.17 on 2026-10-18 19:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+BATCH_SIZE = 5000
+
+
+def move_links(apps, schema_editor):
+    """
+    Copy the order of every item from the `order_items` join table to `OrderItem.order`,
+    one range of item ids per UPDATE so a large table is not rewritten in a single statement.
+    Items left without an order belonged to deleted orders, they are not reachable anymore and are deleted.
+    """
+    Order = apps.get_model("orders", "Order")
+    OrderItem = apps.get_model("orders", "OrderItem")
+    db = schema_editor.connection.alias
+    links = Order.order_items.through.objects.using(db)
+    items = OrderItem.objects.using(db)
+
+    last = items.order_by("-id").values_list("id", flat=True).first() or 0
+    for start in range(0, last + 1, BATCH_SIZE):
+        items.filter(id__gte=start, id__lt=start + BATCH_SIZE).update(order=Subquery(
+            links.filter(orderitem_id=OuterRef("pk")).order_by("order_id").values("order_id")[:1]
+        ))
+    items.filter(order__isnull=True).delete()
+
+
+def move_links_back(apps, schema_editor):
+    Order = apps.get_model("orders", "Order")
+    OrderItem = apps.get_model("orders", "OrderItem")
+    db = schema_editor.connection.alias
+    Link = Order.order_items.through
+
+    rows = OrderItem.objects.using(db).order_by("id").values_list("id", "order_id")
+    batch = []
+    for item_id, order_id in rows.iterator(chunk_size=BATCH_SIZE):
+        batch.append(Link(order_id=order_id, orderitem_id=item_id))
+        if len(batch) == BATCH_SIZE:
+            Link.objects.using(db).bulk_create(batch)
+            batch = []
+    Link.objects.using(db).bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('orders', '0014_balancenote_balancenote_user_timestamp_idx_and_more'),
+    ]
+
+    operations = [
+        # No reverse accessor until the many to many field named `order_items` is removed
+        migrations.AddField(
+            model_name='orderitem',
+            name='order',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='orders.order'),
+        ),
+        migrations.RunPython(move_links, move_links_back),
+        migrations.RemoveField(
+            model_name='order',
+            name='order_items',
+        ),
+        migrations.AlterField(
+            model_name='orderitem',
+            name='order',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_items', to='orders.order'),
+        ),
+    ]
@@ -1,12 +1,19 @@
 import decimal
+from collections import Counter
 
 from django.contrib.auth import get_user_model
-from django.db import models, transaction
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from apps.products.models import Product
+from config.changes import record_balance_changes
 
 
 # Create your models here.
 
 class OrderItem(models.Model):
+    order = models.ForeignKey("Order", on_delete=models.CASCADE, related_name="order_items")
     product = models.ForeignKey("products.Product", on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -21,78 +28,260 @@ class OrderItem(models.Model):
     class Meta:
         ordering = ["-created_at"]
 
-    def save(self, *args, **kwargs):
-        self.total = self.product.price * self.quantity
+    def apply_product_pricing(self, product):
+        """
+        Fill the price dependent fields of the item from its product.
+        Used by `save` and by the bulk order creation which bypasses `save`.
+        """
+        self.total = product.price * self.quantity
         if self.fixed_price == 0:
-            self.fixed_price = self.product.price
-        self.extra_data["product_name"] = self.product.__str__()
+            self.fixed_price = product.price
+        if self.extra_data is None:
+            self.extra_data = {}
+        self.extra_data["product_name"] = product.__str__()
 
-        self.product.stock -= self.quantity
-        self.product.save()
+    def save(self, *args, **kwargs):
+        self.apply_product_pricing(self.product)
 
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            if self._state.adding:
+                Product.objects.decrement_stock({self.product.pk: self.quantity})
+            super().save(*args, **kwargs)
 
     def amount_to_pay(self):
         return self.total - self.supplement
 
 
+class OrderQuerySet(models.QuerySet):
+    def with_details(self):
+        """
+        Load everything `OrderSerializer` renders (user, items, products and brands)
+        in a fixed number of queries, whatever the number of orders and items.
+        """
+        return self.select_related("user").prefetch_related(order_items_prefetch())
+
+
+def order_items_prefetch():
+    return models.Prefetch("order_items", queryset=OrderItem.objects.select_related("product__brand"))
+
+
 class Order(models.Model):
     user = models.ForeignKey("users.CustomUser", on_delete=models.CASCADE)
     total = models.DecimalField(max_digits=10, decimal_places=2, default=0)
-    order_items = models.ManyToManyField(OrderItem)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     supplement = models.DecimalField(max_digits=20, decimal_places=2, default=0)
 
+    objects = OrderQuerySet.as_manager()
+
     def __str__(self):
         return f"Order {self.id} "
 
     class Meta:
         ordering = ["-created_at"]
-
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        total = sum([item.total for item in self.order_items.all()])
-
-        if not self.total == total:
-            self.total = total
-            self.save()
-            self.user.userbalance.deposit(self.amount_to_pay(), "orders_total")
+        indexes = [
+            models.Index(fields=["created_at", "id"], name="order_created_at_id_idx"),
+            models.Index(fields=["user", "created_at"], name="order_user_created_at_idx"),
+        ]
 
     def amount_to_pay(self):
         return self.total + self.supplement
 
+    def stock_quantities(self):
+        """
+        Quantity sold per product pk in this order.
+        """
+        quantities = Counter()
+        for product_id, quantity in self.order_items.values_list("product_id", "quantity"):
+            quantities[product_id] += quantity
+        return quantities
+
+    def return_stock(self):
+        """
+        Put the stock sold by this order back in a single UPDATE statement.
+        Returns the quantity returned per product pk.
+        """
+        quantities = self.stock_quantities()
+        Product.objects.increment_stock(quantities)
+        return quantities
+
 
 class BalanceNote(models.Model):
     user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE, related_name='notes')
     note = models.TextField()
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     timestamp = models.DateTimeField(auto_now_add=True)
+    entry = models.OneToOneField("BalanceEntry", on_delete=models.SET_NULL, null=True, blank=True,
+                                 related_name="note")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["timestamp", "id"], name="balancenote_timestamp_id_idx"),
+            models.Index(fields=["user", "timestamp"], name="balancenote_user_timestamp_idx"),
+        ]
 
     def __str__(self):
         return f"Note for {self.user.username}'s {self.balance_type} balance: {self.amount}"
 
 
+BALANCE_TYPES = ("orders_total", "paid_amount")
+
+
+class UserBalanceQuerySet(models.QuerySet):
+    def with_pending(self):
+        """
+        Annotate the sum of the not yet compacted ledger entries of every balance type,
+        so the current balances of many rows are read without one query per row.
+        """
+        return self.annotate(**{
+            f"pending_{balance}": models.Sum(
+                "entries__amount", filter=models.Q(entries__compacted=False, entries__balance=balance)
+            )
+            for balance in BALANCE_TYPES
+        })
+
+
 class UserBalance(models.Model):
+    """
+    The balance of a user is a ledger: every deposit appends a `BalanceEntry`.
+    `orders_total` and `paid_amount` are a snapshot of the compacted entries,
+    the current balance is the snapshot plus the entries that are not compacted yet.
+    """
     orders_total = models.DecimalField(max_digits=20, decimal_places=2, default=0)
     paid_amount = models.DecimalField(max_digits=20, decimal_places=2, default=0)
     user = models.OneToOneField("users.CustomUser", on_delete=models.CASCADE)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = UserBalanceQuerySet.as_manager()
 
     def get_user_balances_queryset(self):
         return UserBalance.objects.filter(id=self.id)
 
-    @transaction.atomic(using="default")
     def deposit(self, amount, balance):
         """
-        The balance withdrawal function should be used instead of manually adjusting the balance and saving.
-        When making a withdrawal process, the user will not be able to modify until after it is completed,
-        and the process will not be saved until after its success.
+        The balance deposit function should be used instead of manually adjusting the balance and saving.
+        A deposit is a single insert in the ledger, it does not lock the balance row,
+        so concurrent deposits for the same user do not wait for each other.
+        Returns the created `BalanceEntry`.
         """
-        amount = decimal.Decimal(amount)
-        obj = self.get_user_balances_queryset().select_for_update().get()
-        amount = getattr(obj, balance) + amount
-        setattr(obj, balance, amount)
-        obj.save()
+        if balance not in BALANCE_TYPES:
+            raise ValueError(f"Unknown balance: {balance}")
+        entry = BalanceEntry.objects.create(user_balance=self, balance=balance, amount=decimal.Decimal(amount))
+        record_balance_changes([self.user_id])
+        return entry
+
+    def balances(self):
+        """
+        Current value of every balance type: the snapshot plus the pending entries.
+        Uses the `with_pending` annotations when present, otherwise reads the snapshot and the pending entries
+        again in one statement: a compaction between two reads would count its entries twice or not at all.
+        """
+        pending_fields = [f"pending_{balance}" for balance in BALANCE_TYPES]
+        if all(hasattr(self, field) for field in pending_fields):
+            row = {field: getattr(self, field) for field in [*BALANCE_TYPES, *pending_fields]}
+        else:
+            row = UserBalance.objects.with_pending().values(*BALANCE_TYPES, *pending_fields).get(pk=self.pk)
+        return {balance: row[balance] + (row[f"pending_{balance}"] or 0) for balance in BALANCE_TYPES}
 
     def amount_to_pay(self):
-        return self.orders_total - self.paid_amount
+        balances = self.balances()
+        return balances["orders_total"] - balances["paid_amount"]
+
+    @transaction.atomic(using="default")
+    def compact(self):
+        """
+        Fold the pending ledger entries into the snapshot.
+        The balance row is locked so two compactions can not fold the same entries twice,
+        deposits are not blocked as they never touch the balance row.
+        """
+        obj = self.get_user_balances_queryset().select_for_update().get()
+        entries = list(obj.entries.filter(compacted=False).values_list("id", "balance", "amount"))
+        if not entries:
+            return 0
+        for _, balance, amount in entries:
+            setattr(obj, balance, getattr(obj, balance) + amount)
+        obj.save(update_fields=[*BALANCE_TYPES, "updated_at"])
+        BalanceEntry.objects.filter(id__in=[entry_id for entry_id, _, _ in entries]).update(compacted=True)
+        for balance in BALANCE_TYPES:
+            setattr(self, balance, getattr(obj, balance))
+            # The `with_pending` annotations count the entries folded into the snapshot
+            self.__dict__.pop(f"pending_{balance}", None)
+        return len(entries)
+
+
+class BalanceEntry(models.Model):
+    """
+    An append-only movement of a user balance, see `UserBalance`.
+    """
+    user_balance = models.ForeignKey(UserBalance, on_delete=models.CASCADE, related_name="entries")
+    balance = models.CharField(max_length=20, choices=[(balance, balance) for balance in BALANCE_TYPES])
+    amount = models.DecimalField(max_digits=20, decimal_places=2)
+    created_at = models.DateTimeField(auto_now_add=True)
+    compacted = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user_balance", "compacted"], name="balanceentry_pending_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.amount} to {self.balance} of {self.user_balance.user}"
+
+
+class DailySalesRollup(models.Model):
+    """
+    Sales totals per day, kept up to date when orders are created, edited or deleted and when users join,
+    so the analytics only have to sum a few small rows instead of scanning the orders.
+    Can be rebuilt from the orders with the `rebuild_sales_rollup` command.
+    """
+    date = models.DateField(unique=True)
+    products_count = models.BigIntegerField(default=0)
+    products_total = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    supplements_total = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    users_created = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ["-date"]
+
+    def __str__(self):
+        return f"Sales of {self.date}"
+
+    @classmethod
+    def record(cls, date, **deltas):
+        """
+        Add the given deltas to the row of `date`, creating it when needed.
+        """
+        deltas = {field: value for field, value in deltas.items() if value}
+        if not deltas:
+            return
+        increments = {field: F(field) + value for field, value in deltas.items()}
+        if cls.objects.filter(date=date).update(**increments):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(date=date, **deltas)
+        except IntegrityError:
+            # Another transaction created the row in the meantime
+            cls.objects.filter(date=date).update(**increments)
+
+    @classmethod
+    def record_order(cls, order, products_count, sign=1):
+        """
+        Add an order to the rollup of the day it was created on, or remove it with `sign=-1`.
+        """
+        cls.record(
+            timezone.localdate(order.created_at),
+            products_count=sign * products_count,
+            products_total=sign * order.total,
+            supplements_total=sign * order.supplement,
+        )
+
+    @classmethod
+    def record_user(cls, user, sign=1):
+        """
+        Count a user in the rollup of the day they joined, or remove them with `sign=-1`.
+        Staff users are not counted by the analytics.
+        """
+        if user.is_staff:
+            return
+        cls.record(timezone.localdate(user.date_joined), users_created=sign)
@@ -1,8 +1,10 @@
 from django.contrib.auth import get_user_model
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
-from .models import UserBalance
+from apps.products.models import Brand, Product
+from .cache import bump_series_version
+from .models import UserBalance, DailySalesRollup
 
 
 @receiver(post_save, sender=get_user_model())
@@ -12,3 +14,30 @@ def create_user_balance(sender, instance, created, **kwargs):
     """
     if created:
         UserBalance.objects.create(user=instance)
+
+
+@receiver(post_save, sender=get_user_model())
+def record_user_in_sales_rollup(sender, instance, created, raw=False, **kwargs):
+    """
+    Signal to count a new CustomUser in the daily sales rollup
+    """
+    if created and not raw and not instance.deleted:
+        DailySalesRollup.record_user(instance)
+
+
+@receiver(post_save, sender=Product)
+def invalidate_series_of_moved_product(sender, instance, created, using=None, **kwargs):
+    """
+    Signal to invalidate the cached series buckets when a Product moves to another brand,
+    its past sales move with it in the `brand` series
+    """
+    if not created and instance.brand_changed():
+        bump_series_version(using=using)
+
+
+@receiver(post_delete, sender=Brand)
+def invalidate_series_of_deleted_brand(sender, using=None, **kwargs):
+    """
+    Signal to invalidate the cached series buckets when a Brand is deleted, its products lose their brand
+    """
+    bump_series_version(using=using)
@@ -1,3 +1,867 @@
-from django.test import TestCase
+import json
+import tempfile
+import threading
+import time
+import warnings
+from io import StringIO
+from unittest import skipUnless
 
-# Create your tests here.
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import OperationalError, close_old_connections, connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from apps.orders.api.serializers import OrderSerializer
+from apps.orders.cache import get_analytics_cache
+from apps.orders.exports import CHUNK_SIZE
+from apps.orders.models import BalanceEntry, BalanceNote, DailySalesRollup, Order, OrderItem, UserBalance
+from apps.products.models import Brand, Product, OutOfStockError
+from config.asgi import application
+from config.authentication import get_auth_cache
+from config.querycount import QueryBudgetTestMixin, QueryStats, fingerprint
+
+
+class OrderTestMixin:
+    def setUp(self):
+        get_auth_cache().clear()
+        User = get_user_model()
+        self.staff = User.objects.create(username="staff", first_name="staff", is_staff=True)
+        self.customer = User.objects.create(username="customer", first_name="customer")
+        self.brand = Brand.objects.create(name="brand")
+        self.products = [
+            Product.objects.create(name=f"product {i}", brand=self.brand, price=10, stock=100)
+            for i in range(40)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    def order_payload(self, lines, quantity=1):
+        return {
+            "user": self.customer.pk,
+            "supplement": 0,
+            "order_items": [{"product": product.pk, "quantity": quantity} for product in self.products[:lines]],
+        }
+
+
+class OrderCreateTests(OrderTestMixin, TestCase):
+    def create_order(self, lines):
+        serializer = OrderSerializer(data=self.order_payload(lines, quantity=2))
+        serializer.is_valid(raise_exception=True)
+        with CaptureQueriesContext(connection) as ctx:
+            serializer.save()
+        return len(ctx.captured_queries)
+
+    def test_query_count_does_not_depend_on_lines(self):
+        self.assertEqual(self.create_order(1), self.create_order(40))
+
+    def test_validation_loads_products_once(self):
+        serializer = OrderSerializer(data=self.order_payload(40))
+        with CaptureQueriesContext(connection) as ctx:
+            serializer.is_valid(raise_exception=True)
+        product_queries = [q for q in ctx.captured_queries if 'FROM "products_product"' in q["sql"]]
+        self.assertEqual(len(product_queries), 1)
+
+    def test_create_prices_items_and_updates_stock_and_balance(self):
+        response = self.client.post("/api/orders/", self.order_payload(3, quantity=2), format="json")
+        self.assertEqual(response.status_code, 201, response.data)
+
+        order = Order.objects.get(pk=response.data["id"])
+        self.assertEqual(order.total, 60)
+        self.assertEqual(order.order_items.count(), 3)
+        for item in order.order_items.all():
+            self.assertEqual(item.total, 20)
+            self.assertEqual(item.fixed_price, 10)
+            self.assertEqual(item.extra_data["product_name"], str(item.product))
+        for product in self.products[:3]:
+            product.refresh_from_db()
+            self.assertEqual(product.stock, 98)
+        self.assertEqual(self.customer.userbalance.balances()["orders_total"], 60)
+
+    def test_unknown_product_is_rejected(self):
+        payload = self.order_payload(1)
+        payload["order_items"].append({"product": 0, "quantity": 1})
+        response = self.client.post("/api/orders/", payload, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("order_items", response.data)
+
+
+class OrderAdminTests(OrderTestMixin, TestCase):
+    def test_orders_are_read_only_in_the_admin(self):
+        order = self.client.post("/api/orders/", self.order_payload(2), format="json").data
+        admin_user = get_user_model().objects.create_superuser("admin", first_name="admin", password="admin")
+        client = APIClient()
+        client.force_login(admin_user)
+
+        url = f"/admin/orders/order/{order['id']}/change/"
+        self.assertEqual(client.get(url).status_code, 200)
+        self.assertEqual(client.post(url, {"user": self.customer.pk, "total": 1, "supplement": 0}).status_code, 403)
+        self.assertEqual(client.get("/admin/orders/order/add/").status_code, 403)
+        self.assertEqual(client.get(f"/admin/orders/order/{order['id']}/delete/").status_code, 403)
+        self.assertEqual(Order.objects.get(pk=order["id"]).total, 20)
+
+
+class StockReservationTests(OrderTestMixin, TestCase):
+    def test_oversell_is_refused_per_line(self):
+        Product.objects.filter(pk=self.products[1].pk).update(stock=1)
+        response = self.client.post("/api/orders/", self.order_payload(3, quantity=2), format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data["order_items"][0], {})
+        self.assertIn("quantity", response.data["order_items"][1])
+        self.assertEqual(Order.objects.count(), 0)
+        stocks = dict(Product.objects.filter(pk__in=[p.pk for p in self.products[:3]]).values_list("pk", "stock"))
+        self.assertEqual(stocks, {self.products[0].pk: 100, self.products[1].pk: 1, self.products[2].pk: 100})
+
+    def test_failed_reservation_reserves_nothing(self):
+        with self.assertRaises(OutOfStockError) as ctx:
+            Product.objects.decrement_stock({self.products[0].pk: 5, self.products[1].pk: 500})
+        self.assertEqual(ctx.exception.available, {self.products[1].pk: 100})
+        self.products[0].refresh_from_db()
+        self.assertEqual(self.products[0].stock, 100)
+
+    def test_update_returns_stock_before_reserving(self):
+        Product.objects.filter(pk=self.products[0].pk).update(stock=2)
+        response = self.client.post("/api/orders/", self.order_payload(1, quantity=2), format="json")
+        self.assertEqual(response.status_code, 201, response.data)
+
+        response = self.client.put(f"/api/orders/{response.data['id']}/", self.order_payload(1, quantity=1),
+                                   format="json")
+        self.assertEqual(response.status_code, 200, response.data)
+        self.products[0].refresh_from_db()
+        self.assertEqual(self.products[0].stock, 1)
+
+    def test_destroy_returns_stock_and_balance(self):
+        response = self.client.post("/api/orders/", self.order_payload(2, quantity=3), format="json")
+        response = self.client.delete(f"/api/orders/{response.data['id']}/")
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).stock, 100)
+        self.assertEqual(self.customer.userbalance.balances()["orders_total"], 0)
+        self.assertFalse(OrderItem.objects.exists())
+
+    def test_items_are_read_without_a_join_table(self):
+        response = self.client.post("/api/orders/", self.order_payload(3), format="json")
+        with CaptureQueriesContext(connection) as ctx:
+            detail = self.client.get(f"/api/orders/{response.data['id']}/")
+        self.assertEqual(detail.data["order_items"], response.data["order_items"])
+        self.assertNotIn("order", detail.data["order_items"][0])
+        self.assertFalse(any("orders_order_order_items" in query["sql"] for query in ctx.captured_queries))
+
+
+class StockContentionTests(OrderTestMixin, TransactionTestCase):
+    threads = 8
+    orders_per_thread = 10
+
+    def sell(self, errors):
+        sold = 0
+        try:
+            for _ in range(self.orders_per_thread):
+                while True:
+                    try:
+                        Product.objects.decrement_stock({self.products[0].pk: 1})
+                        sold += 1
+                        break
+                    except OutOfStockError:
+                        break
+                    except OperationalError:
+                        # SQLite reports a locked table instead of waiting, try again
+                        time.sleep(0.001)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            close_old_connections()
+        return sold
+
+    def test_concurrent_sales_never_lose_units_or_oversell(self):
+        stock = self.threads * self.orders_per_thread // 2
+        Product.objects.filter(pk=self.products[0].pk).update(stock=stock)
+        results, errors = [], []
+
+        def worker():
+            results.append(self.sell(errors))
+
+        threads = [threading.Thread(target=worker) for _ in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(sum(results), stock)
+        self.products[0].refresh_from_db()
+        self.assertEqual(self.products[0].stock, 0)
+
+
+@skipUnless(settings.DATABASE_PROFILE == "sqlite", "Only the sqlite profile tunes the connections")
+class DatabaseProfileTests(TransactionTestCase):
+    def test_sqlite_connections_are_tuned(self):
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA busy_timeout")
+            self.assertEqual(cursor.fetchone()[0], 10000)
+            cursor.execute("PRAGMA synchronous")
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+    def test_transactions_take_the_write_lock_when_they_begin(self):
+        with CaptureQueriesContext(connection) as ctx, transaction.atomic():
+            Product.objects.count()
+        self.assertEqual(ctx.captured_queries[0]["sql"], "BEGIN IMMEDIATE")
+
+
+class OrderReadQueryTests(OrderTestMixin, TestCase):
+    def create_orders(self, count, lines=5):
+        for _ in range(count):
+            serializer = OrderSerializer(data=self.order_payload(lines))
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_list_query_count_is_fixed(self):
+        counts = []
+        for page_size in (1, 5, 20):
+            Order.objects.all().delete()
+            self.create_orders(page_size)
+            counts.append(self.count_queries(f"/api/orders/?limit={page_size}"))
+        self.assertEqual(len(set(counts)), 1, counts)
+        self.assertLessEqual(counts[0], 4)
+
+    def test_retrieve_query_count_does_not_depend_on_lines(self):
+        self.create_orders(1, lines=1)
+        self.create_orders(1, lines=40)
+        small, large = Order.objects.order_by("pk")
+        self.assertEqual(self.count_queries(f"/api/orders/{small.pk}/"),
+                         self.count_queries(f"/api/orders/{large.pk}/"))
+
+
+class OrderPaginationTests(OrderTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        for _ in range(7):
+            serializer = OrderSerializer(data=self.order_payload(1))
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+
+    def test_offset_pagination_is_the_default(self):
+        response = self.client.get("/api/orders/?limit=3&offset=3")
+        self.assertEqual(response.data["count"], 7)
+        self.assertEqual(len(response.data["results"]), 3)
+
+    def test_cursor_pagination_walks_every_order_without_count(self):
+        url, seen = "/api/orders/?pagination=cursor&limit=3", []
+        while url:
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(url)
+            self.assertNotIn("count", response.data)
+            self.assertFalse(any("__count" in q["sql"] for q in ctx.captured_queries))
+            seen += [order["id"] for order in response.data["results"]]
+            url = response.data["next"]
+        self.assertEqual(seen, list(Order.objects.order_by("-created_at", "-id").values_list("id", flat=True)))
+
+
+class DailySalesRollupTests(OrderTestMixin, TestCase):
+    def analytics(self, source=None):
+        url = "/api/orders-analytics/" + (f"?source={source}" if source else "")
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_rollup_follows_orders_and_users(self):
+        first = self.client.post("/api/orders/", self.order_payload(3, quantity=2), format="json").data
+        second = self.client.post("/api/orders/", self.order_payload(2), format="json").data
+        self.client.put(f"/api/orders/{first['id']}/", self.order_payload(1, quantity=5), format="json")
+        self.client.delete(f"/api/orders/{second['id']}/")
+        get_user_model().objects.create(username="new", first_name="new")
+
+        rollup = self.analytics()
+        self.assertEqual(rollup, self.analytics(source="orders"))
+        self.assertEqual(rollup["today"]["products_count"], 5)
+        self.assertEqual(rollup["today"]["products_total"], 50)
+        self.assertEqual(rollup["this_year"]["users_created"], 2)
+
+    def test_analytics_reads_rollup_once(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.analytics()
+        self.assertEqual(len(ctx.captured_queries), 1)
+
+    def test_rebuild_matches_incremental_rollup(self):
+        self.client.post("/api/orders/", self.order_payload(4, quantity=3), format="json")
+        self.client.post("/api/orders/", self.order_payload(1), format="json")
+        incremental = list(DailySalesRollup.objects.values())
+
+        DailySalesRollup.objects.all().delete()
+        call_command("rebuild_sales_rollup", stdout=StringIO())
+        rebuilt = list(DailySalesRollup.objects.values())
+        for row in incremental + rebuilt:
+            row.pop("id")
+        self.assertEqual(rebuilt, incremental)
+
+    def test_analytics_from_orders_scan_orders_and_users_once(self):
+        self.client.post("/api/orders/", self.order_payload(2), format="json")
+        with CaptureQueriesContext(connection) as ctx:
+            self.analytics(source="orders")
+        # One scan of the orders, one sum of the items per period and one scan of the users
+        self.assertEqual(len(ctx.captured_queries), 5)
+
+
+class OrderSeriesAnalyticsTests(OrderTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        get_analytics_cache().clear()
+        self.today = timezone.localdate()
+        for days_ago, lines in ((3, 2), (3, 1), (1, 4)):
+            response = self.client.post("/api/orders/", self.order_payload(lines), format="json")
+            Order.objects.filter(pk=response.data["id"]).update(
+                created_at=timezone.now() - timedelta(days=days_ago))
+
+    def series(self, **params):
+        params.setdefault("start", self.today - timedelta(days=4))
+        params.setdefault("end", self.today - timedelta(days=1))
+        response = self.client.get("/api/orders-analytics/series/", params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data["buckets"]
+
+    def test_daily_buckets(self):
+        buckets = self.series()
+        self.assertEqual([bucket["orders_count"] for bucket in buckets], [0, 2, 0, 1])
+        self.assertEqual([bucket["products_count"] for bucket in buckets], [0, 3, 0, 4])
+        self.assertEqual(buckets[1]["products_total"], 30)
+
+    def test_weekly_and_monthly_buckets_line_up_with_the_database(self):
+        for granularity in ("week", "month", "hour"):
+            buckets = self.series(granularity=granularity)
+            self.assertEqual(sum(bucket["products_count"] for bucket in buckets), 7, granularity)
+
+    def test_product_filter(self):
+        buckets = self.series(product=self.products[3].pk)
+        self.assertEqual([bucket["products_count"] for bucket in buckets], [0, 0, 0, 1])
+
+    def test_closed_buckets_are_served_from_cache(self):
+        self.series()
+        with CaptureQueriesContext(connection) as ctx:
+            self.series()
+        self.assertEqual(len(ctx.captured_queries), 0)
+
+    def test_deleting_an_order_invalidates_the_buckets(self):
+        self.series()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f"/api/orders/{Order.objects.order_by('created_at').first().pk}/")
+        self.assertEqual([bucket["orders_count"] for bucket in self.series()], [0, 1, 0, 1])
+
+    def test_moving_a_product_to_another_brand_invalidates_the_buckets(self):
+        self.assertEqual([bucket["products_count"] for bucket in self.series(brand=self.brand.pk)], [0, 3, 0, 4])
+        product = Product.objects.get(pk=self.products[0].pk)
+        product.brand = Brand.objects.create(name="other")
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        self.assertEqual([bucket["products_count"] for bucket in self.series(brand=self.brand.pk)], [0, 1, 0, 3])
+        self.assertEqual([bucket["products_count"] for bucket in self.series(brand=product.brand_id)], [0, 2, 0, 1])
+
+        # Saving the product again keeps the buckets
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        with CaptureQueriesContext(connection) as ctx:
+            self.series(brand=self.brand.pk)
+        self.assertEqual(len(ctx.captured_queries), 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product.brand.delete()
+        self.assertEqual([bucket["products_count"] for bucket in self.series(brand=product.brand_id)], [0, 0, 0, 0])
+
+    def test_range_is_capped(self):
+        response = self.client.get("/api/orders-analytics/series/",
+                                    {"start": "2000-01-01", "end": "2020-01-01", "granularity": "hour"})
+        self.assertEqual(response.status_code, 400)
+
+
+class OrderConditionalGetTests(OrderTestMixin, TestCase):
+    def test_product_changes_change_the_order_validator(self):
+        order = self.client.post("/api/orders/", self.order_payload(2), format="json").data
+        url = f"/api/orders/{order['id']}/"
+        etag = self.client.get(url)["ETag"]
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        Product.objects.filter(pk=self.products[0].pk).update(price=11, updated_at=timezone.now())
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.data["allow_edit"])
+
+    def test_renaming_the_customer_changes_the_order_validator(self):
+        order = self.client.post("/api/orders/", self.order_payload(2), format="json").data
+        url = f"/api/orders/{order['id']}/"
+        etag, list_etag = self.client.get(url)["ETag"], self.client.get("/api/orders/")["ETag"]
+        self.client.patch(f"/api/users/{self.customer.pk}/", {"first_name": "renamed"}, format="json")
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["user"]["first_name"], "renamed")
+        self.assertEqual(self.client.get("/api/orders/", HTTP_IF_NONE_MATCH=list_etag).status_code, 200)
+
+    def test_malformed_pk_is_not_found(self):
+        self.assertEqual(self.client.get("/api/orders/abc/").status_code, 404)
+        self.assertEqual(self.client.get("/api/user-balance/abc/").status_code, 404)
+
+
+class BalanceLedgerTests(OrderTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.balance = self.customer.userbalance
+
+    def test_deposits_are_inserts(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.balance.deposit(10, "paid_amount")
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertTrue(ctx.captured_queries[0]["sql"].startswith("INSERT"))
+
+    def test_balance_is_snapshot_plus_pending_entries(self):
+        self.balance.deposit(100, "orders_total")
+        self.balance.deposit(30, "paid_amount")
+        self.assertEqual(self.balance.compact(), 2)
+        self.balance.deposit(5, "paid_amount")
+
+        self.balance.refresh_from_db()
+        self.assertEqual((self.balance.orders_total, self.balance.paid_amount), (100, 30))
+        self.assertEqual(self.balance.balances(), {"orders_total": 100, "paid_amount": 35})
+        self.assertEqual(UserBalance.objects.with_pending().get(pk=self.balance.pk).amount_to_pay(), 65)
+        self.assertEqual(self.balance.compact(), 1)
+        self.assertEqual(self.balance.compact(), 0)
+        self.assertEqual(self.balance.amount_to_pay(), 65)
+
+    def test_compactions_are_neither_counted_twice_nor_dropped(self):
+        self.balance.deposit(100, "orders_total")
+        loaded = UserBalance.objects.get(pk=self.balance.pk)
+        # Another process folds the entry after the snapshot was loaded
+        UserBalance.objects.get(pk=self.balance.pk).compact()
+        self.assertEqual(loaded.balances()["orders_total"], 100)
+
+        self.balance.deposit(50, "orders_total")
+        annotated = UserBalance.objects.with_pending().get(pk=self.balance.pk)
+        self.assertEqual(annotated.balances()["orders_total"], 150)
+        self.assertEqual(annotated.compact(), 1)
+        self.assertEqual(annotated.balances()["orders_total"], 150)
+
+    def test_deposit_endpoint_attaches_the_note_to_the_entry(self):
+        self.balance.deposit(50, "orders_total")
+        response = self.client.post(f"/api/user-balance/{self.balance.pk}/deposit/",
+                                    {"amount": "20.00", "balance_type": "paid_amount", "note": "cash"}, format="json")
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data["balance"]["amount_to_pay"], 30)
+        note = BalanceNote.objects.get()
+        self.assertEqual((note.entry.balance, note.entry.amount), ("paid_amount", 20))
+
+    def test_compact_command(self):
+        self.balance.deposit(10, "orders_total")
+        call_command("compact_balance_ledger", stdout=StringIO())
+        self.assertFalse(BalanceEntry.objects.filter(compacted=False).exists())
+        self.balance.refresh_from_db()
+        self.assertEqual(self.balance.orders_total, 10)
+
+
+class DepositBatchTests(OrderTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.balances = [self.customer.userbalance] + [
+            get_user_model().objects.create(username=f"c{i}", first_name=f"c{i}").userbalance for i in range(20)
+        ]
+
+    def payload(self, balances, amount="5.00"):
+        return [{"user_balance": balance.pk, "amount": amount, "balance_type": "paid_amount", "note": "cash"}
+                for balance in balances]
+
+    def post(self, payload):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post("/api/user-balance/deposit-batch/", payload, format="json")
+        return response, len(ctx.captured_queries)
+
+    def test_batch_applies_every_row(self):
+        response, _ = self.post(self.payload(self.balances) + self.payload(self.balances[:1]))
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(len(response.data["results"]), 22)
+        self.assertEqual(response.data["results"][0]["balance"]["paid_amount"], 10)
+        self.assertEqual(self.customer.userbalance.balances()["paid_amount"], 10)
+        self.assertEqual(BalanceNote.objects.filter(entry__isnull=False).count(), 22)
+
+    def test_query_count_does_not_depend_on_rows(self):
+        _, small = self.post(self.payload(self.balances[:1]))
+        _, large = self.post(self.payload(self.balances))
+        self.assertEqual(small, large)
+
+    def test_invalid_row_rejects_the_batch(self):
+        payload = self.payload(self.balances[:3])
+        payload[1]["user_balance"] = 0
+        response, _ = self.post(payload)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data[0], {})
+        self.assertIn("user_balance", response.data[1])
+        self.assertFalse(BalanceEntry.objects.exists())
+
+
+class OrderUpdateTests(OrderTestMixin, TestCase):
+    def create_order(self, lines):
+        response = self.client.post("/api/orders/", self.order_payload(lines, quantity=2), format="json")
+        return response.data["id"]
+
+    def edit_first_line(self, order_id, lines, quantity):
+        payload = self.order_payload(lines, quantity=2)
+        payload["order_items"][0]["quantity"] = quantity
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.put(f"/api/orders/{order_id}/", payload, format="json")
+        self.assertEqual(response.status_code, 200, response.data)
+        return response, [q["sql"] for q in ctx.captured_queries]
+
+    def test_edit_keeps_the_order_and_untouched_lines(self):
+        order_id = self.create_order(3)
+        item_ids = set(Order.objects.get(pk=order_id).order_items.values_list("id", flat=True))
+        response, _ = self.edit_first_line(order_id, 3, 5)
+
+        self.assertEqual(response.data["id"], order_id)
+        self.assertEqual(response.data["total"], 90)
+        order = Order.objects.get(pk=order_id)
+        self.assertEqual(set(order.order_items.values_list("id", flat=True)), item_ids)
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).stock, 95)
+        self.assertEqual(Product.objects.get(pk=self.products[1].pk).stock, 98)
+        self.assertEqual(self.customer.userbalance.balances()["orders_total"], 90)
+
+    def test_added_and_removed_lines(self):
+        order_id = self.create_order(2)
+        payload = self.order_payload(3, quantity=2)
+        del payload["order_items"][0]
+        response = self.client.put(f"/api/orders/{order_id}/", payload, format="json")
+        self.assertEqual(response.status_code, 200, response.data)
+
+        self.assertEqual(Order.objects.get(pk=order_id).order_items.count(), 2)
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).stock, 100)
+        self.assertEqual(Product.objects.get(pk=self.products[2].pk).stock, 98)
+        self.assertEqual(self.customer.userbalance.balances()["orders_total"], 40)
+
+    def test_cost_follows_the_size_of_the_change(self):
+        small, large = self.create_order(5), self.create_order(40)
+        _, small_queries = self.edit_first_line(small, 5, 3)
+        _, large_queries = self.edit_first_line(large, 40, 3)
+        self.assertEqual(len(small_queries), len(large_queries))
+        writes = [sql for sql in large_queries if sql.startswith(("INSERT", "UPDATE", "DELETE"))]
+        self.assertFalse(any(sql.startswith(("INSERT INTO \"orders_orderitem\"", "DELETE")) for sql in writes))
+
+    def test_fixed_price_and_extra_data_edits_are_saved(self):
+        order_id = self.create_order(2)
+        item_ids = set(Order.objects.get(pk=order_id).order_items.values_list("id", flat=True))
+        payload = self.order_payload(2, quantity=2)
+        payload["order_items"][0].update(fixed_price="8.00", extra_data={"note": "خصم"})
+        response = self.client.put(f"/api/orders/{order_id}/", payload, format="json")
+        self.assertEqual(response.status_code, 200, response.data)
+
+        items = {item.product_id: item for item in Order.objects.get(pk=order_id).order_items.all()}
+        self.assertEqual(set(item.pk for item in items.values()), item_ids)
+        edited, untouched = items[self.products[0].pk], items[self.products[1].pk]
+        self.assertEqual(edited.fixed_price, 8)
+        self.assertEqual(edited.extra_data, {"note": "خصم", "product_name": str(self.products[0])})
+        self.assertEqual(untouched.fixed_price, 10)
+        # The stock did not move
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).stock, 98)
+
+        # Sending the saved values back changes nothing
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.put(f"/api/orders/{order_id}/", payload, format="json")
+        self.assertFalse(any(q["sql"].startswith('UPDATE "orders_orderitem"') for q in ctx.captured_queries))
+
+    def test_quantity_edit_after_a_price_change_keeps_the_agreed_price(self):
+        order_id = self.create_order(2)
+        Product.objects.filter(pk=self.products[0].pk).update(price=15)
+        response, _ = self.edit_first_line(order_id, 2, 3)
+
+        # The total follows the current product price, as for a new line
+        item = Order.objects.get(pk=order_id).order_items.get(product=self.products[0])
+        self.assertEqual((item.fixed_price, item.total), (10, 45))
+        self.assertEqual(response.data["total"], 65)
+        self.assertEqual(self.customer.userbalance.balances()["orders_total"], 65)
+
+    def test_out_of_stock_edit_is_refused(self):
+        order_id = self.create_order(2)
+        Product.objects.filter(pk=self.products[1].pk).update(stock=0)
+        payload = self.order_payload(2, quantity=2)
+        payload["order_items"][1]["quantity"] = 3
+        response = self.client.put(f"/api/orders/{order_id}/", payload, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data["order_items"][0], {})
+        self.assertIn("quantity", response.data["order_items"][1])
+        self.assertEqual(Order.objects.get(pk=order_id).total, 40)
+
+
+class ExportTests(OrderTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.post("/api/orders/", self.order_payload(3, quantity=2), format="json")
+        self.client.post(f"/api/user-balance/{self.customer.userbalance.pk}/deposit/",
+                         {"amount": "20.00", "balance_type": "paid_amount", "note": "cash"}, format="json")
+
+    def export(self, dataset, **params):
+        response = self.client.get(f"/api/exports/{dataset}/", params)
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content).decode()
+
+    def test_orders_csv_has_one_row_per_line(self):
+        lines = self.export("orders").splitlines()
+        self.assertEqual(lines[0].split(",")[:2], ["order_id", "created_at"])
+        self.assertEqual(len(lines), 4)
+
+    def test_jsonl_and_filters(self):
+        rows = [json.loads(line) for line in self.export("balances", output="jsonl", user=self.customer.pk).splitlines()]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]["amount_to_pay"], "40.00")
+        self.assertEqual(self.export("notes", start=timezone.localdate() + timedelta(days=1)).count("\n"), 1)
+
+    def test_export_command(self):
+        out = StringIO()
+        call_command("export_data", "notes", "--output", "jsonl", stdout=out)
+        self.assertEqual(json.loads(out.getvalue())["balance_type"], "paid_amount")
+
+
+class AsgiExportTests(OrderTestMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.token = Token.objects.create(user=self.staff)
+        BalanceNote.objects.bulk_create(
+            [BalanceNote(user=self.customer, amount=1, note="cash") for _ in range(CHUNK_SIZE * 2)])
+
+    async def test_exports_are_streamed_under_asgi(self):
+        communicator = ApplicationCommunicator(application, {
+            "type": "http", "method": "GET", "path": "/api/exports/notes/", "query_string": b"",
+            "headers": [(b"authorization", f"Token {self.token.key}".encode())],
+        })
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            await communicator.send_input({"type": "http.request"})
+            start = await communicator.receive_output(5)
+            bodies = []
+            while not bodies or bodies[-1].get("more_body"):
+                bodies.append(await communicator.receive_output(5))
+        self.assertEqual(start["status"], 200)
+        # The synchronous iterator would be read in full first, with a warning
+        self.assertFalse([warning for warning in caught if "StreamingHttpResponse" in str(warning.message)])
+        self.assertEqual(b"".join(body.get("body", b"") for body in bodies).count(b"\n"), CHUNK_SIZE * 2 + 1)
+
+
+class BenchmarkCommandTests(TestCase):
+    def seed(self):
+        call_command("seed_benchmark_data", "--users", "5", "--brands", "2", "--products", "20", "--orders", "30",
+                     "--notes", "10", "--days", "10", "--until", "2025-01-31", stdout=StringIO())
+
+    def test_seed_is_deterministic_and_consistent(self):
+        self.seed()
+        orders = list(Order.objects.order_by("id").values_list("user__username", "total", "created_at"))
+        self.assertEqual(len(orders), 30)
+        self.assertTrue(all(timezone.localdate(created_at).month == 1 for _, _, created_at in orders))
+        self.assertEqual(sum(r.products_total for r in DailySalesRollup.objects.all()), sum(t for _, t, _ in orders))
+
+        Order.objects.all().delete()
+        get_user_model().objects.all().delete()
+        Product.objects.all().delete()
+        Brand.objects.all().delete()
+        self.seed()
+        self.assertEqual(list(Order.objects.order_by("id").values_list("user__username", "total", "created_at")), orders)
+
+    def test_runner_writes_results(self):
+        self.seed()
+        with tempfile.NamedTemporaryFile(suffix=".json") as output:
+            call_command("run_benchmarks", "--iterations", "2", "--warmup", "0", "--only", "orders",
+                         "--output", output.name, stdout=StringIO())
+            report = json.load(output)
+        names = {result["name"] for result in report["results"]}
+        self.assertTrue({"orders-list", "orders-detail", "orders-create"} <= names)
+        for result in report["results"]:
+            self.assertLess(result["status"], 400)
+            self.assertGreater(result["queries"], 0)
+        # The rolled back writes leave the data as it was
+        self.assertEqual(Order.objects.count(), 30)
+
+    def test_cases_compare_the_replaced_paths(self):
+        self.seed()
+        with tempfile.NamedTemporaryFile(suffix=".json") as output:
+            call_command("run_benchmarks", "--iterations", "2", "--warmup", "0", "--only", "analytics-periods",
+                         "--output", output.name, stdout=StringIO())
+            results = {result["name"]: result for result in json.load(output)["results"]}
+        self.assertEqual(set(results), {"analytics-periods-per-query", "analytics-periods-single-scan"})
+        self.assertEqual(results["analytics-periods-per-query"]["queries"], 12)
+        self.assertEqual(results["analytics-periods-single-scan"]["queries"], 5)
+
+    def test_deposit_cases_compare_single_deposits_with_a_batch(self):
+        self.seed()
+        entries = BalanceEntry.objects.count()
+        with tempfile.NamedTemporaryFile(suffix=".json") as output:
+            call_command("run_benchmarks", "--iterations", "2", "--warmup", "0", "--only", "deposit-",
+                         "--deposits", "3", "--output", output.name, stdout=StringIO())
+            results = {result["name"]: result for result in json.load(output)["results"]}
+        self.assertEqual(set(results), {"user-balance-deposit-loop", "user-balance-deposit-batch"})
+        self.assertEqual(results["user-balance-deposit-loop"]["status"], 200)
+        self.assertEqual(results["user-balance-deposit-batch"]["status"], 200)
+        self.assertGreater(results["user-balance-deposit-loop"]["queries"],
+                           results["user-balance-deposit-batch"]["queries"])
+        # Both are rolled back
+        self.assertEqual(BalanceEntry.objects.count(), entries)
+
+
+class QueryBudgetTests(QueryBudgetTestMixin, OrderTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        for _ in range(10):
+            serializer = OrderSerializer(data=self.order_payload(8))
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+        self.order = Order.objects.first()
+
+    def test_order_actions_are_within_budget(self):
+        self.assertWithinQueryBudget("get", "/api/orders/")
+        self.assertWithinQueryBudget("get", f"/api/orders/{self.order.pk}/")
+        response = self.assertWithinQueryBudget("post", "/api/orders/", self.order_payload(20), format="json")
+        payload = self.order_payload(30, quantity=2)
+        self.assertWithinQueryBudget("put", f"/api/orders/{response.data['id']}/", payload, format="json")
+        self.assertWithinQueryBudget("delete", f"/api/orders/{response.data['id']}/")
+
+    def test_other_reads_are_within_budget(self):
+        BalanceNote.objects.bulk_create([BalanceNote(user=self.customer, note="n", amount=1) for _ in range(10)])
+        for path in ("/api/products/", f"/api/products/{self.products[0].pk}/", "/api/brand/",
+                     "/api/user-balance/", f"/api/user-balance/{self.customer.userbalance.pk}/",
+                     "/api/user-balance-notes/", "/api/users/", f"/api/users/{self.customer.pk}/"):
+            self.assertWithinQueryBudget("get", path)
+
+    def test_repeated_query_shapes_are_detected(self):
+        self.assertEqual(fingerprint("SELECT * FROM t WHERE id IN (%s, %s, %s) AND name = 'a''b' LIMIT 21"),
+                         "SELECT * FROM t WHERE id IN (...) AND name = ? LIMIT ?")
+        with QueryStats() as stats:
+            for product in self.products[:6]:
+                Product.objects.get(pk=product.pk)
+            list(Product.objects.filter(pk__in=[product.pk for product in self.products]))
+        self.assertEqual(stats.count, 7)
+        self.assertEqual([count for _, count in stats.repeated()], [6])
+        with self.assertRaises(AssertionError):
+            self.assertNoRepeatedQueries(stats)
+
+    @override_settings(MIDDLEWARE=["config.querycount.QueryCountMiddleware", *settings.MIDDLEWARE])
+    def test_middleware_reports_the_queries(self):
+        with self.assertLogs("config.querycount", "INFO") as logs:
+            response = self.client.get("/api/orders/")
+        self.assertRegex(response["Server-Timing"], r'^db;dur=[\d.]+;desc="\d+ queries", app;dur=[\d.]+$')
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual((record["view"], record["action"], record["status"]), ("orders-list", "list", 200))
+        self.assertGreater(record["queries"], 0)
+        self.assertEqual(len(logs.records), 1)
+
+
+class AsyncReadTests(OrderTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        for lines in (1, 5, 12):
+            serializer = OrderSerializer(data=self.order_payload(lines))
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+        self.order = Order.objects.first()
+        self.token = Token.objects.create(user=self.staff)
+
+    async def get(self, path, **params):
+        return await self.async_client.get(path, params, headers={"Authorization": f"Token {self.token.key}"})
+
+    async def test_order_list_and_detail_match_the_sync_views(self):
+        sync_list = await sync_to_async(self.client.get)("/api/orders/", {"limit": 1, "offset": 1})
+        response = await self.get("/api/async/orders/", limit=1, offset=1)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["count"], 3)
+        self.assertEqual(response.json()["results"], json.loads(sync_list.content)["results"])
+        self.assertIn("/api/async/orders/?limit=1&offset=2", response.json()["next"])
+
+        sync_detail = await sync_to_async(self.client.get)(f"/api/orders/{self.order.pk}/")
+        response = await self.get(f"/api/async/orders/{self.order.pk}/")
+        self.assertEqual(response.json(), json.loads(sync_detail.content))
+
+        response = await self.get("/api/async/orders/", user=self.staff.pk)
+        self.assertEqual(response.json()["count"], 0)
+
+    async def test_analytics_match_the_sync_view(self):
+        for params in ({}, {"source": "orders"}):
+            sync_response = await sync_to_async(self.client.get)("/api/orders-analytics/", params)
+            response = await self.get("/api/async/orders-analytics/", **params)
+            self.assertEqual(response.json(), json.loads(sync_response.content))
+
+    async def test_errors(self):
+        self.assertEqual((await self.get("/api/async/orders/0/")).status_code, 404)
+        self.assertEqual((await self.async_client.get("/api/async/orders/")).status_code, 401)
+        response = await self.async_client.get("/api/async/orders/", headers={"Authorization": "Token nope"})
+        self.assertEqual(response.status_code, 401)
+        response = await self.async_client.post("/api/async/orders/", headers={"Authorization": f"Token {self.token.key}"})
+        self.assertEqual(response.status_code, 405)
+
+
+class ChangesPushTests(OrderTestMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.token = Token.objects.create(user=self.staff)
+
+    async def connect(self, **subscriptions):
+        communicator = WebsocketCommunicator(application, f"/ws/changes/?token={self.token.key}")
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.send_json_to({"action": "subscribe", **subscriptions})
+        self.assertEqual((await communicator.receive_json_from())["type"], "subscriptions")
+        return communicator
+
+    def create_order(self, lines):
+        serializer = OrderSerializer(data=self.order_payload(lines))
+        serializer.is_valid(raise_exception=True)
+        return serializer.save()
+
+    async def test_an_order_is_pushed_as_one_message(self):
+        communicator = await self.connect(products=[product.pk for product in self.products], users=[self.customer.pk])
+        await sync_to_async(self.create_order)(40)
+
+        message = await communicator.receive_json_from()
+        self.assertEqual(message["type"], "changes")
+        self.assertEqual(len(message["products"]), 40)
+        self.assertEqual({product["stock"] for product in message["products"]}, {99})
+        self.assertEqual(message["balances"], [
+            {"user": self.customer.pk, "orders_total": 400.0, "paid_amount": 0.0, "amount_to_pay": 400.0}])
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+    async def test_only_subscribed_changes_are_pushed(self):
+        by_brand = await self.connect(brands=[self.brand.pk])
+        by_user = await self.connect(users=[self.staff.pk])
+
+        product = self.products[0]
+        product.price = 12
+        await sync_to_async(product.save)()
+        message = await by_brand.receive_json_from()
+        self.assertEqual(message["products"][0]["price"], 12.0)
+        self.assertTrue(await by_user.receive_nothing())
+
+        await by_brand.send_json_to({"action": "unsubscribe", "brands": [self.brand.pk]})
+        await by_brand.receive_json_from()
+        await sync_to_async(self.create_order)(2)
+        self.assertTrue(await by_brand.receive_nothing())
+        await by_brand.disconnect()
+        await by_user.disconnect()
+
+    async def test_rolled_back_changes_are_not_pushed(self):
+        communicator = await self.connect(products=[self.products[0].pk])
+
+        def fail():
+            with transaction.atomic():
+                Product.objects.decrement_stock({self.products[0].pk: 1})
+                transaction.set_rollback(True)
+        await sync_to_async(fail)()
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+    async def test_token_is_required(self):
+        communicator = WebsocketCommunicator(application, "/ws/changes/?token=nope")
+        connected, _ = await communicator.connect()
+        self.assertFalse(connected)
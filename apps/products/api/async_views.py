@@ -0,0 +1,20 @@
+from apps.products.api.serializers import ProductSerializer
+from apps.products.models import Product
+from apps.products.search import search_products
+from config.asyncviews import AsyncAPIView
+
+
+class AsyncProductListView(AsyncAPIView):
+    """
+    Async version of the `ProductViewSet` list, with the same `?search=`, `?limit=` and `?offset=` parameters.
+    It always reads the database, the catalog response cache is only used by the sync view.
+    """
+    serializer_class = ProductSerializer
+    ordering = ("-created_at", "-id")
+
+    async def get(self, request, *args, **kwargs):
+        queryset = Product.objects.filter(deleted=False).order_by(*self.ordering)
+        text = request.query_params.get("search", "")
+        if text.strip():
+            queryset = search_products(queryset, text).order_by("search_rank", *self.ordering)
+        return self.render(await self.paginate(queryset))
@@ -0,0 +1,19 @@
+from rest_framework import filters
+
+from apps.products.search import search_products
+
+
+class ProductSearchFilter(filters.SearchFilter):
+    """
+    `?search=` backed by the products full text index instead of `icontains` scans.
+    Results are ranked by relevance unless the request asks for an explicit `?ordering=`.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        text = request.query_params.get(self.search_param, "")
+        if not text.strip():
+            return queryset
+        queryset = search_products(queryset, text)
+        if filters.OrderingFilter.ordering_param not in request.query_params:
+            queryset = queryset.order_by("search_rank", *queryset.query.order_by)
+        return queryset
@@ -1,42 +1,64 @@
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
 from rest_framework import serializers
 
-from apps.products.models import Product, Brand
+from apps.products.models import Product, Brand, PRODUCT_UNIQUE_NAME_CONSTRAINT
+from apps.products.thumbnails import variants_are_current
+
+
+class ImageVariantField(serializers.Field):
+    """
+    URL of a resized variant of the product image. Until the variant is rendered (or after the image
+    was replaced) the original image URL is returned, the rendering is queued when the product is saved.
+    """
+
+    def __init__(self, variant, **kwargs):
+        self.variant = variant
+        super().__init__(source="*", read_only=True, **kwargs)
+
+    def to_representation(self, product):
+        if not product.image:
+            return None
+        if variants_are_current(product):
+            url = default_storage.url(product.image_variants[self.variant])
+        else:
+            url = product.image.url
+        request = self.context.get("request")
+        return request.build_absolute_uri(url) if request is not None else url
 
 
 class ProductSerializer(serializers.ModelSerializer):
+    image_thumb = ImageVariantField("thumb")
+    image_card = ImageVariantField("card")
+    image_thumb_webp = ImageVariantField("thumb_webp")
+    image_card_webp = ImageVariantField("card_webp")
+
     class Meta:
         model = Product
-        fields = '__all__'
+        exclude = ('search_document', 'image_variants')
         read_only_fields = ('id', 'created_at', 'updated_at')
 
     def validate(self, attrs):
         name = attrs.get('name')
-        brand = attrs.get('brand')
 
         if name:
             attrs['name'] = name.lower()
 
-        # Only check for duplicates on create or when name/brand is updated
-        if name:
-            print('attrs', attrs)
-            queryset = Product.objects.filter(
-                name=attrs['name'],
-                brand=brand,
-                deleted=False
-            )
-            print(queryset)
-
-            # Exclude current instance on update
-            if self.instance:
-                queryset = queryset.exclude(pk=self.instance.pk)
-
-            if queryset.exists():
-                raise serializers.ValidationError({
-                    'name': 'هذا المنتج موجود بالفعل'
-                })
-
         return attrs
 
+    def save(self, **kwargs):
+        # Duplicates are rejected by the unique constraint, a check query before the insert
+        # would let two concurrent requests create the same product
+        try:
+            with transaction.atomic():
+                return super().save(**kwargs)
+        except IntegrityError as e:
+            if PRODUCT_UNIQUE_NAME_CONSTRAINT not in str(e):
+                raise
+            raise serializers.ValidationError({
+                'name': ['هذا المنتج موجود بالفعل']
+            })
+
 
 class BrandSerializer(serializers.ModelSerializer):
     class Meta:
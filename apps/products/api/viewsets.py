@@ -1,15 +1,53 @@
+import csv
+
 from rest_framework import filters, viewsets, status
+from rest_framework.decorators import action
 from rest_framework.response import Response
 
+from apps.products.api.filters import ProductSearchFilter
 from apps.products.api.serializers import ProductSerializer, BrandSerializer
+from apps.products.cache import catalog_cache_key, catalog_cache_stats, get_catalog_cache, record_hit, record_miss
+from apps.products.imports import guess_format, import_products, read_rows
 from apps.products.models import Product, Brand
+from config.conditional import ConditionalGetMixin
+from config.pagination import OffsetOrCursorPagination
+
+
+class CatalogCacheMixin:
+    """
+    Serve list and retrieve responses from the catalog cache, see `apps.products.cache`.
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
 
+    def cached_response(self, handler, request, *args, **kwargs):
+        cache = get_catalog_cache()
+        key = catalog_cache_key(request)
+        data = cache.get(key)
+        if data is not None:
+            record_hit()
+            return Response(data, headers={"X-Cache": "HIT"})
 
-class ProductViewSet(viewsets.ModelViewSet):
+        record_miss()
+        response = handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            cache.set(key, response.data)
+        response["X-Cache"] = "MISS"
+        return response
+
+
+class ProductViewSet(ConditionalGetMixin, CatalogCacheMixin, viewsets.ModelViewSet):
     queryset = Product.objects.filter(deleted=False)
     serializer_class = ProductSerializer
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter, ]
+    filter_backends = [filters.OrderingFilter, ProductSearchFilter, ]
     search_fields = ['name', 'description']
+    pagination_class = OffsetOrCursorPagination
+    ordering = ("-created_at", "-id")
+    query_budgets = {"list": 4, "retrieve": 3, "create": 5, "update": 6, "partial_update": 6, "destroy": 4}
 
     def destroy(self, request, *args, **kwargs):
         instance = self.get_object()
@@ -17,7 +55,31 @@ class ProductViewSet(viewsets.ModelViewSet):
         instance.save()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @action(detail=False, methods=['get'], url_path='cache-stats')
+    def cache_stats(self, request):
+        return Response(catalog_cache_stats())
+
+    @action(detail=False, methods=['post'], url_path='import')
+    def import_file(self, request):
+        """
+        Create or update products from an uploaded CSV or JSON lines price list (`file`),
+        the format is guessed from the file name unless `?input=csv|jsonl` is given.
+        """
+        file = request.FILES.get("file")
+        if file is None:
+            return Response({"error": "file is required"}, status=status.HTTP_400_BAD_REQUEST)
+        input_format = request.query_params.get("input") or guess_format(file.name)
+        if input_format not in ("csv", "jsonl"):
+            return Response({"error": f"Unknown input format: {input_format}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            result = import_products(read_rows(file, input_format))
+        except (UnicodeDecodeError, csv.Error) as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(result)
+
 
-class BrandViewSet(viewsets.ModelViewSet):
+class BrandViewSet(ConditionalGetMixin, CatalogCacheMixin, viewsets.ModelViewSet):
     queryset = Brand.objects.all()
     serializer_class = BrandSerializer
+    query_budgets = {"list": 4, "retrieve": 3}
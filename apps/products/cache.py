@@ -0,0 +1,61 @@
+"""
+Response cache of the product catalog (products and brands).
+
+Cached responses are keyed by the request and a catalog version counter; every write to a product or
+brand bumps the counter once its transaction commits, so stale entries are simply never read again.
+The cache backend is the `catalog` alias of `CACHES`.
+"""
+import hashlib
+
+from django.core.cache import caches
+from django.db import transaction
+
+VERSION_KEY = "catalog:version"
+HITS_KEY = "catalog:hits"
+MISSES_KEY = "catalog:misses"
+
+
+def get_catalog_cache():
+    return caches["catalog"]
+
+
+def _incr(key):
+    cache = get_catalog_cache()
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, None)
+        return cache.incr(key)
+
+
+def bump_catalog_version(using=None):
+    """
+    Invalidate every cached catalog response once the current transaction commits
+    """
+    transaction.on_commit(lambda: _incr(VERSION_KEY), using=using)
+
+
+def catalog_cache_key(request):
+    version = get_catalog_cache().get_or_set(VERSION_KEY, 0, None)
+    params = sorted(request.query_params.lists())
+    raw = f"{request.get_host()}:{request.path}:{params}"
+    return f"catalog:{version}:{hashlib.md5(raw.encode()).hexdigest()}"
+
+
+def record_hit():
+    _incr(HITS_KEY)
+
+
+def record_miss():
+    _incr(MISSES_KEY)
+
+
+def catalog_cache_stats():
+    values = get_catalog_cache().get_many([VERSION_KEY, HITS_KEY, MISSES_KEY])
+    hits, misses = values.get(HITS_KEY, 0), values.get(MISSES_KEY, 0)
+    return {
+        "version": values.get(VERSION_KEY, 0),
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": hits / (hits + misses) if hits + misses else 0,
+    }
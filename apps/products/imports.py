@@ -0,0 +1,185 @@
+"""
+Bulk import of products from a supplier price list (CSV or JSON lines).
+
+Every row has a `name` and `price`, and optionally `brand` (name), `stock`, `sku` and `description`.
+Brands and existing products are resolved through in-memory indexes built with one query each,
+new products are inserted with `bulk_create` and changed ones written with `bulk_update`, in chunks.
+A row matches an existing product by (lowercase name, brand), the same rule as `ProductSerializer`.
+The counts are per row: a row changing a product created by an earlier row of the file counts as updated.
+"""
+import csv
+import io
+import json
+from collections import Counter
+from decimal import Decimal, InvalidOperation
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from apps.products.cache import bump_catalog_version
+from apps.products.models import Brand, Product
+from apps.products.search import build_search_document, index_products
+from config.changes import record_product_changes
+
+CHUNK_SIZE = 1000
+UPDATABLE_FIELDS = ("price", "stock", "sku", "description")
+
+
+def guess_format(filename):
+    return "jsonl" if filename.lower().endswith((".jsonl", ".json", ".ndjson")) else "csv"
+
+
+def read_rows(file, input_format):
+    """
+    Yield the rows of a text or binary file as dicts
+    """
+    if isinstance(file.read(0), bytes):
+        # Uploaded files wrap the real file object
+        file = io.TextIOWrapper(getattr(file, "file", file), encoding="utf-8-sig")
+    if input_format == "csv":
+        yield from csv.DictReader(file)
+    else:
+        for line in file:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # Rejected by the import as it is not an object
+                yield line
+
+
+def _clean_row(row):
+    """
+    Returns the product fields of a row, or raises ValueError with the reason it is rejected
+    """
+    if not isinstance(row, dict):
+        raise ValueError("row must be an object")
+    name = (row.get("name") or "").strip().lower()
+    if not name:
+        raise ValueError("name is required")
+    try:
+        price = Decimal(str(row.get("price")).strip())
+    except InvalidOperation:
+        raise ValueError("price must be a number")
+    if not price.is_finite() or price < 0:
+        raise ValueError("price must be a positive number")
+
+    fields = {"name": name, "price": price.quantize(Decimal("0.01"))}
+    if row.get("stock") not in (None, ""):
+        try:
+            stock = Decimal(str(row["stock"]).strip())
+        except InvalidOperation:
+            raise ValueError("stock must be an integer")
+        # `int()` would silently truncate a stock of 3.7
+        if not stock.is_finite() or stock != stock.to_integral_value():
+            raise ValueError("stock must be an integer")
+        if stock < 0:
+            raise ValueError("stock must be a positive integer")
+        fields["stock"] = int(stock)
+    for field in ("sku", "description"):
+        if row.get(field) not in (None, ""):
+            fields[field] = str(row[field])
+    return (row.get("brand") or "").strip(), fields
+
+
+def import_products(rows, chunk_size=CHUNK_SIZE):
+    """
+    Create or update the products of `rows`, returns the created/updated/unchanged counts and the rejected rows.
+    Missing brands are created.
+    """
+    brands = {brand.name.strip().lower(): brand for brand in Brand.objects.all()}
+    products = {
+        (product.name.lower(), product.brand_id): product
+        for product in Product.objects.filter(deleted=False).select_related("brand")
+    }
+
+    new_brands, created, updated, rejected = {}, {}, {}, []
+    counts = Counter()
+    # (row, count) of the rows of every created product, they are rejected together if it can not be inserted
+    created_rows = {}
+    for index, row in enumerate(rows, start=1):
+        try:
+            brand_name, fields = _clean_row(row)
+        except ValueError as e:
+            rejected.append({"row": index, "error": str(e)})
+            continue
+
+        brand = None
+        if brand_name:
+            brand = brands.get(brand_name.lower())
+            if brand is None:
+                brand = new_brands.setdefault(brand_name.lower(), Brand(name=brand_name))
+        # Products of a brand that does not exist yet are keyed by the brand name
+        key = (fields["name"], brand.pk if brand is not None and brand.pk else brand_name.lower() or None)
+
+        product = products.get(key) or created.get(key)
+        if product is None:
+            created[key] = Product(brand=brand, **fields)
+            count = "created"
+        else:
+            changes = {field: value for field, value in fields.items()
+                       if field in UPDATABLE_FIELDS and getattr(product, field) != value}
+            for field, value in changes.items():
+                setattr(product, field, value)
+            if changes and product.pk:
+                updated[product.pk] = product
+            count = "updated" if changes else "unchanged"
+        counts[count] += 1
+        if key in created:
+            created_rows.setdefault(key, []).append((index, count))
+
+    now = timezone.now()
+    with transaction.atomic():
+        # bulk_create sets the brand_id of the new products from the brands created first
+        Brand.objects.bulk_create(new_brands.values(), batch_size=chunk_size)
+        for product in created.values():
+            product.search_document = build_search_document(product)
+        _create_products(created, created_rows, counts, rejected, chunk_size)
+
+        if updated:
+            for product in updated.values():
+                product.search_document = build_search_document(product)
+                product.updated_at = now
+            Product.objects.bulk_update(
+                updated.values(), [*UPDATABLE_FIELDS, "search_document", "updated_at"], batch_size=chunk_size)
+
+        index_products([*created.values(), *updated.values()])
+        bump_catalog_version()
+        record_product_changes(product.pk for product in updated.values())
+
+    rejected.sort(key=lambda error: error["row"])
+    return {
+        "created": counts["created"],
+        "updated": counts["updated"],
+        "unchanged": counts["unchanged"],
+        "rejected": len(rejected),
+        "errors": rejected,
+    }
+
+
+def _create_products(created, created_rows, counts, rejected, chunk_size):
+    """
+    Insert the `created` products. A product inserted by another request since the products were read
+    violates the unique constraint: its rows are moved from `counts` to `rejected` and the rest is inserted again.
+    """
+    while created:
+        try:
+            with transaction.atomic():
+                Product.objects.bulk_create(created.values(), batch_size=chunk_size)
+            return
+        except IntegrityError:
+            existing = {
+                (name.lower(), brand_id)
+                for name, brand_id in Product.objects.filter(
+                    deleted=False, name__in=[product.name for product in created.values()],
+                ).values_list("name", "brand_id")
+            }
+            conflicts = [key for key, product in created.items() if (product.name, product.brand_id) in existing]
+            if not conflicts:
+                raise
+        for key in conflicts:
+            del created[key]
+            for index, count in created_rows.pop(key):
+                counts[count] -= 1
+                rejected.append({"row": index, "error": "the product was created by another request meanwhile"})
@@ -0,0 +1,59 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.utils import timezone
+
+from apps.products.cache import bump_catalog_version
+from apps.products.models import Product
+from apps.products.thumbnails import render_variants, schedule_variants, variants_are_current
+
+
+class Command(BaseCommand):
+    help = "Render the resized variants of the existing product images, in parallel worker processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Defaults to the number of cores")
+        parser.add_argument("--force", action="store_true", help="Render the variants that are current as well")
+        parser.add_argument("--queue", action="store_true",
+                            help="Queue a job per product for `run_workers` instead of rendering here")
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(image="").exclude(image__isnull=True).only("image", "image_variants")
+        if options["queue"]:
+            queued = 0
+            with transaction.atomic():
+                for product in products.iterator():
+                    if not variants_are_current(product):
+                        schedule_variants(product)
+                        queued += 1
+            self.stdout.write(self.style.SUCCESS(f"Queued the variants of {queued} images"))
+            return
+
+        images = {
+            product.pk: product.image.name
+            for product in products.iterator()
+            if options["force"] or not variants_are_current(product)
+        }
+        if not images:
+            self.stdout.write(self.style.SUCCESS("Every product image has its variants"))
+            return
+
+        # The workers only render files, the database is written from this process
+        connections.close_all()
+        rendered, failed = [], 0
+        now = timezone.now()
+        with ProcessPoolExecutor(max_workers=options["workers"]) as executor:
+            futures = {executor.submit(render_variants, name): pk for pk, name in images.items()}
+            for future in as_completed(futures):
+                try:
+                    rendered.append(Product(pk=futures[future], image_variants=future.result(), updated_at=now))
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f"Product {futures[future]}: {e}")
+
+        # `updated_at` changes the ETag of the catalog, so clients load the variant URLs
+        Product.objects.bulk_update(rendered, ["image_variants", "updated_at"], batch_size=500)
+        bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS(f"Rendered the variants of {len(rendered)} images, {failed} failed"))
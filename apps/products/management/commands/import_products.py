@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from apps.products.imports import guess_format, import_products, read_rows
+
+
+class Command(BaseCommand):
+    help = "Create or update products from a CSV or JSON lines price list."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--input", choices=["csv", "jsonl"], help="Defaults to the file extension")
+        parser.add_argument("--chunk-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        input_format = options["input"] or guess_format(options["path"])
+        with open(options["path"], encoding="utf-8-sig", newline="") as file:
+            result = import_products(read_rows(file, input_format), chunk_size=options["chunk_size"])
+
+        for error in result["errors"]:
+            self.stderr.write(f"Row {error['row']}: {error['error']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{result['created']} created, {result['updated']} updated, "
+            f"{result['unchanged']} unchanged, {result['rejected']} rejected"
+        ))
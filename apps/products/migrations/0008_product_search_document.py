@@ -0,0 +1,71 @@
+# Generated by Django 4.2.17 on 2026-10-18 15:50
+
+import re
+
+from django.db import migrations, models
+
+# A copy of `apps.products.search` as of this migration, so later changes to it do not change what it does
+FTS_TABLE = "products_product_fts"
+
+ARABIC_DIACRITICS = re.compile("[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]")
+ARABIC_LETTERS = str.maketrans({
+    "أ": "ا",
+    "إ": "ا",
+    "آ": "ا",
+    "ٱ": "ا",
+    "ة": "ه",
+    "ى": "ي",
+    "ئ": "ي",
+    "ؤ": "و",
+})
+
+
+def search_terms(text):
+    text = ARABIC_DIACRITICS.sub("", text).translate(ARABIC_LETTERS).lower()
+    return re.findall(r"\w+", text)
+
+
+def create_search_index(apps, schema_editor):
+    Product = apps.get_model("products", "Product")
+    connection = schema_editor.connection
+
+    products = list(Product.objects.select_related("brand"))
+    for product in products:
+        parts = [product.name, getattr(product.brand, "name", None), product.sku, product.description]
+        product.search_document = " ".join(search_terms(" ".join(part for part in parts if part)))
+    Product.objects.bulk_update(products, ["search_document"], batch_size=500)
+
+    if connection.vendor == "sqlite":
+        schema_editor.execute(f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(document, tokenize='unicode61')")
+        schema_editor.execute(
+            f"INSERT INTO {FTS_TABLE}(rowid, document) "
+            f"SELECT id, search_document FROM products_product WHERE deleted = 0"
+        )
+    elif connection.vendor == "postgresql":
+        schema_editor.execute(
+            "CREATE INDEX product_search_document_idx ON products_product "
+            "USING GIN (to_tsvector('simple', search_document))"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == "sqlite":
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    elif connection.vendor == "postgresql":
+        schema_editor.execute("DROP INDEX IF EXISTS product_search_document_idx")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('products', '0007_product_product_created_at_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_document',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.17 on 2026-10-18 15:54
+
+from django.db import migrations, models
+import django.db.models.functions.comparison
+
+
+def soft_delete_duplicates(apps, schema_editor):
+    """
+    The constraint can not be added while duplicates exist, keep the oldest product
+    of every (name, brand) and soft delete the others, the orders still reference them.
+    The soft deleted products are hidden from the API, their pks are printed.
+    """
+    Product = apps.get_model("products", "Product")
+    seen, duplicates = {}, []
+    for pk, name, brand_id in Product.objects.filter(deleted=False).order_by("id").values_list("id", "name", "brand_id"):
+        if (name, brand_id) in seen:
+            duplicates.append((pk, seen[name, brand_id]))
+        else:
+            seen[name, brand_id] = pk
+    if not duplicates:
+        return
+    Product.objects.filter(pk__in=[pk for pk, _ in duplicates]).update(deleted=True)
+    print(f"\n  Soft deleted {len(duplicates)} duplicate products (pk: pk of the product kept):")
+    for pk, kept in duplicates:
+        print(f"    {pk}: {kept}")
+
+
+def keep_duplicates_deleted(apps, schema_editor):
+    """
+    The reverse of `soft_delete_duplicates` leaves the duplicates soft deleted: which products it deleted is not
+    recorded, restore them with the pks it printed (`deleted=False`) once the constraint is removed.
+    """
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('products', '0009_brand_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(soft_delete_duplicates, keep_duplicates_deleted),
+        migrations.AddConstraint(
+            model_name='product',
+            constraint=models.UniqueConstraint(models.F('name'), django.db.models.functions.comparison.Coalesce('brand', models.Value(0)), condition=models.Q(('deleted', False)), name='product_unique_name_brand', violation_error_message='هذا المنتج موجود بالفعل'),
+        ),
+    ]
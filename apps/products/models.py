@@ -1,14 +1,91 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import DEFERRED, Case, F, Q, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from apps.products.cache import bump_catalog_version
+from apps.products.search import build_search_document
+from config.changes import record_product_changes
 
 # Create your models here.
 
 class Brand(models.Model):
     name = models.CharField(max_length=255)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.name
 
 
+class OutOfStockError(Exception):
+    """
+    Raised when a stock reservation asks for more than what is left.
+    `available` maps the pk of every short product to its remaining stock.
+    """
+
+    def __init__(self, available):
+        self.available = available
+        super().__init__(f"Out of stock: {available}")
+
+
+class ProductQuerySet(models.QuerySet):
+    def _quantity_case(self, quantities, then):
+        return Case(
+            *[When(pk=pk, then=then(quantity)) for pk, quantity in quantities.items()],
+            output_field=models.PositiveIntegerField(),
+        )
+
+    def decrement_stock(self, quantities):
+        """
+        Reserve stock for many products in a single conditional UPDATE
+        (`stock = stock - n WHERE stock >= n`), so concurrent sales can never lose units or oversell.
+        `quantities` maps a product pk to the quantity to take out of its stock.
+        Nothing is reserved and `OutOfStockError` is raised if any product does not have enough stock.
+        """
+        quantities = {pk: quantity for pk, quantity in quantities.items() if quantity}
+        if not quantities:
+            return 0
+        try:
+            with transaction.atomic(using=self.db):
+                updated = self.filter(
+                    pk__in=quantities.keys(),
+                    stock__gte=self._quantity_case(quantities, Value),
+                ).update(
+                    stock=self._quantity_case(quantities, lambda quantity: F("stock") - quantity),
+                    updated_at=timezone.now(),
+                )
+                if updated != len(quantities):
+                    raise OutOfStockError({})
+                bump_catalog_version(using=self.db)
+                record_product_changes(quantities.keys(), using=self.db)
+        except OutOfStockError:
+            # The savepoint is rolled back, find which products were short
+            stocks = dict(self.filter(pk__in=quantities.keys()).values_list("pk", "stock"))
+            raise OutOfStockError({
+                pk: stocks.get(pk, 0) for pk, quantity in quantities.items() if stocks.get(pk, 0) < quantity
+            })
+        return updated
+
+    def increment_stock(self, quantities):
+        """
+        Put stock back for many products in a single UPDATE statement.
+        `quantities` maps a product pk to the quantity to return to its stock.
+        """
+        quantities = {pk: quantity for pk, quantity in quantities.items() if quantity}
+        if not quantities:
+            return 0
+        updated = self.filter(pk__in=quantities.keys()).update(
+            stock=self._quantity_case(quantities, lambda quantity: F("stock") + quantity),
+            updated_at=timezone.now(),
+        )
+        bump_catalog_version(using=self.db)
+        record_product_changes(quantities.keys(), using=self.db)
+        return updated
+
+
+PRODUCT_UNIQUE_NAME_CONSTRAINT = "product_unique_name_brand"
+
+
 class Product(models.Model):
     name = models.CharField(max_length=255)
     brand = models.ForeignKey(Brand, on_delete=models.SET_NULL, null=True)
@@ -20,10 +97,49 @@ class Product(models.Model):
     image = models.ImageField(upload_to="products", null=True, blank=True)
     stock = models.PositiveIntegerField(default=0)
     deleted = models.BooleanField(default=False)
+    search_document = models.TextField(blank=True, default="", editable=False)
+    # Resized copies of `image`, see `apps.products.thumbnails`
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
 
+    objects = ProductQuerySet.as_manager()
 
     def __str__(self):
         return getattr(self.brand,'name',' ' ) + '-' + self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        product = super().from_db(db, field_names, values)
+        # The brand as loaded, see `brand_changed`
+        product._loaded_brand_id = product.__dict__.get("brand_id", DEFERRED)
+        return product
+
+    def brand_changed(self):
+        """
+        Whether the product was moved to another brand since it was loaded or saved,
+        a product whose brand was not loaded counts as moved.
+        """
+        return getattr(self, "_loaded_brand_id", DEFERRED) != self.brand_id
+
+    def save(self, *args, **kwargs):
+        self.search_document = build_search_document(self)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            kwargs["update_fields"] = {*update_fields, "search_document"}
+        super().save(*args, **kwargs)
+        self._loaded_brand_id = self.brand_id
+
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            models.Index(fields=["created_at", "id"], name="product_created_at_id_idx"),
+        ]
+        constraints = [
+            # A name is unique per brand among the products that are not deleted,
+            # products without a brand count as one brand
+            models.UniqueConstraint(
+                F("name"), Coalesce("brand", Value(0)),
+                condition=Q(deleted=False),
+                name=PRODUCT_UNIQUE_NAME_CONSTRAINT,
+                violation_error_message="هذا المنتج موجود بالفعل",
+            ),
+        ]
@@ -0,0 +1,101 @@
+"""
+Full text search of the products.
+
+The searchable text of a product (name, brand, sku and description) is normalized and stored in
+`Product.search_document`. On SQLite it is indexed by the `products_product_fts` FTS5 table, kept in sync
+by the product signals; on PostgreSQL by a GIN index over its tsvector. Other databases fall back to a
+`LIKE` scan of the normalized text.
+"""
+import re
+
+from django.db import connection
+from django.db.models import BooleanField, FloatField, Value
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = "products_product_fts"
+
+ARABIC_DIACRITICS = re.compile("[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]")
+ARABIC_LETTERS = str.maketrans({
+    "أ": "ا",
+    "إ": "ا",
+    "آ": "ا",
+    "ٱ": "ا",
+    "ة": "ه",
+    "ى": "ي",
+    "ئ": "ي",
+    "ؤ": "و",
+})
+
+
+def normalize_arabic(text):
+    """
+    Normalize text so spelling variants match: drop the diacritics and tatweel,
+    unify alef/hamza forms, taa marbuta and alef maqsura, and lowercase the latin letters.
+    """
+    if not text:
+        return ""
+    return ARABIC_DIACRITICS.sub("", text).translate(ARABIC_LETTERS).lower()
+
+
+def search_terms(text):
+    return re.findall(r"\w+", normalize_arabic(text))
+
+
+def build_search_document(product):
+    parts = [product.name, getattr(product.brand, "name", None), product.sku, product.description]
+    return " ".join(search_terms(" ".join(part for part in parts if part)))
+
+
+def index_products(products):
+    """
+    Add or refresh the products in the full text index, deleted products are removed from it
+    """
+    if connection.vendor != "sqlite":
+        return
+    products = list(products)
+    remove_products([product.pk for product in products if product.deleted])
+    rows = [(product.pk, product.search_document) for product in products if not product.deleted]
+    if rows:
+        with connection.cursor() as cursor:
+            cursor.executemany(f"INSERT OR REPLACE INTO {FTS_TABLE}(rowid, document) VALUES (%s, %s)", rows)
+
+
+def remove_products(pks):
+    if connection.vendor != "sqlite" or not pks:
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [(pk,) for pk in pks])
+
+
+def search_products(queryset, text):
+    """
+    Filter `queryset` to the products matching every term of `text` (as a prefix, for type-ahead)
+    and annotate them with `search_rank`, lower is better.
+    """
+    terms = search_terms(text)
+    if not terms:
+        return queryset
+
+    if connection.vendor == "sqlite":
+        match = " ".join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+        table = queryset.model._meta.db_table
+        return queryset.filter(
+            pk__in=RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [match]),
+        ).annotate(search_rank=RawSQL(
+            f"SELECT rank FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s AND rowid = {table}.id",
+            [match],
+            output_field=FloatField(),
+        ))
+
+    if connection.vendor == "postgresql":
+        tsquery = " & ".join(f"{term}:*" for term in terms)
+        vector = "to_tsvector('simple', search_document)"
+        return queryset.annotate(
+            search_match=RawSQL(f"{vector} @@ to_tsquery('simple', %s)", [tsquery], output_field=BooleanField()),
+            search_rank=RawSQL(f"-ts_rank({vector}, to_tsquery('simple', %s))", [tsquery],
+                               output_field=FloatField()),
+        ).filter(search_match=True)
+
+    for term in terms:
+        queryset = queryset.filter(search_document__contains=term)
+    return queryset.annotate(search_rank=Value(0.0, output_field=FloatField()))
@@ -0,0 +1,67 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from config.changes import record_product_changes
+from .cache import bump_catalog_version
+from .models import Brand, Product
+from .search import build_search_document, index_products, remove_products
+from .thumbnails import schedule_variants
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    """
+    Signal to keep the full text index in sync when a Product is saved or soft deleted
+    """
+    index_products([instance])
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    """
+    Signal to remove a deleted Product from the full text index
+    """
+    remove_products([instance.pk])
+
+
+@receiver(post_save, sender=Brand)
+def reindex_brand_products(sender, instance, created, **kwargs):
+    """
+    Signal to refresh the search document of the products of a renamed Brand
+    """
+    if created:
+        return
+    products = list(instance.product_set.select_related("brand"))
+    for product in products:
+        product.search_document = build_search_document(product)
+    Product.objects.bulk_update(products, ["search_document"], batch_size=500)
+    index_products(products)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Brand)
+@receiver(post_delete, sender=Brand)
+def invalidate_catalog_cache(sender, using=None, **kwargs):
+    """
+    Signal to invalidate the cached catalog responses when a Product or Brand changes
+    """
+    bump_catalog_version(using=using)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def push_product_changes(sender, instance, using=None, **kwargs):
+    """
+    Signal to push the new stock and price of an edited Product to the subscribed clients
+    """
+    record_product_changes([instance.pk], using=using)
+
+
+@receiver(post_save, sender=Product)
+def render_image_variants(sender, instance, raw=False, **kwargs):
+    """
+    Signal to render the resized variants of a new or replaced Product image in the background
+    """
+    if not raw:
+        schedule_variants(instance)
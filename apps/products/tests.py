@@ -1,3 +1,380 @@
+import json
+import tempfile
+from io import BytesIO, StringIO
+from urllib.parse import urlencode
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from apps.jobs.models import Job
+from apps.products.cache import get_catalog_cache
+from apps.products.imports import import_products
+from apps.products.models import Brand, Product
+from apps.products.search import normalize_arabic
+from apps.products.thumbnails import generate_variants, variants_are_current
+from config.authentication import get_auth_cache
+
+
+class ProductTestMixin:
+    def setUp(self):
+        get_catalog_cache().clear()
+        get_auth_cache().clear()
+        self.staff = get_user_model().objects.create(username="staff", first_name="staff", is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+        self.brand = Brand.objects.create(name="كلورايد")
+
+
+class ProductSearchTests(ProductTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.battery = Product.objects.create(name="بطارية سيارة 70 أمبير", brand=self.brand, price=10)
+        self.charger = Product.objects.create(name="شاحن", description="شاحن بطارية", price=5)
+        Product.objects.create(name="زيت", price=1)
+
+    def search(self, text):
+        response = self.client.get("/api/products/", {"search": text})
+        self.assertEqual(response.status_code, 200)
+        return [product["id"] for product in response.data["results"]]
+
+    def test_normalize_arabic(self):
+        self.assertEqual(normalize_arabic("بَطَّارِيَّة إأآ مستشفى ABC"), "بطاريه ااا مستشفي abc")
+
+    def test_spelling_variants_and_prefixes_match(self):
+        self.assertEqual(set(self.search("بطاريه")), {self.battery.pk, self.charger.pk})
+        self.assertEqual(self.search("امبير"), [self.battery.pk])
+        self.assertEqual(self.search("بطار كلور"), [self.battery.pk])
+
+    def test_results_are_ranked(self):
+        cable = Product.objects.create(name="كابل", description="كابل طويل لشاحن السيارة أو شاحن المنزل", price=1)
+        self.assertEqual(self.search("شاحن"), [self.charger.pk, cable.pk])
+        self.assertEqual(self.search("شاحن بطاريه"), [self.charger.pk])
+
+    def test_index_follows_edits_and_soft_delete(self):
+        self.battery.name = "مولد"
+        self.battery.save()
+        self.assertEqual(self.search("مولد"), [self.battery.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f"/api/products/{self.battery.pk}/")
+        self.assertEqual(self.search("مولد"), [])
+
+    def test_brand_rename_is_searchable(self):
+        self.brand.name = "فارتا"
+        self.brand.save()
+        self.assertEqual(self.search("فارتا"), [self.battery.pk])
+
+
+class CatalogCacheTests(ProductTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = Product.objects.create(name="زيت", brand=self.brand, price=10, stock=5)
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, len(ctx.captured_queries)
+
+    def test_second_read_is_served_from_cache(self):
+        response, _ = self.get("/api/products/")
+        self.assertEqual(response["X-Cache"], "MISS")
+        response, queries = self.get("/api/products/")
+        self.assertEqual(response["X-Cache"], "HIT")
+        # Only the conditional GET validator
+        self.assertEqual(queries, 1)
+        self.assertEqual(self.client.get("/api/products/cache-stats/").data["hits"], 1)
+
+    def test_writes_invalidate_the_cache(self):
+        self.get("/api/products/")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f"/api/products/{self.product.pk}/", {"price": 12}, format="json")
+        response, _ = self.get("/api/products/")
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(response.data["results"][0]["price"], 12)
+
+    def test_stock_changes_invalidate_the_cache(self):
+        self.get(f"/api/products/{self.product.pk}/")
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.decrement_stock({self.product.pk: 2})
+        response, _ = self.get(f"/api/products/{self.product.pk}/")
+        self.assertEqual(response.data["stock"], 3)
+
+    def test_soft_delete_invalidates_the_cache(self):
+        self.get("/api/products/")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f"/api/products/{self.product.pk}/")
+        response, _ = self.get("/api/products/")
+        self.assertEqual(response.data["results"], [])
+
+
+class ConditionalGetTests(ProductTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = Product.objects.create(name="زيت", brand=self.brand, price=10)
+
+    def test_unchanged_list_is_not_modified(self):
+        etag = self.client.get("/api/products/")["ETag"]
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get("/api/products/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(ctx.captured_queries), 1)
+
+    def test_list_changes_with_rows(self):
+        etag = self.client.get("/api/products/")["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f"/api/products/{self.product.pk}/")
+            Product.objects.create(name="شحم", price=1)
+        self.assertEqual(self.client.get("/api/products/", HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_detail_supports_last_modified(self):
+        response = self.client.get(f"/api/products/{self.product.pk}/")
+        self.assertEqual(self.client.get(f"/api/products/{self.product.pk}/",
+                                         HTTP_IF_MODIFIED_SINCE=response["Last-Modified"]).status_code, 304)
+        self.assertEqual(self.client.get(f"/api/products/{self.product.pk}/",
+                                         HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
+
+    def test_malformed_pk_is_not_found(self):
+        self.assertEqual(self.client.get("/api/products/abc/").status_code, 404)
+
+
+class ProductImportTests(ProductTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = Product.objects.create(name="زيت", brand=self.brand, price=10, stock=5)
+
+    def upload(self, name, content, **params):
+        file = SimpleUploadedFile(name, content.encode())
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(f"/api/products/import/?{urlencode(params)}", {"file": file})
+
+    def test_csv_rows_are_created_updated_or_rejected(self):
+        response = self.upload("prices.csv", (
+            "name,brand,price,stock\n"
+            "زيت,كلورايد,12,5\n"
+            "شحم,كلورايد,3,\n"
+            "بطارية,فارتا,40,2\n"
+            ",كلورايد,1,1\n"
+            "فلتر,,abc,1\n"
+        ))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            {key: response.data[key] for key in ("created", "updated", "unchanged", "rejected")},
+            {"created": 2, "updated": 1, "unchanged": 0, "rejected": 2},
+        )
+        self.assertEqual([error["row"] for error in response.data["errors"]], [4, 5])
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.price, 12)
+        self.assertEqual(Product.objects.get(name="بطارية").brand.name, "فارتا")
+        self.assertEqual(Product.objects.get(name="شحم").brand, self.brand)
+        # New products are searchable and the cached catalog is invalidated
+        self.assertEqual(len(self.client.get("/api/products/", {"search": "فارتا"}).data["results"]), 1)
+
+    def test_jsonl_and_unchanged_rows(self):
+        response = self.upload("prices.txt", (
+            '{"name": "زيت", "brand": "كلورايد", "price": "10", "stock": 5}\n'
+            'not json\n'
+        ), input="jsonl")
+        self.assertEqual((response.data["unchanged"], response.data["rejected"]), (1, 1))
+
+    def test_every_row_is_counted(self):
+        response = self.upload("prices.csv", (
+            "name,brand,price,stock\n"
+            "شحم,كلورايد,3,1\n"
+            "شحم,كلورايد,4,1\n"
+            "شحم,كلورايد,4,1\n"
+            "زيت,كلورايد,12,5\n"
+            "زيت,كلورايد,13,5\n"
+        ))
+        self.assertEqual(
+            {key: response.data[key] for key in ("created", "updated", "unchanged", "rejected")},
+            {"created": 1, "updated": 3, "unchanged": 1, "rejected": 0},
+        )
+        self.assertEqual(Product.objects.get(name="شحم").price, 4)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.price, 13)
+
+    def test_fractional_stock_is_rejected(self):
+        response = self.upload("prices.txt", (
+            '{"name": "زيت", "brand": "كلورايد", "price": "10", "stock": 3.7}\n'
+            '{"name": "شحم", "brand": "كلورايد", "price": "10", "stock": "3.0"}\n'
+        ), input="jsonl")
+        self.assertEqual(response.data["errors"], [{"row": 1, "error": "stock must be an integer"}])
+        self.assertEqual(Product.objects.get(name="شحم").stock, 3)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 5)
+
+    def test_products_created_meanwhile_are_rejected(self):
+        def rows():
+            yield {"name": "شحم", "brand": "كلورايد", "price": "3"}
+            yield {"name": "شحم", "brand": "كلورايد", "price": "4"}
+            # Another request creates the product after the import read the existing ones
+            Product.objects.create(name="شحم", brand=self.brand, price=1)
+            yield {"name": "بطارية", "brand": "كلورايد", "price": "40"}
+
+        with self.captureOnCommitCallbacks(execute=True):
+            result = import_products(rows())
+        self.assertEqual((result["created"], result["updated"], result["rejected"]), (1, 0, 2))
+        self.assertEqual([error["row"] for error in result["errors"]], [1, 2])
+        self.assertEqual(Product.objects.get(name="شحم").price, 1)
+        self.assertTrue(Product.objects.filter(name="بطارية").exists())
+
+    def test_query_count_does_not_grow_with_the_rows(self):
+        rows = "".join(f"منتج {i},كلورايد,{i}\n" for i in range(300))
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.upload("prices.csv", "name,brand,price\n" + rows)
+        self.assertEqual(response.data["created"], 300)
+        self.assertLess(len(ctx.captured_queries), 15)
+
+    def test_missing_file(self):
+        self.assertEqual(self.client.post("/api/products/import/").status_code, 400)
+
+
+class ProductUniquenessTests(ProductTestMixin, TestCase):
+    def create(self, name, brand=None):
+        data = {"name": name, "price": 1}
+        if brand is not None:
+            data["brand"] = brand.pk
+        return self.client.post("/api/products/", data)
+
+    def test_duplicates_are_rejected_by_the_constraint(self):
+        self.assertEqual(self.create("Oil", self.brand).status_code, 201)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.create("oil", self.brand)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data["name"], ["هذا المنتج موجود بالفعل"])
+        # No lookup query runs before the insert
+        self.assertFalse(any('"products_product"."name"' in query["sql"] for query in ctx.captured_queries))
+
+        self.assertEqual(self.create("oil").status_code, 201)
+        self.assertEqual(self.create("oil").status_code, 400)
+        self.assertEqual(self.create("oil", Brand.objects.create(name="فارتا")).status_code, 201)
+
+    def test_deleted_products_do_not_count(self):
+        product = Product.objects.create(name="oil", brand=self.brand, price=1)
+        self.client.delete(f"/api/products/{product.pk}/")
+        self.assertEqual(self.create("oil", self.brand).status_code, 201)
+
+    def test_rename_to_an_existing_name(self):
+        Product.objects.create(name="oil", brand=self.brand, price=1)
+        product = Product.objects.create(name="grease", brand=self.brand, price=1)
+        response = self.client.patch(f"/api/products/{product.pk}/", {"name": "OIL"})
+        self.assertEqual(response.status_code, 400)
+
+
+class AsyncProductListTests(ProductTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        Product.objects.create(name="بطارية سيارة", brand=self.brand, price=10)
+        Product.objects.create(name="شاحن", description="شاحن بطارية", price=5)
+        Product.objects.create(name="زيت", price=1)
+        self.token = Token.objects.create(user=self.staff)
+
+    async def test_list_and_search_match_the_sync_view(self):
+        for params in ({}, {"limit": 1, "offset": 1}, {"search": "بطاريه"}):
+            sync_response = await sync_to_async(self.client.get)("/api/products/", params)
+            response = await self.async_client.get(
+                "/api/async/products/", params, headers={"Authorization": f"Token {self.token.key}"})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()["count"], sync_response.data["count"])
+            self.assertEqual(response.json()["results"], json.loads(sync_response.content)["results"])
+
+
+class ImageVariantsTests(ProductTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings = override_settings(MEDIA_ROOT=media.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def upload(self, size=(1000, 500), name="photo.png"):
+        buffer = BytesIO()
+        Image.new("RGBA", size, (200, 30, 30, 255)).save(buffer, "PNG")
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type="image/png")
+
+    def test_variants_are_rendered_and_served(self):
+        product = Product.objects.create(name="زيت", price=1, image=self.upload())
+        response = self.client.get(f"/api/products/{product.pk}/")
+        # Not rendered yet: the original is served meanwhile
+        self.assertEqual(response.data["image_thumb"], response.data["image"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            variants = generate_variants(product.pk)
+        with default_storage.open(variants["thumb"]) as file:
+            self.assertEqual(Image.open(file).size, (64, 32))
+        with default_storage.open(variants["card_webp"]) as file:
+            image = Image.open(file)
+            self.assertEqual((image.format, image.size), ("WEBP", (320, 160)))
+
+        response = self.client.get(f"/api/products/{product.pk}/")
+        self.assertTrue(response.data["image_thumb"].endswith(variants["thumb"]))
+        self.assertTrue(response.data["image_card_webp"].endswith(variants["card_webp"]))
+        self.assertNotIn("image_variants", response.data)
+
+    def test_rendering_changes_the_etags(self):
+        product = Product.objects.create(name="زيت", price=1, image=self.upload())
+        paths = ["/api/products/", f"/api/products/{product.pk}/"]
+        etags = {path: self.client.get(path)["ETag"] for path in paths}
+        with self.captureOnCommitCallbacks(execute=True):
+            generate_variants(product.pk)
+        for path in paths:
+            response = self.client.get(path, HTTP_IF_NONE_MATCH=etags[path])
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response["ETag"], etags[path])
+
+    def test_replaced_images_are_rendered_again(self):
+        product = Product.objects.create(name="زيت", price=1, image=self.upload())
+        generate_variants(product.pk)
+        product.refresh_from_db()
+        self.assertIsNone(generate_variants(product.pk))
+
+        product.image = self.upload(name="new.png")
+        product.save()
+        self.assertFalse(variants_are_current(product))
+        self.assertTrue(Job.objects.filter(
+            name=generate_variants.job_name, kwargs={"product_pk": product.pk}, status=Job.QUEUED).exists())
+        self.assertNotEqual(generate_variants(product.pk)["source"], product.image_variants["source"])
+
+    async def test_reads_serve_the_original_without_queueing(self):
+        product = await sync_to_async(Product.objects.create)(name="زيت", price=1, image=self.upload())
+        await Job.objects.all().adelete()
+        token = await Token.objects.acreate(user=self.staff)
+        response = await self.async_client.get("/api/async/products/", headers={"Authorization": f"Token {token.key}"})
+        self.assertEqual(response.status_code, 200)
+        result = response.json()["results"][0]
+        self.assertEqual((result["id"], result["image_thumb"]), (product.pk, result["image"]))
+
+        response = await sync_to_async(self.client.get)(f"/api/products/{product.pk}/")
+        self.assertEqual(response.data["image_card_webp"], response.data["image"])
+        self.assertFalse(await Job.objects.aexists())
+
+    def test_backfill_command_can_queue_the_rendering(self):
+        product = Product.objects.create(name="زيت", price=1, image=self.upload())
+        Job.objects.all().delete()
+        out = StringIO()
+        call_command("build_image_variants", "--queue", stdout=out)
+        self.assertIn("Queued the variants of 1 images", out.getvalue())
+        self.assertEqual(list(Job.objects.values_list("kwargs", flat=True)), [{"product_pk": product.pk}])
 
-# Create your tests here.
+    def test_backfill_command(self):
+        products = [Product.objects.create(name=f"p{i}", price=1, image=self.upload()) for i in range(3)]
+        Product.objects.create(name="no image", price=1)
+        etag = self.client.get("/api/products/")["ETag"]
+        call_command("build_image_variants", "--workers", "2", stdout=StringIO())
+        self.assertEqual(self.client.get("/api/products/", HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        for product in products:
+            product.refresh_from_db()
+            self.assertTrue(variants_are_current(product))
+            self.assertTrue(default_storage.exists(product.image_variants["thumb_webp"]))
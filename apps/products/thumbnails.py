@@ -0,0 +1,99 @@
+"""
+Resized and compressed variants of `Product.image` for the list icons and cards of the tablets.
+
+The variants are rendered with Pillow off the request path: a product saved with a new image queues
+a background job (see `apps.jobs`), and `build_image_variants` backfills the existing media in parallel processes
+or queues it for the workers. Reads never queue anything, they serve the original image meanwhile.
+`Product.image_variants` maps every variant to its file and records the image they were made from,
+so a replaced image is detected without touching the storage: reads fall back to the original until the job
+queued by the save that replaced it has rendered the new variants.
+"""
+import hashlib
+import posixpath
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from apps.jobs.queue import task
+
+# name: (longest side in px, Pillow format, file extension)
+VARIANTS = {
+    "thumb": (64, "JPEG", "jpg"),
+    "card": (320, "JPEG", "jpg"),
+    "thumb_webp": (64, "WEBP", "webp"),
+    "card_webp": (320, "WEBP", "webp"),
+}
+QUALITY = 80
+VARIANTS_DIR = "products/variants"
+
+def variant_name(image_name, variant):
+    """
+    Storage name of a variant, it changes with the image so browsers never keep a stale variant
+    """
+    stem = posixpath.splitext(posixpath.basename(image_name))[0]
+    digest = hashlib.md5(image_name.encode()).hexdigest()[:8]
+    return f"{VARIANTS_DIR}/{stem}-{digest}-{variant}.{VARIANTS[variant][2]}"
+
+
+def render_variants(image_name, storage=default_storage):
+    """
+    Render and store every variant of `image_name`, returns the `Product.image_variants` value.
+    Does not use the database, so it can run in a worker process.
+    """
+    with storage.open(image_name, "rb") as file:
+        image = ImageOps.exif_transpose(Image.open(file))
+        image.load()
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "transparency" in image.info or image.mode in ("LA", "PA") else "RGB")
+
+    variants = {"source": image_name}
+    for variant, (size, image_format, _) in VARIANTS.items():
+        resized = image.copy()
+        resized.thumbnail((size, size), Image.LANCZOS)
+        if image_format == "JPEG" and resized.mode == "RGBA":
+            background = Image.new("RGB", resized.size, "white")
+            background.paste(resized, mask=resized.getchannel("A"))
+            resized = background
+        buffer = BytesIO()
+        resized.save(buffer, image_format, quality=QUALITY, optimize=True)
+        name = variant_name(image_name, variant)
+        if storage.exists(name):
+            storage.delete(name)
+        variants[variant] = storage.save(name, ContentFile(buffer.getvalue()))
+    return variants
+
+
+def variants_are_current(product):
+    return bool(product.image) and product.image_variants.get("source") == product.image.name
+
+
+@task(priority=-1)
+def generate_variants(product_pk):
+    """
+    Render the variants of a product and store them on it, unless they are current already
+    """
+    from apps.products.cache import bump_catalog_version
+    from apps.products.models import Product
+
+    product = Product.objects.filter(pk=product_pk).only("image", "image_variants").first()
+    if product is None or not product.image or variants_are_current(product):
+        return None
+    variants = render_variants(product.image.name)
+    # Only store them if the image was not replaced in the meantime, `updated_at` changes the ETag of the product
+    Product.objects.filter(pk=product_pk, image=variants["source"]).update(
+        image_variants=variants, updated_at=timezone.now())
+    bump_catalog_version()
+    return variants
+
+
+def schedule_variants(product):
+    """
+    Queue the rendering of the variants of `product` with the current transaction, on save or by the backfill.
+    A product already waiting for its variants is not queued twice.
+    """
+    if not product.image or variants_are_current(product):
+        return
+    generate_variants.enqueue(product_pk=product.pk, unique=True)
@@ -1,10 +1,12 @@
 from django.contrib.auth import get_user_model
+from django.db import transaction
 from rest_framework import permissions, status
 from rest_framework import viewsets
 from rest_framework.response import Response
 
-from apps.orders.models import UserBalance
+from apps.orders.models import UserBalance, DailySalesRollup
 from apps.users.api.serializers import UserSerializer
+from config.pagination import OffsetOrCursorPagination
 
 
 class UserViewSet(viewsets.ModelViewSet):
@@ -12,10 +14,16 @@ class UserViewSet(viewsets.ModelViewSet):
     serializer_class = UserSerializer
     permission_classes = [permissions.IsAuthenticated]
     search_fields = ['username', 'email', "first_name", ]
+    pagination_class = OffsetOrCursorPagination
+    ordering = ("-date_joined", "-id")
+    query_budgets = {"list": 3, "retrieve": 3}
+
     def destroy(self, request, *args, **kwargs):
         instance = self.get_object()
-        instance.deleted = True
-        instance.save()
+        with transaction.atomic():
+            instance.deleted = True
+            instance.save()
+            DailySalesRollup.record_user(instance, sign=-1)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     def get_object(self):
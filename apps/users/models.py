@@ -17,9 +17,16 @@ class CustomUser(AbstractUser):
                                   error_messages={
                                       'unique': _("يوجد مستخدم بنفس الاسم بالفعل."),
                                   })
+    # Part of the validators of the orders embedding the user, see `OrderViewSet.last_modified_fields`
+    updated_at = models.DateTimeField(auto_now=True)
 
 
 
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            models.Index(fields=["date_joined", "id"], name="user_date_joined_id_idx"),
+        ]
+
     def save(self, *args, **kwargs):
         if not self.username:
             self.username = generate_username()
@@ -0,0 +1,24 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from config.authentication import forget_token, forget_user
+from .models import CustomUser
+
+
+@receiver([post_save, post_delete], sender=CustomUser)
+def forget_cached_user(sender, instance, raw=False, **kwargs):
+    """
+    Signal to drop the cached authenticated user when it is saved, soft deleted or deleted
+    """
+    if not raw:
+        forget_user(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Token)
+def forget_cached_token(sender, instance, raw=False, **kwargs):
+    """
+    Signal to drop the cached token when it is revoked
+    """
+    if not raw:
+        forget_token(instance.key)
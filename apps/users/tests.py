@@ -1,3 +1,70 @@
+from django.contrib.auth import get_user_model
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
 
-# Create your tests here.
+from config.authentication import get_auth_cache, get_cached_user
+
+
+class CachedAuthenticationTests(TestCase):
+    def setUp(self):
+        get_auth_cache().clear()
+        User = get_user_model()
+        self.staff = User.objects.create(username="staff", first_name="staff", is_staff=True)
+        self.customer = User.objects.create(username="customer", first_name="customer")
+        self.token = Token.objects.create(user=self.staff)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+
+    def get(self, path="/api/users/"):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(path)
+        return response, [query["sql"] for query in ctx.captured_queries]
+
+    def test_token_users_are_cached(self):
+        response, first = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(any("authtoken_token" in sql for sql in first))
+
+        response, second = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(second), len(first) - 1)
+        self.assertFalse(any("authtoken_token" in sql for sql in second))
+
+    def test_jwt_users_are_cached(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(self.staff).access_token}")
+        response, first = self.get()
+        self.assertEqual(response.status_code, 200)
+        response, second = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(second), len(first) - 1)
+
+    def test_revoked_tokens_are_rejected(self):
+        self.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.token.delete()
+        response, _ = self.get()
+        self.assertEqual(response.status_code, 401)
+
+    def test_saved_users_are_loaded_again(self):
+        self.get()
+        self.staff.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.staff.save()
+        response, _ = self.get()
+        self.assertEqual(response.status_code, 401)
+
+    def test_soft_deleted_users_are_forgotten(self):
+        Token.objects.create(user=self.customer)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.customer.auth_token.key}")
+        self.get()
+        self.assertIsNotNone(get_cached_user(self.customer.pk))
+
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(f"/api/users/{self.customer.pk}/")
+        self.assertEqual(response.status_code, 204)
+        self.assertIsNone(get_cached_user(self.customer.pk))
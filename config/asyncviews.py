@@ -0,0 +1,50 @@
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponse
+from django.views import View
+from rest_framework import exceptions, status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+
+class AsyncAPIView(View):
+    """
+    Read only JSON view running natively under ASGI: the handlers are coroutines using the async ORM,
+    so a slow client or query does not hold a worker thread for the whole request.
+    Responses have the same shape as the DRF views they mirror, the serializers are reused on
+    objects that are fully loaded beforehand (an unexpected query raises `SynchronousOnlyOperation`).
+    """
+    http_method_names = ["get", "head", "options"]
+    authentication_classes = api_settings.DEFAULT_AUTHENTICATION_CLASSES
+    pagination_class = api_settings.DEFAULT_PAGINATION_CLASS
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.request = Request(request, authenticators=[auth() for auth in self.authentication_classes])
+        try:
+            # The token and JWT authentication classes look the user up with the sync ORM
+            user = await sync_to_async(lambda: self.request.user)()
+            if not user or not user.is_authenticated:
+                raise exceptions.NotAuthenticated()
+            return await super().dispatch(self.request, *args, **kwargs)
+        except exceptions.APIException as e:
+            return self.render({"detail": e.detail}, status=e.status_code)
+        except Http404:
+            return self.render({"detail": exceptions.NotFound.default_detail}, status=status.HTTP_404_NOT_FOUND)
+
+    def render(self, data, status=status.HTTP_200_OK):
+        return HttpResponse(JSONRenderer().render(data), content_type="application/json", status=status)
+
+    def serialize(self, instance, many=False):
+        return self.serializer_class(instance, many=many, context={"request": self.request, "view": self}).data
+
+    async def paginate(self, queryset):
+        """
+        The paginated response data of `queryset`, with the limit and offset parameters of `pagination_class`
+        """
+        paginator = self.pagination_class()
+        paginator.request = self.request
+        paginator.limit = paginator.get_limit(self.request)
+        paginator.offset = paginator.get_offset(self.request)
+        paginator.count = await queryset.acount()
+        page = [obj async for obj in queryset[paginator.offset:paginator.offset + paginator.limit]]
+        return paginator.get_paginated_response(self.serialize(page, many=True)).data
@@ -0,0 +1,99 @@
+"""
+Token and JWT authentication resolving the user from the `auth` cache instead of the database.
+
+A token key maps to its user pk and a user pk to the user, both for `AUTH_CACHE_TIMEOUT` seconds,
+so an authenticated request usually runs no query before the view. Entries are deleted once the
+transaction saving or deleting a user (including the soft delete) or deleting a token commits.
+Changes made with `QuerySet.update()` or by another process are only seen after the timeout.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+
+def get_auth_cache():
+    return caches["auth"]
+
+
+def user_cache_key(pk):
+    return f"auth:user:{pk}"
+
+
+def token_cache_key(key):
+    # The keys are credentials, they are not written to the cache as is
+    return f"auth:token:{hashlib.sha256(key.encode()).hexdigest()}"
+
+
+def get_cached_user(pk):
+    return get_auth_cache().get(user_cache_key(pk))
+
+
+def cache_user(user, token_key=None):
+    values = {user_cache_key(user.pk): user}
+    if token_key is not None:
+        values[token_cache_key(token_key)] = user.pk
+    get_auth_cache().set_many(values, settings.AUTH_CACHE_TIMEOUT)
+
+
+def get_token_user(key):
+    """
+    The user of the API token `key`, raises `AuthenticationFailed` for an unknown key or an inactive user
+    """
+    cache = get_auth_cache()
+    user_pk = cache.get(token_cache_key(key))
+    user = get_cached_user(user_pk) if user_pk is not None else None
+    if user is None:
+        try:
+            user = Token.objects.select_related("user").get(key=key).user
+        except Token.DoesNotExist:
+            raise exceptions.AuthenticationFailed(_("Invalid token."))
+        cache_user(user, key)
+    if not user.is_active:
+        raise exceptions.AuthenticationFailed(_("User inactive or deleted."))
+    return user
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    def authenticate_credentials(self, key):
+        user = get_token_user(key)
+        return user, Token(key=key, user=user)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        user_id = validated_token.get(jwt_settings.USER_ID_CLAIM)
+        user = get_cached_user(user_id) if user_id is not None else None
+        if user is None:
+            user = super().get_user(validated_token)
+            cache_user(user)
+            return user
+
+        # The checks of `JWTAuthentication.get_user`, on the cached user
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        if jwt_settings.CHECK_REVOKE_TOKEN and validated_token.get(
+                jwt_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+            raise exceptions.AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+        return user
+
+
+def forget_user(pk):
+    """
+    Drop the cached user once the current transaction commits, see `apps.users.signals`
+    """
+    cache_key = user_cache_key(pk)
+    transaction.on_commit(lambda: get_auth_cache().delete(cache_key))
+
+
+def forget_token(key):
+    cache_key = token_cache_key(key)
+    transaction.on_commit(lambda: get_auth_cache().delete(cache_key))
@@ -0,0 +1,80 @@
+"""
+Push of stock and balance changes to the WebSocket clients, see `config.consumers`.
+
+Writes record the changed product or user pks, and the changes of a transaction are sent once it commits
+as a single batch holding the current values, so a 40 line order gives one message and not 40.
+The batch goes to the `CHANGES_GROUP` channel layer group, every consumer forwards the part its client subscribed to.
+"""
+import threading
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+CHANGES_GROUP = "changes"
+
+_local = threading.local()
+
+
+class ChangeBatch:
+    def __init__(self, using):
+        self.using = using
+        self.products = set()
+        self.users = set()
+
+    def send(self):
+        channel_layer = get_channel_layer()
+        if channel_layer is None:
+            return
+        from apps.orders.models import UserBalance
+        from apps.products.models import Product
+
+        products = [
+            {**product, "price": float(product["price"])}
+            for product in Product.objects.using(self.using).filter(pk__in=self.products)
+            .values("id", "brand_id", "stock", "price", "deleted")
+        ] if self.products else []
+        balances = []
+        for balance in UserBalance.objects.using(self.using).with_pending().filter(user_id__in=self.users):
+            values = balance.balances()
+            balances.append({
+                "user": balance.user_id,
+                "orders_total": float(values["orders_total"]),
+                "paid_amount": float(values["paid_amount"]),
+                "amount_to_pay": float(values["orders_total"] - values["paid_amount"]),
+            })
+        async_to_sync(channel_layer.group_send)(CHANGES_GROUP, {
+            "type": "changes.batch",
+            "products": products,
+            "balances": balances,
+        })
+
+
+def _record(kind, pks, using):
+    using = using or DEFAULT_DB_ALIAS
+    connection = connections[using]
+    batches = getattr(_local, "batches", None)
+    if batches is None:
+        batches = _local.batches = {}
+
+    batch = batches.get(using)
+    # The batch is pending until its transaction commits, or is dropped by a (savepoint) rollback
+    if connection.in_atomic_block and batch is not None and any(
+            func == batch.send for _, func, _ in connection.run_on_commit):
+        getattr(batch, kind).update(pks)
+        return
+
+    batch = ChangeBatch(using)
+    getattr(batch, kind).update(pks)
+    if connection.in_atomic_block:
+        batches[using] = batch
+    # Sent right away in autocommit mode, a failing channel layer must not fail the committed write
+    transaction.on_commit(batch.send, using=using, robust=True)
+
+
+def record_product_changes(pks, using=None):
+    _record("products", pks, using)
+
+
+def record_balance_changes(user_pks, using=None):
+    _record("users", user_pks, using)
@@ -0,0 +1,63 @@
+import hashlib
+
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Max
+from django.http import Http404
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+class ConditionalGetMixin:
+    """
+    Conditional GET (`If-None-Match` / `If-Modified-Since`) for list and retrieve.
+    The validator is computed with one aggregate query over `last_modified_fields` (plus the row count for lists),
+    and a matching request gets `304 Not Modified` before anything is fetched or serialized.
+    Lists only send an `ETag`: a `Last-Modified` date alone cannot tell that a row was removed.
+    """
+    last_modified_fields = ("updated_at",)
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        return self.conditional_response(queryset, super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            queryset = self.filter_queryset(self.get_queryset()).filter(
+                **{self.lookup_field: self.kwargs[lookup_url_kwarg]}
+            )
+        except (TypeError, ValueError, ValidationError):
+            # A malformed pk, as in DRF's `get_object_or_404`
+            raise Http404
+        return self.conditional_response(queryset, super().retrieve, request, *args, **kwargs, detail=True)
+
+    def get_validators(self, queryset, detail):
+        aggregates = {field: Max(field) for field in self.last_modified_fields}
+        aggregates["rows"] = Count("pk", distinct=True)
+        values = queryset.aggregate(**aggregates)
+        if not values["rows"]:
+            return None, None
+
+        last_modified = max(values[field] for field in self.last_modified_fields if values[field] is not None)
+        raw = f"{self.request.get_full_path()}:{values['rows']}:" + ":".join(
+            str(values[field]) for field in self.last_modified_fields)
+        etag = quote_etag(hashlib.md5(raw.encode()).hexdigest())
+        # HTTP dates have a one second precision
+        return etag, int(last_modified.timestamp()) if detail else None
+
+    def conditional_response(self, queryset, handler, request, *args, detail=False, **kwargs):
+        etag, last_modified = self.get_validators(queryset, detail)
+        if etag is None:
+            return handler(request, *args, **kwargs)
+
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            not_modified["ETag"] = etag
+            return not_modified
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            response["ETag"] = etag
+            if last_modified is not None:
+                response["Last-Modified"] = http_date(last_modified)
+        return response
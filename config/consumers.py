@@ -0,0 +1,75 @@
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from channels.middleware import BaseMiddleware
+from django.contrib.auth.models import AnonymousUser
+from rest_framework.exceptions import AuthenticationFailed
+
+from config.authentication import get_token_user
+from config.changes import CHANGES_GROUP
+
+
+@database_sync_to_async
+def get_scope_user(key):
+    try:
+        return get_token_user(key)
+    except AuthenticationFailed:
+        return AnonymousUser()
+
+
+class TokenAuthMiddleware(BaseMiddleware):
+    """
+    Authenticate WebSocket connections with the API token given as `?token=`,
+    browsers can not set an `Authorization` header on a WebSocket.
+    """
+
+    async def __call__(self, scope, receive, send):
+        key = parse_qs(scope.get("query_string", b"").decode()).get("token", [None])[0]
+        scope["user"] = await get_scope_user(key) if key else AnonymousUser()
+        return await super().__call__(scope, receive, send)
+
+
+class ChangesConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Pushes stock and balance changes instead of polling `/api/products/` and `/api/user-balance/`.
+    The client sends `{"action": "subscribe" | "unsubscribe", "products": [...], "brands": [...], "users": [...]}`
+    and receives one `{"type": "changes", "products": [...], "balances": [...]}` message per committed
+    transaction touching its subscriptions, see `config.changes`.
+    """
+    groups = [CHANGES_GROUP]
+    subscription_kinds = ("products", "brands", "users")
+
+    async def connect(self):
+        user = self.scope.get("user")
+        if user is None or not user.is_authenticated:
+            await self.close(code=4401)
+            return
+        self.subscriptions = {kind: set() for kind in self.subscription_kinds}
+        await self.accept()
+
+    async def receive_json(self, content, **kwargs):
+        action = content.get("action") if isinstance(content, dict) else None
+        if action not in ("subscribe", "unsubscribe"):
+            await self.send_json({"type": "error", "error": "action must be subscribe or unsubscribe"})
+            return
+        for kind in self.subscription_kinds:
+            try:
+                pks = {int(pk) for pk in content.get(kind, [])}
+            except (TypeError, ValueError):
+                await self.send_json({"type": "error", "error": f"{kind} must be a list of ids"})
+                return
+            if action == "subscribe":
+                self.subscriptions[kind] |= pks
+            else:
+                self.subscriptions[kind] -= pks
+        await self.send_json({"type": "subscriptions", **{kind: sorted(pks) for kind, pks in self.subscriptions.items()}})
+
+    async def changes_batch(self, event):
+        products = [
+            product for product in event["products"]
+            if product["id"] in self.subscriptions["products"] or product["brand_id"] in self.subscriptions["brands"]
+        ]
+        balances = [balance for balance in event["balances"] if balance["user"] in self.subscriptions["users"]]
+        if products or balances:
+            await self.send_json({"type": "changes", "products": products, "balances": balances})
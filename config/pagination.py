@@ -0,0 +1,57 @@
+from rest_framework.pagination import BasePagination, CursorPagination, LimitOffsetPagination
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination ordered by the view's `ordering`, e.g. ("-created_at", "-id").
+    Pages are fetched with an indexed `WHERE created_at < cursor` instead of `OFFSET n`,
+    and without the `COUNT(*)` of the offset pagination, so deep pages cost the same as the first one.
+    """
+    page_size_query_param = "limit"
+    max_page_size = 200
+
+    def get_ordering(self, request, queryset, view):
+        self.ordering = getattr(view, "ordering", None) or self.ordering
+        return super().get_ordering(request, queryset, view)
+
+
+class OffsetOrCursorPagination(BasePagination):
+    """
+    Offset pagination by default so existing clients keep working,
+    keyset pagination when the request asks for it with `?pagination=cursor` or carries a `cursor`.
+    """
+    cursor_query_param = "cursor"
+    mode_query_param = "pagination"
+
+    def __init__(self):
+        self.offset_paginator = LimitOffsetPagination()
+        self.cursor_paginator = KeysetPagination()
+        self.paginator = self.offset_paginator
+
+    def use_cursor(self, request):
+        return (request.query_params.get(self.mode_query_param) == "cursor"
+                or self.cursor_query_param in request.query_params)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.paginator = self.cursor_paginator if self.use_cursor(request) else self.offset_paginator
+        return self.paginator.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        return self.paginator.get_paginated_response_schema(schema)
+
+    def get_schema_operation_parameters(self, view):
+        return (self.offset_paginator.get_schema_operation_parameters(view)
+                + self.cursor_paginator.get_schema_operation_parameters(view))
+
+    @property
+    def display_page_controls(self):
+        return self.paginator.display_page_controls
+
+    def to_html(self):
+        return self.paginator.to_html()
+
+    def get_results(self, data):
+        return data["results"]
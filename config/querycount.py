@@ -0,0 +1,137 @@
+import json
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger("config.querycount")
+
+DEFAULT_REPEAT_THRESHOLD = 5
+
+
+def fingerprint(sql):
+    """
+    The shape of a query: literals and the length of IN lists are removed,
+    so the queries of an N+1 loop all share one fingerprint.
+    """
+    sql = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    sql = re.sub(r"\b\d+(?:\.\d+)?\b", "?", sql)
+    sql = re.sub(r"(%s|\?)(?:\s*,\s*(%s|\?))+", "...", sql)
+    return re.sub(r"\s+", " ", sql).strip()
+
+
+class QueryStats:
+    """
+    Counts the queries run on every database connection while used as a context manager,
+    with their total duration and how many times every query shape ran.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+        self._stack = None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+
+    def repeated(self, threshold=None):
+        """
+        The query shapes that ran more than `threshold` times, most repeated first.
+        """
+        if threshold is None:
+            threshold = getattr(settings, "QUERY_REPEAT_THRESHOLD", DEFAULT_REPEAT_THRESHOLD)
+        return [(sql, count) for sql, count in self.fingerprints.most_common() if count > threshold]
+
+
+def get_query_budget(view, action):
+    """
+    The budget a viewset declares for an action in `query_budgets`, or None.
+    """
+    return getattr(view, "query_budgets", {}).get(action)
+
+
+class QueryCountMiddleware:
+    """
+    Opt-in middleware reporting the queries of every request: a `Server-Timing` header with the database time,
+    a structured log line, and a warning when a query shape repeats more than `QUERY_REPEAT_THRESHOLD` times
+    or a viewset goes over its `query_budgets`.
+    The queries of a streaming response run after the middleware and are not counted.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        with QueryStats() as stats:
+            response = self.get_response(request)
+        total = time.perf_counter() - start
+
+        response["Server-Timing"] = (
+            f'db;dur={stats.duration * 1000:.2f};desc="{stats.count} queries", app;dur={total * 1000:.2f}'
+        )
+
+        match = request.resolver_match
+        view = getattr(response, "renderer_context", {}).get("view")
+        action = getattr(view, "action", None)
+        record = {
+            "method": request.method,
+            "path": request.path,
+            "view": match.view_name if match else None,
+            "action": action,
+            "status": response.status_code,
+            "queries": stats.count,
+            "db_ms": round(stats.duration * 1000, 2),
+            "total_ms": round(total * 1000, 2),
+        }
+        logger.info(json.dumps(record))
+
+        repeated = stats.repeated()
+        if repeated:
+            logger.warning(json.dumps({**record, "repeated": [{"sql": sql, "count": count} for sql, count in repeated]}))
+        budget = get_query_budget(view, action)
+        if budget is not None and stats.count > budget:
+            logger.warning(json.dumps({**record, "budget": budget}))
+        return response
+
+
+class QueryBudgetTestMixin:
+    """
+    Test case helpers failing when a request goes over the `query_budgets` of its viewset
+    or runs the same query shape more than `QUERY_REPEAT_THRESHOLD` times.
+    """
+
+    def assertWithinQueryBudget(self, method, path, data=None, **extra):
+        with QueryStats() as stats:
+            response = getattr(self.client, method)(path, data, **extra)
+        view = response.renderer_context["view"]
+        budget = get_query_budget(view, view.action)
+        self.assertIsNotNone(budget, f"{type(view).__name__} has no query budget for {view.action}")
+        self.assertLessEqual(
+            stats.count, budget, f"{method.upper()} {path} ran {stats.count} queries, the budget is {budget}")
+        self.assertNoRepeatedQueries(stats)
+        return response
+
+    def assertNoRepeatedQueries(self, stats):
+        repeated = stats.repeated()
+        self.assertFalse(repeated, "Repeated queries:\n" + "\n".join(f"{count}x {sql}" for sql, count in repeated))
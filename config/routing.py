@@ -0,0 +1,7 @@
+from django.urls import path
+
+from config.consumers import ChangesConsumer
+
+websocket_urlpatterns = [
+    path("ws/changes/", ChangesConsumer.as_asgi()),
+]
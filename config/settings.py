@@ -11,10 +11,12 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 import asyncio
 import datetime
+import os
 from pathlib import Path
 from uuid import uuid4
 
 import django
+from django.core.exceptions import ImproperlyConfigured
 from django.utils.encoding import force_str, smart_str
 from django.utils.translation import gettext, gettext_lazy
 
@@ -63,6 +65,7 @@ INSTALLED_APPS = [
     "apps.users",
     "apps.products",
     "apps.orders",
+    "apps.jobs",
 
 ]
 
@@ -79,6 +82,13 @@ MIDDLEWARE = [
 
 ]
 
+# Report the queries of every request (Server-Timing header and log lines), see `config.querycount`
+if os.environ.get("QUERY_STATS"):
+    MIDDLEWARE.insert(0, "config.querycount.QueryCountMiddleware")
+
+# A query shape running more than this many times in one request is reported as an N+1
+QUERY_REPEAT_THRESHOLD = int(os.environ.get("QUERY_REPEAT_THRESHOLD", 5))
+
 ROOT_URLCONF = 'config.urls'
 
 TEMPLATES = [
@@ -102,13 +112,107 @@ WSGI_APPLICATION = 'config.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# Selected with DATABASE_PROFILE, compare them with `manage.py benchmark_database`:
+#   "sqlite" (default): the SQLite file in WAL mode, readers are not blocked by the writer
+#   "sqlite-plain": the SQLite file with the default rollback journal, every write blocks the readers
+#   "postgres": PostgreSQL (needs psycopg) with persistent connections, or pooled by PgBouncer with POSTGRES_POOLER
+DATABASE_PROFILE = os.environ.get("DATABASE_PROFILE", "sqlite")
+SQLITE_PATH = os.environ.get("SQLITE_PATH", str(BASE_DIR / "db.sqlite3"))
+
+SQLITE_PRAGMAS = [
+    "PRAGMA journal_mode = WAL",
+    # Wait for the write lock instead of failing with "database is locked"
+    "PRAGMA busy_timeout = 10000",
+    # Safe in WAL mode: a crash of the app loses nothing, a power loss may lose the last commits
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA cache_size = -65536",
+    "PRAGMA temp_store = MEMORY",
+]
+
+if DATABASE_PROFILE == "sqlite":
+    DATABASES = {
+        "default": {
+            "ENGINE": "config.sqlite3",
+            "NAME": SQLITE_PATH,
+            "OPTIONS": {"init_command": ";".join(SQLITE_PRAGMAS), "transaction_mode": "IMMEDIATE"},
+            # The PRAGMAs and the page cache are kept between requests
+            "CONN_MAX_AGE": int(os.environ.get("CONN_MAX_AGE", 600)),
+            "CONN_HEALTH_CHECKS": True,
+        }
+    }
+elif DATABASE_PROFILE == "sqlite-plain":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": SQLITE_PATH,
+        }
     }
+elif DATABASE_PROFILE == "postgres":
+    POSTGRES_POOLER = os.environ.get("POSTGRES_POOLER", "")
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.environ.get("POSTGRES_DB", "alhashimi"),
+            "USER": os.environ.get("POSTGRES_USER", "postgres"),
+            "PASSWORD": os.environ.get("POSTGRES_PASSWORD", ""),
+            "HOST": os.environ.get("POSTGRES_HOST", "localhost"),
+            "PORT": os.environ.get("POSTGRES_PORT", "6432" if POSTGRES_POOLER else "5432"),
+            "OPTIONS": {"connect_timeout": 5},
+            # Without a pooler the connections are kept between requests and checked before they are reused,
+            # PgBouncer already keeps the server connections open so every request gives its connection back
+            "CONN_MAX_AGE": int(os.environ.get("CONN_MAX_AGE", 0 if POSTGRES_POOLER else 600)),
+            "CONN_HEALTH_CHECKS": True,
+            # PgBouncer in transaction mode can not keep a cursor open across transactions (`iterator()`)
+            "DISABLE_SERVER_SIDE_CURSORS": POSTGRES_POOLER == "transaction",
+        }
+    }
+else:
+    raise ImproperlyConfigured(f"Unknown DATABASE_PROFILE: {DATABASE_PROFILE}")
+
+
+# ==============================================================================
+# CACHE SETTINGS
+# ==============================================================================
+
+# Backend of the product catalog response cache: "locmem" (per process) or "file" (shared by the workers)
+CATALOG_CACHE_BACKEND = os.environ.get("CATALOG_CACHE_BACKEND", "locmem")
+# Backend of the order series buckets, "file" shares their invalidation between the workers
+ANALYTICS_CACHE_BACKEND = os.environ.get("ANALYTICS_CACHE_BACKEND", CATALOG_CACHE_BACKEND)
+# Seconds a series bucket is cached, also the longest another "locmem" worker serves an invalidated bucket
+ANALYTICS_CACHE_TIMEOUT = int(os.environ.get("ANALYTICS_CACHE_TIMEOUT", 10 * 60))
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "catalog": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.environ.get("CATALOG_CACHE_LOCATION", str(BASE_DIR / "tmp" / "catalog-cache")),
+        "TIMEOUT": 60 * 60,
+    } if CATALOG_CACHE_BACKEND == "file" else {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "catalog",
+        "TIMEOUT": 60 * 60,
+    },
+    "analytics": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.environ.get("ANALYTICS_CACHE_LOCATION", str(BASE_DIR / "tmp" / "analytics-cache")),
+        "TIMEOUT": ANALYTICS_CACHE_TIMEOUT,
+    } if ANALYTICS_CACHE_BACKEND == "file" else {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "analytics",
+        "TIMEOUT": ANALYTICS_CACHE_TIMEOUT,
+    },
+    "auth": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "auth",
+    },
 }
 
+# Seconds an authenticated user is cached, also the longest another process keeps using a changed user or token
+AUTH_CACHE_TIMEOUT = int(os.environ.get("AUTH_CACHE_TIMEOUT", 30))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -167,8 +271,9 @@ REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
         # "rest_framework.authentication.BasicAuthentication",
         # "rest_framework.authentication.SessionAuthentication",
-        "rest_framework.authentication.TokenAuthentication",
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        # The authenticated users are cached, see `config.authentication`
+        "config.authentication.CachedTokenAuthentication",
+        "config.authentication.CachedJWTAuthentication",
     ],
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.IsAuthenticated",
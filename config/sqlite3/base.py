@@ -0,0 +1,29 @@
+"""
+SQLite backend of the "sqlite" database profile, with the connection options Django 5.1 added:
+
+- `init_command`: statements run on every new connection, `;` separated, used for the PRAGMAs.
+- `transaction_mode`: "DEFERRED", "IMMEDIATE" or "EXCLUSIVE", how atomic blocks begin.
+  With "IMMEDIATE" a write transaction takes the write lock when it starts and waits for it
+  with `busy_timeout`, instead of failing with "database is locked" when it upgrades a read lock.
+"""
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        self.init_command = params.pop("init_command", "")
+        self.transaction_mode = params.pop("transaction_mode", None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for statement in self.init_command.split(";"):
+            if statement.strip():
+                conn.execute(statement)
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        if self.transaction_mode is None:
+            return super()._start_transaction_under_autocommit()
+        self.cursor().execute(f"BEGIN {self.transaction_mode}")
@@ -20,7 +20,10 @@ from django.contrib import admin
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 
-from apps.orders.api.viewsets import OrderViewSet, UserBalanceViewSet, OrderAnalyticsView, UserBalanceNoteViewSet
+from apps.orders.api.async_views import AsyncOrderListView, AsyncOrderDetailView, AsyncOrderAnalyticsView
+from apps.orders.api.viewsets import OrderViewSet, UserBalanceViewSet, OrderAnalyticsView, UserBalanceNoteViewSet, \
+    OrderSeriesAnalyticsView, ExportView
+from apps.products.api.async_views import AsyncProductListView
 from apps.products.api.viewsets import ProductViewSet, BrandViewSet
 from apps.users.api.viewsets import UserViewSet
 
@@ -36,6 +39,13 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include(router.urls)),
     path('api/orders-analytics/', OrderAnalyticsView.as_view(), name='today-order-analytics'),
+    path('api/orders-analytics/series/', OrderSeriesAnalyticsView.as_view(), name='order-analytics-series'),
+    path('api/exports/<str:dataset>/', ExportView.as_view(), name='exports'),
+    # Native async read paths for the ASGI deployment
+    path('api/async/products/', AsyncProductListView.as_view(), name='async-products'),
+    path('api/async/orders/', AsyncOrderListView.as_view(), name='async-orders'),
+    path('api/async/orders/<int:pk>/', AsyncOrderDetailView.as_view(), name='async-order-detail'),
+    path('api/async/orders-analytics/', AsyncOrderAnalyticsView.as_view(), name='async-order-analytics'),
     path('api-auth/', include('rest_framework.urls', namespace='rest_framework')),
     path('api/authentication/', include('dj_rest_auth.urls')),
     path('api/authentication/registration/', include('dj_rest_auth.registration.urls')),